@@ -0,0 +1,123 @@
+# bench/db_bench.py
+"""
+Сравнивает пропускную способность db/db_data.py под конкурентной нагрузкой:
+старый вариант (connect() на каждый вызов, без индекса) против пула с WAL.
+
+    python -m bench.db_bench --tasks 50 --ops 40 --rows 2000
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import tempfile
+import time
+
+import aiosqlite
+
+from db import db_data
+
+
+async def _seed(path: str, rows: int, sources: int, content_len: int):
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute('''
+            CREATE TABLE site_data (
+                id INTEGER PRIMARY KEY AUTOINCREMENT,
+                source TEXT, title TEXT, content TEXT,
+                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+        ''')
+        body = "x" * content_len
+        await conn.executemany(
+            "INSERT INTO site_data (source, title, content) VALUES (?, ?, ?)",
+            [(f"src{i % sources}", f"t{i}", body) for i in range(rows)],
+        )
+        await conn.commit()
+
+
+# ── старый вариант: новое соединение (и поток) на каждый вызов ──
+async def _legacy_sources(path: str):
+    async with aiosqlite.connect(path) as conn:
+        cursor = await conn.execute("SELECT DISTINCT source FROM site_data")
+        return [row[0] for row in await cursor.fetchall()]
+
+async def _legacy_add(path: str, source: str):
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute(
+            "INSERT INTO site_data (source, title, content) VALUES (?, ?, ?)",
+            (source, "bench", "y" * 100),
+        )
+        await conn.commit()
+
+async def _legacy_delete(path: str, source: str):
+    async with aiosqlite.connect(path) as conn:
+        await conn.execute("DELETE FROM site_data WHERE source = ?", (source,))
+        await conn.commit()
+
+
+async def _run(tasks: int, ops: int, sources_fn, add_fn, delete_fn) -> dict:
+    latencies: list[float] = []
+
+    async def worker(n: int):
+        rnd = random.Random(n)
+        for i in range(ops):
+            started = time.perf_counter()
+            if rnd.random() < 0.9:
+                await sources_fn()
+            else:
+                src = f"bench{n}_{i}"
+                await add_fn(src)
+                await delete_fn(src)
+            latencies.append(time.perf_counter() - started)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker(n) for n in range(tasks)))
+    elapsed = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "ops": len(latencies),
+        "seconds": round(elapsed, 4),
+        "ops_per_sec": round(len(latencies) / elapsed, 1),
+        "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+        "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+    }
+
+
+async def main(args):
+    results = {"params": vars(args)}
+    with tempfile.TemporaryDirectory() as tmp:
+        legacy_path = os.path.join(tmp, "legacy.db")
+        await _seed(legacy_path, args.rows, args.sources, args.content_len)
+        results["legacy"] = await _run(
+            args.tasks, args.ops,
+            lambda: _legacy_sources(legacy_path),
+            lambda s: _legacy_add(legacy_path, s),
+            lambda s: _legacy_delete(legacy_path, s),
+        )
+
+        pooled_path = os.path.join(tmp, "pooled.db")
+        await _seed(pooled_path, args.rows, args.sources, args.content_len)
+        db_data.db = db_data.Database(pooled_path, readers=args.readers)
+        await db_data.init_db_documents()          # индекс по source
+        results["pooled"] = await _run(
+            args.tasks, args.ops,
+            db_data.get_all_sources,
+            lambda s: db_data.add_site_data(s, "bench", "y" * 100),
+            db_data.delete_site_data_by_source,
+        )
+        await db_data.close_db()
+
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark db/db_data.py")
+    parser.add_argument("--tasks", type=int, default=50, help="конкурентных «хэндлеров»")
+    parser.add_argument("--ops", type=int, default=40, help="операций на хэндлер")
+    parser.add_argument("--rows", type=int, default=2000)
+    parser.add_argument("--sources", type=int, default=20)
+    parser.add_argument("--content-len", type=int, default=20000)
+    parser.add_argument("--readers", type=int, default=db_data.READ_POOL_SIZE)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,135 @@
+# bench/quant_bench.py
+"""
+Качество и память компактного хранения NumpyVectorStore на корпусах data/:
+recall@k квантованного поиска (с точным пересчётом и без) относительно
+точного float32‑поиска, размер индекса в памяти и на диске.
+
+    python -m bench.quant_bench                 # эмбеддинги OpenAI (через кэш)
+    python -m bench.quant_bench --stub          # детерминированные векторы, без сети
+
+С --stub векторы случайные и не несут смысла текста: recall по ним говорит
+только о том, что код квантования и пересчёта работает, но не о ранжировании
+на настоящих данных. Поэтому int8 в боте по умолчанию выключен
+(VECTOR_INT8_UNVALIDATED, rag.config), пока прогон без --stub не покажет
+recall на эмбеддингах корпусов data/.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import random
+import resource
+import tempfile
+from pathlib import Path
+
+from rag.config import EMBEDDING_MODEL_NAME
+from rag.numpy_store import NumpyVectorStore
+from rag.vectorestore import _doc_id, _load_docs
+
+MODES = ("none", "float16", "int8")
+
+
+def _rss_mb() -> float:
+    with open("/proc/self/statm") as f:
+        return int(f.read().split()[1]) * resource.getpagesize() / 2**20
+
+
+def _corpus(data_dir: str, source: str):
+    rows = []
+    folder = os.path.join(data_dir, source)
+    for i, name in enumerate(sorted(os.listdir(folder))):
+        if name.endswith(".txt"):
+            with open(os.path.join(folder, name), encoding="utf-8") as f:
+                rows.append((i, source, os.path.splitext(name)[0], f.read()))
+    return _load_docs(rows)
+
+
+def _embedder(stub: bool, dim: int):
+    if stub:
+        from rag.stub_embeddings import fake_vector
+        return lambda texts: [fake_vector(t, dim) for t in texts]
+    from rag.embeddings import get_embeddings
+    return get_embeddings().embed_documents
+
+
+def _queries(docs, n: int, seed: int = 0):
+    """Вопрос‑суррогат: первое предложение случайного чанка."""
+    rnd = random.Random(seed)
+    picked = [rnd.choice(docs) for _ in range(n)]
+    return [d.page_content.split(".")[0][:200] for d in picked]
+
+
+def _bench_source(source: str, args, embed) -> dict:
+    docs = _corpus(args.data_dir, source)
+    vectors = embed([d.page_content for d in docs])
+    queries = embed(_queries(docs, args.queries))
+    result = {"chunks": len(docs), "dim": len(vectors[0])}
+
+    with tempfile.TemporaryDirectory() as tmp:
+        exact_top = None
+        for mode in MODES:
+            dir_ = Path(tmp) / mode
+            store = NumpyVectorStore(dir_, None, quantization=mode, rescore=args.rescore)
+            store.upsert([_doc_id(d) for d in docs], vectors,
+                         [d.metadata for d in docs], [d.page_content for d in docs])
+            store.flush()
+            del store
+
+            rss_before = _rss_mb()
+            store = NumpyVectorStore(dir_, None, quantization=mode, rescore=args.rescore)
+            tops = [
+                [_doc_id(doc) for doc, _ in store.similarity_search_by_vector_with_score(q, args.k)]
+                for q in queries
+            ]
+            stats = {
+                "index_mb": round(((store._codes.nbytes + store._scales.nbytes)
+                                   if store._codes is not None else store._matrix.nbytes) / 2**20, 3),
+                "disk_mb": round(sum(p.stat().st_size for p in dir_.iterdir()) / 2**20, 3),
+                "rss_delta_mb": round(_rss_mb() - rss_before, 2),
+            }
+            if mode == "none":
+                exact_top = tops
+            else:
+                stats[f"recall@{args.k}"] = _recall(tops, exact_top, args.k)
+                # без пересчёта: сколько теряется, если верить только квантованным скорам
+                store._rescore = 1
+                raw = [
+                    [_doc_id(doc) for doc, _ in store.similarity_search_by_vector_with_score(q, args.k)]
+                    for q in queries
+                ]
+                stats[f"recall@{args.k}_no_rescore"] = _recall(raw, exact_top, args.k)
+            result[mode] = stats
+            del store
+    return result
+
+
+def _recall(found, expected, k: int) -> float:
+    hits = sum(len(set(f) & set(e)) for f, e in zip(found, expected))
+    return round(hits / (k * len(expected)), 4)
+
+
+def main(args):
+    embed = _embedder(args.stub, args.dim)
+    sources = sorted(s for s in os.listdir(args.data_dir)
+                     if os.path.isdir(os.path.join(args.data_dir, s)))
+    results = {
+        "params": vars(args),
+        # stub‑векторы не валидируют recall на реальном ранжировании (см. docstring)
+        "embeddings": "stub" if args.stub else EMBEDDING_MODEL_NAME,
+        "validates_ranking": not args.stub,
+    }
+    for source in sources:
+        results[source] = _bench_source(source, args, embed)
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Recall и память квантованного индекса")
+    parser.add_argument("--data-dir", default="data")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--rescore", type=int, default=4, help="кандидатов на пересчёт: k × rescore")
+    parser.add_argument("--stub", action="store_true", help="векторы rag.stub_embeddings вместо OpenAI")
+    parser.add_argument("--dim", type=int, default=1536, help="размерность для --stub")
+    main(parser.parse_args())
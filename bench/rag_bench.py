@@ -0,0 +1,316 @@
+# bench/rag_bench.py
+"""
+Офлайн‑бенчмарк всего пути ответа: сборка индекса, поиск, aget_answer
+и обработка сообщений хэндлерами aiogram. Эмбеддинги и чат‑модель —
+rag.stub_embeddings (детерминированные векторы, задержки настраиваются),
+Telegram — фальшивая сессия Bot, которая ничего не отправляет.
+
+    python -m bench.rag_bench --sizes 20 100 400 --concurrency 1 8 32 > bench_rag.json
+
+Всё пишется во временный каталог (data.db, vectorstore/, кэш эмбеддингов),
+так что рабочие данные бота не трогаются. Результат — JSON в stdout,
+его удобно сравнивать между коммитами. Сеть не нужна, кроме
+однократной загрузки словарей tiktoken (или задайте TIKTOKEN_CACHE_DIR).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+DATA_DIR = Path(__file__).resolve().parent.parent / "data"
+
+
+def _percentiles(latencies: list[float]) -> dict:
+    latencies = sorted(latencies)
+    pick = lambda q: round(latencies[min(int(len(latencies) * q), len(latencies) - 1)] * 1000, 2)
+    return {"n": len(latencies), "p50_ms": pick(0.5), "p95_ms": pick(0.95), "p99_ms": pick(0.99)}
+
+
+def _sentences(seed: int = 0) -> list[str]:
+    """Предложения из data/*/*.txt — синтетический корпус похож на настоящий."""
+    sentences = []
+    for path in sorted(DATA_DIR.glob("*/*.txt")):
+        text = path.read_text(encoding="utf-8")
+        sentences.extend(s.strip() + "." for s in text.replace("\n", " ").split(".") if len(s.strip()) > 20)
+    random.Random(seed).shuffle(sentences)
+    return sentences or ["Пустой корпус."]
+
+
+def _corpus(source: str, docs: int, doc_len: int, sentences: list[str]) -> list[tuple]:
+    rnd = random.Random(docs)
+    rows = []
+    for i in range(docs):
+        body = []
+        while sum(len(s) for s in body) < doc_len:
+            body.append(rnd.choice(sentences))
+        rows.append((source, f"doc{i}", " ".join(body)))
+    return rows
+
+
+def _questions(sentences: list[str], n: int, seed: int) -> list[str]:
+    rnd = random.Random(seed)
+    return [" ".join(rnd.choice(sentences).split()[:8]) + f" #{i}" for i in range(n)]
+
+
+# ────────────────────────────────────────────────
+#   Фальшивая сессия Telegram
+# ────────────────────────────────────────────────
+def _fake_session():
+    from datetime import datetime
+    from aiogram.client.session.base import BaseSession
+    from aiogram.exceptions import TelegramBadRequest
+    from aiogram.methods import EditMessageText
+    from aiogram.types import Chat, Message, ReplyKeyboardMarkup
+
+    class FakeSession(BaseSession):
+        """
+        Отвечает на любой метод Bot API без сети; считает вызовы.
+        Как и Telegram, не даёт редактировать сообщения с reply‑клавиатурой.
+        """
+
+        def __init__(self):
+            super().__init__()
+            self.calls: dict[str, int] = {}
+            self._next_id = 0
+            self._with_keyboard: set[int] = set()
+
+        async def make_request(self, bot, method, timeout=None):
+            name = type(method).__name__
+            self.calls[name] = self.calls.get(name, 0) + 1
+            if isinstance(method, EditMessageText) and method.message_id in self._with_keyboard:
+                self.calls["edit_failed"] = self.calls.get("edit_failed", 0) + 1
+                raise TelegramBadRequest(method=method, message="Bad Request: message can't be edited")
+            self._next_id += 1
+            if isinstance(getattr(method, "reply_markup", None), ReplyKeyboardMarkup):
+                self._with_keyboard.add(self._next_id)
+            chat_id = getattr(method, "chat_id", None)
+            if chat_id is None:
+                return True
+            return Message(
+                message_id=self._next_id, date=datetime.now(),
+                chat=Chat(id=chat_id, type="private"),
+                text=getattr(method, "text", None),
+            ).as_(bot)                  # как настоящая сессия: ответ привязан к боту
+
+        async def stream_content(self, *args, **kwargs):
+            yield b""
+
+        async def close(self):
+            pass
+
+    return FakeSession()
+
+
+def _update(update_id: int, user_id: int, text: str):
+    from datetime import datetime
+    from aiogram.types import Chat, Message, Update, User
+
+    return Update(update_id=update_id, message=Message(
+        message_id=update_id, date=datetime.now(), text=text,
+        chat=Chat(id=user_id, type="private"),
+        from_user=User(id=user_id, is_bot=False, first_name="bench"),
+    ))
+
+
+# ────────────────────────────────────────────────
+#   Сценарии
+# ────────────────────────────────────────────────
+async def bench_build(args, sentences) -> list[dict]:
+    """Время сборки шарда с нуля в зависимости от размера корпуса."""
+    from db.db_data import add_site_data_many
+    from rag.embeddings import get_embeddings
+    from rag.vectorestore import build_shard
+
+    results = []
+    for size in args.sizes:
+        source = f"bench{size}"
+        await add_site_data_many(_corpus(source, size, args.doc_len, sentences))
+        started = time.perf_counter()
+        vs = await asyncio.to_thread(build_shard, source)
+        elapsed = time.perf_counter() - started
+        chunks = len(vs.get(include=[])["ids"])
+        results.append({
+            "source": source, "docs": size, "chunks": chunks,
+            "seconds": round(elapsed, 3), "chunks_per_sec": round(chunks / elapsed, 1),
+        })
+    results.append({"embed_cache": get_embeddings().stats()})
+    return results
+
+
+def bench_retrieval(args, source: str, sentences) -> dict:
+    """Латентность ретривера: холодные вопросы и они же повторно (кэш эмбеддингов)."""
+    from rag.pipeline import get_rag_chain
+
+    retriever = get_rag_chain(source).retriever
+    questions = _questions(sentences, args.queries, seed=1)
+    result = {}
+    for label in ("cold", "repeat"):
+        latencies = []
+        for q in questions:
+            started = time.perf_counter()
+            retriever.invoke(q)
+            latencies.append(time.perf_counter() - started)
+        result[label] = _percentiles(latencies)
+    return result
+
+
+async def bench_answers(args, source: str, sentences) -> list[dict]:
+    """aget_answer под нагрузкой: уникальные вопросы, кэш ответов не помогает."""
+    from rag.pipeline import aget_answer
+
+    results = []
+    for concurrency in args.concurrency:
+        questions = _questions(sentences, args.queries, seed=100 + concurrency)
+        slots = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(i: int, q: str):
+            async with slots:
+                started = time.perf_counter()
+                # новый пользователь на каждый вопрос: без истории и переформулировки
+                await aget_answer(10_000 * concurrency + i, q, source)
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i, q) for i, q in enumerate(questions)))
+        elapsed = time.perf_counter() - started
+        results.append({"concurrency": concurrency, "answers_per_sec": round(len(questions) / elapsed, 2),
+                        **_percentiles(latencies)})
+    return results
+
+
+async def bench_burst(args, source: str, sentences, server) -> dict:
+    """Всплеск одинаковых вопросов от разных пользователей (как при сбое сервиса)."""
+    from rag.pipeline import aget_answer
+    from rag.singleflight import inflight
+
+    question = _questions(sentences, 1, seed=300)[0]
+    chat_before, flights_before = server.chat_requests, inflight.stats()
+    started = time.perf_counter()
+    await asyncio.gather(*(aget_answer(2_000_000 + i, question, source) for i in range(args.queries)))
+    elapsed = time.perf_counter() - started
+    flights = inflight.stats()
+    return {
+        "users": args.queries, "seconds": round(elapsed, 3),
+        "llm_requests": server.chat_requests - chat_before,
+        "collapsed": flights["collapsed"] - flights_before["collapsed"],
+    }
+
+
+async def bench_handlers(args, source: str, sentences) -> list[dict]:
+    """Сквозная обработка синтетических апдейтов Dispatcher'ом с нашими хэндлерами."""
+    from aiogram import Bot, Dispatcher
+    from bot import handlers
+    from bot.admin_handlers import register_admin_handlers
+    from bot.state import user_state
+
+    session = _fake_session()
+    bot = Bot(token="123456:bench", session=session)
+    dp = Dispatcher()
+    register_admin_handlers(dp)
+    handlers.register_handlers(dp)
+
+    results = []
+    update_id = 0
+    for concurrency in args.concurrency:
+        questions = _questions(sentences, args.queries, seed=200 + concurrency)
+        slots = asyncio.Semaphore(concurrency)
+        latencies = []
+
+        async def one(q: str):
+            nonlocal update_id
+            update_id += 1
+            user_id = 1_000_000 + update_id          # по вопросу на пользователя — мимо дневного лимита
+            await user_state.set_source(user_id, source)
+            async with slots:
+                started = time.perf_counter()
+                await dp.feed_update(bot, _update(update_id, user_id, q))
+                latencies.append(time.perf_counter() - started)
+
+        session.calls.clear()
+        started = time.perf_counter()
+        await asyncio.gather(*(one(q) for q in questions))
+        elapsed = time.perf_counter() - started
+        results.append({"concurrency": concurrency, "updates_per_sec": round(len(questions) / elapsed, 2),
+                        **_percentiles(latencies), "bot_api_calls": dict(session.calls)})
+    await bot.session.close()
+    return results
+
+
+async def run(args, server) -> dict:
+    from db.db_data import close_db, init_db_documents, open_db
+
+    sentences = _sentences()
+    await open_db()
+    await init_db_documents()
+    try:
+        results = {"build": await bench_build(args, sentences)}
+        source = f"bench{args.sizes[-1]}"
+        results["retrieval"] = await asyncio.to_thread(bench_retrieval, args, source, sentences)
+        results["answers"] = await bench_answers(args, source, sentences)
+        results["burst"] = await bench_burst(args, source, sentences, server)
+        results["handlers"] = await bench_handlers(args, source, sentences)
+    finally:
+        await close_db()
+    return results
+
+
+def offline_env(args):
+    """
+    Поднимает stub‑сервер эмбеддингов/чата и переносит рабочий каталог
+    во временный. Возвращает (server, workdir); workdir держите до конца.
+    """
+    from rag.stub_embeddings import StubEmbeddingServer
+    server = StubEmbeddingServer(("127.0.0.1", 0), dim=args.dim, latency=args.embed_latency,
+                                 chat_latency=args.chat_latency, token_delay=args.token_delay)
+    server.start()
+
+    workdir = tempfile.TemporaryDirectory()
+    # rag.config читает окружение при импорте, а пути к БД и индексу —
+    # относительные, поэтому всё настраиваем до первого импорта rag/db/bot
+    os.environ.update({
+        "OPENAI_API_BASE": server.base_url,
+        "OPENAI_API_KEY": "stub",
+        "TELEGRAM_BOT_TOKEN": "123456:bench",
+        "EMBED_CACHE_PATH": os.path.join(workdir.name, "embeddings_cache.db"),
+        "STREAM_EDIT_INTERVAL": os.environ.get("STREAM_EDIT_INTERVAL", "0.2"),
+    })
+    sys.path.insert(0, os.getcwd())
+    os.chdir(workdir.name)
+    return server, workdir
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Офлайн‑бенчмарк RAG‑бота")
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20, 100, 400], help="документов в корпусе")
+    parser.add_argument("--doc-len", type=int, default=3000, help="символов в документе")
+    parser.add_argument("--queries", type=int, default=100, help="вопросов на сценарий")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--embed-latency", type=float, default=0.0, help="задержка эмбеддинга, сек")
+    parser.add_argument("--chat-latency", type=float, default=0.2, help="до первого токена, сек")
+    parser.add_argument("--token-delay", type=float, default=0.0, help="между словами, сек")
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+    server, workdir = offline_env(args)
+
+    started = time.perf_counter()
+    results = {"params": vars(args)}
+    # прогресс сборки шардов печатается в stdout — уводим его, чтобы там был только JSON
+    with contextlib.redirect_stdout(sys.stderr):
+        results.update(asyncio.run(run(args, server)))
+    results["stub"] = {"embedding_requests": server.requests, "chat_requests": server.chat_requests}
+    results["total_seconds"] = round(time.perf_counter() - started, 2)
+    server.shutdown()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+# bench/state_check.py
+"""
+Проверка бэкендов состояния пользователей (bot/state.py) одним сценарием:
+дневная квота под конкурентными вопросами, смена дня, выбор сервиса
+и флаг чата с оператором. RedisState гоняется на fakeredis — живой
+Redis не нужен (pip install fakeredis).
+
+    python -m bench.state_check
+    python -m bench.state_check --backend redis --users 50 --limit 5 --burst 20
+
+Печатает JSON с итогами по бэкендам; при расхождении — код выхода 1.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import os
+import sys
+import tempfile
+
+from bot import state as state_mod
+
+
+def _make(backend: str, workdir: str):
+    if backend == "memory":
+        return state_mod.MemoryState()
+    if backend == "sqlite":
+        return state_mod.SQLiteState(os.path.join(workdir, "state.db"), flush_interval=0.05)
+    from fakeredis import FakeAsyncRedis
+    return state_mod.RedisState(client=FakeAsyncRedis(decode_responses=True))
+
+
+async def _check(backend: str, args, workdir: str) -> list[str]:
+    """Возвращает список найденных расхождений (пустой — всё в порядке)."""
+    errors: list[str] = []
+    st = _make(backend, workdir)
+    await st.open()
+    try:
+        # burst одновременных вопросов от каждого пользователя: ровно limit проходят,
+        # номера за день — 1..limit без повторов, остальные получают None
+        for user_id in range(1, args.users + 1):
+            taken = await asyncio.gather(*(st.take_quota(user_id, args.limit)
+                                           for _ in range(args.burst)))
+            granted = sorted(n for n in taken if n is not None)
+            if granted != list(range(1, min(args.limit, args.burst) + 1)):
+                errors.append(f"user {user_id}: выдано {granted}")
+
+        # отказ не должен сдвигать счётчик: после лишних попыток лимит всё так же исчерпан
+        if await st.take_quota(1, args.limit) is not None:
+            errors.append("после исчерпания квоты вопрос прошёл")
+        if await st.take_quota(1, args.limit + 1) != args.limit + 1:
+            errors.append("отказы сдвинули счётчик квоты (нет DECR)")
+
+        # новый день — квота снова с единицы
+        today = state_mod._today
+        state_mod._today = lambda: today() + 1
+        try:
+            if await st.take_quota(1, args.limit) != 1:
+                errors.append("квота не сбросилась на следующий день")
+        finally:
+            state_mod._today = today
+
+        if backend == "redis":
+            ttl = await st._redis.ttl(f"quota:1:{today()}")
+            if not 0 < ttl <= 2 * 24 * 60 * 60:
+                errors.append(f"у счётчика квоты нет TTL ({ttl})")
+
+        await st.set_source(1, "сервис")
+        if await st.get_source(1) != "сервис" or await st.get_source(2) is not None:
+            errors.append("выбор сервиса не сохранился")
+
+        await st.support_enter(1)
+        active = await st.support_active(1)
+        await st.support_leave(1)
+        if not active or await st.support_active(1):
+            errors.append("флаг чата с оператором работает неверно")
+    finally:
+        await st.close()
+    return errors
+
+
+async def run(args) -> dict:
+    results = {}
+    with tempfile.TemporaryDirectory() as workdir:
+        for backend in args.backend:
+            errors = await _check(backend, args, workdir)
+            results[backend] = {"ok": not errors, "errors": errors}
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Проверка бэкендов состояния пользователей")
+    parser.add_argument("--backend", choices=["memory", "sqlite", "redis"], nargs="+",
+                        default=["memory", "sqlite", "redis"])
+    parser.add_argument("--users", type=int, default=20)
+    parser.add_argument("--limit", type=int, default=5, help="дневной лимит вопросов")
+    parser.add_argument("--burst", type=int, default=12, help="одновременных вопросов от пользователя")
+    args = parser.parse_args()
+
+    results = asyncio.run(run(args))
+    print(json.dumps({"params": vars(args), "results": results}, ensure_ascii=False, indent=2))
+    sys.exit(0 if all(r["ok"] for r in results.values()) else 1)
+
+
+if __name__ == "__main__":
+    main()
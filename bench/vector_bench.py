@@ -0,0 +1,118 @@
+# bench/vector_bench.py
+"""
+Сравнивает бэкенды шарда rag/vectorestore.py на синтетических векторах:
+Chroma (HNSW + SQLite) против NumpyVectorStore (точный поиск по memmap).
+Каждый бэкенд меряется в отдельном процессе, чтобы RSS не смешивались.
+
+    python -m bench.vector_bench --chunks 5000 --dim 1536 --queries 500
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+
+BACKENDS = ("chroma", "numpy")
+
+
+def _rss_mb() -> float:
+    """Текущий RSS процесса (Linux), МБ."""
+    with open("/proc/self/statm") as f:
+        pages = int(f.read().split()[1])
+    return pages * resource.getpagesize() / 2**20
+
+
+def _data(chunks: int, dim: int, queries: int, seed: int = 0):
+    rnd = np.random.default_rng(seed)
+    vectors = rnd.standard_normal((chunks, dim), dtype=np.float32)
+    vectors /= np.linalg.norm(vectors, axis=1, keepdims=True)
+    # запросы — зашумлённые копии случайных чанков, как перефразированный вопрос
+    targets = rnd.integers(0, chunks, queries)
+    qs = vectors[targets] + 0.3 * rnd.standard_normal((queries, dim), dtype=np.float32) / np.sqrt(dim)
+    return vectors, qs
+
+
+def _open(backend: str, dir_: Path):
+    if backend == "numpy":
+        from rag.numpy_store import NumpyVectorStore
+        return NumpyVectorStore(dir_, embedding_function=None)
+    from langchain_chroma import Chroma
+    return Chroma(collection_name="bench", persist_directory=str(dir_))
+
+
+def _measure(backend: str, args) -> dict:
+    """Выполняется в дочернем процессе: сборка, холодное открытие, поиск."""
+    vectors, queries = _data(args.chunks, args.dim, args.queries)
+    rss_base = _rss_mb()
+    with tempfile.TemporaryDirectory() as tmp:
+        dir_ = Path(tmp)
+        started = time.perf_counter()
+        vs = _open(backend, dir_)
+        upsert = vs.upsert if backend == "numpy" else vs._collection.upsert
+        for i in range(0, args.chunks, 1000):
+            part = range(i, min(i + 1000, args.chunks))
+            upsert(
+                ids=[str(j) for j in part],
+                embeddings=vectors[i:i + 1000].tolist(),
+                metadatas=[{"row_id": j, "chunk": 0} for j in part],
+                documents=[f"chunk {j}" for j in part],
+            )
+        if backend == "numpy":
+            vs.flush()
+        build = time.perf_counter() - started
+        del vs
+
+        started = time.perf_counter()
+        vs = _open(backend, dir_)
+        open_s = time.perf_counter() - started
+
+        latencies = []
+        for q in queries:
+            started = time.perf_counter()
+            vs.similarity_search_by_vector(q.tolist(), k=args.k)
+            latencies.append(time.perf_counter() - started)
+        latencies.sort()
+        return {
+            "build_s": round(build, 3),
+            "open_s": round(open_s, 4),
+            "p50_ms": round(latencies[len(latencies) // 2] * 1000, 3),
+            "p95_ms": round(latencies[int(len(latencies) * 0.95)] * 1000, 3),
+            "qps": round(len(latencies) / sum(latencies), 1),
+            "rss_mb": round(_rss_mb() - rss_base, 1),
+            "max_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        }
+
+
+def main(args):
+    if args.child:
+        print(json.dumps(_measure(args.child, args)))
+        return
+    results = {"params": {k: v for k, v in vars(args).items() if k != "child"}}
+    for backend in args.backends:
+        cmd = [sys.executable, "-m", "bench.vector_bench", "--child", backend,
+               "--chunks", str(args.chunks), "--dim", str(args.dim),
+               "--queries", str(args.queries), "--k", str(args.k)]
+        proc = subprocess.run(cmd, capture_output=True, text=True)
+        if proc.returncode:
+            results[backend] = {"error": proc.stderr.strip().splitlines()[-1:]}
+        else:
+            results[backend] = json.loads(proc.stdout.strip().splitlines()[-1])
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Benchmark Chroma vs NumPy shard backend")
+    parser.add_argument("--chunks", type=int, default=5000, help="чанков в шарде")
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=5)
+    parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    parser.add_argument("--child", choices=BACKENDS, help=argparse.SUPPRESS)
+    main(parser.parse_args())
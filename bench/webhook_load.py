@@ -0,0 +1,159 @@
+# bench/webhook_load.py
+"""
+Нагрузочный прогон webhook‑режима: локальный aiohttp‑сервер bot.webhook
+с нашими хэндлерами принимает синтетические апдейты Telegram по HTTP.
+
+    python -m bench.webhook_load --updates 2000 --concurrency 1 16 64
+    python -m bench.webhook_load --kind question --updates 200 --chat-latency 0.5
+    WORKER_PROCESSES=4 python -m bench.webhook_load --kind question --updates 200
+
+Меряются две скорости: подтверждения (200 на POST — то, что видит Telegram)
+и полной обработки апдейтов хэндлерами. Kind "start" — /start (только
+Bot API), "question" — вопрос по шарду через stub‑LLM. Окружение то же,
+что у bench.rag_bench: временный каталог, stub‑сервер, фальшивая сессия Bot.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import contextlib
+import json
+import sys
+import time
+
+from bench.rag_bench import _corpus, _fake_session, _percentiles, _questions, _sentences, _update, offline_env
+
+SECRET = "bench-secret"
+SOURCE = "webhook_bench"
+
+
+async def _serve(dp, bot):
+    from aiohttp import web
+    from bot.webhook import build_app
+
+    runner = web.AppRunner(build_app(dp, bot, SECRET, path="/telegram"), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}/telegram"
+
+
+async def run(args) -> dict:
+    import aiohttp
+    from aiogram import Bot, Dispatcher
+    from bot import handlers
+    from bot.admin_handlers import register_admin_handlers
+    from bot.state import user_state
+    from db.db_data import add_site_data_many, close_db, init_db_documents, open_db
+    from rag.vectorestore import build_shard
+    from rag.workers import worker_pool
+
+    sentences = _sentences()
+    await open_db()
+    await init_db_documents()
+    await add_site_data_many(_corpus(SOURCE, args.docs, 3000, sentences))
+    if args.kind == "question":
+        await asyncio.to_thread(build_shard, SOURCE)
+    if worker_pool.enabled:
+        await worker_pool.start()
+
+    session = _fake_session()
+    bot = Bot(token="123456:bench", session=session)
+    dp = Dispatcher()
+    register_admin_handlers(dp)
+    handlers.register_handlers(dp)
+
+    # счётчик полностью обработанных апдейтов
+    done = {"n": 0, "target": 0, "event": asyncio.Event()}
+
+    async def count_done(handler, event, data):
+        try:
+            return await handler(event, data)
+        finally:
+            done["n"] += 1
+            if done["n"] >= done["target"]:
+                done["event"].set()
+
+    dp.update.outer_middleware(count_done)
+    runner, url = await _serve(dp, bot)
+    results = {"url": url}
+    update_id = 0
+    try:
+        async with aiohttp.ClientSession() as http:
+            async with http.post(url, json={"update_id": 0}) as resp:
+                results["without_secret_status"] = resp.status
+
+            headers = {"X-Telegram-Bot-Api-Secret-Token": SECRET}
+            runs = []
+            for concurrency in args.concurrency:
+                questions = _questions(sentences, args.updates, seed=400 + concurrency)
+                payloads = []
+                for q in questions:
+                    update_id += 1
+                    user_id = 3_000_000 + update_id      # по апдейту на пользователя — мимо дневного лимита
+                    if args.kind == "question":
+                        await user_state.set_source(user_id, SOURCE)
+                    text = q if args.kind == "question" else "/start"
+                    payloads.append(_update(update_id, user_id, text).model_dump(mode="json", exclude_none=True))
+
+                slots = asyncio.Semaphore(concurrency)
+                latencies = []
+                statuses: dict[int, int] = {}
+
+                async def post(payload):
+                    async with slots:
+                        started = time.perf_counter()
+                        async with http.post(url, json=payload, headers=headers) as resp:
+                            await resp.read()
+                        latencies.append(time.perf_counter() - started)
+                        statuses[resp.status] = statuses.get(resp.status, 0) + 1
+
+                done["n"], done["target"] = 0, len(payloads)
+                done["event"].clear()
+                session.calls.clear()
+                started = time.perf_counter()
+                await asyncio.gather(*(post(p) for p in payloads))
+                acked = time.perf_counter() - started
+                await asyncio.wait_for(done["event"].wait(), timeout=args.timeout)
+                processed = time.perf_counter() - started
+                runs.append({
+                    "concurrency": concurrency,
+                    "acks_per_sec": round(len(payloads) / acked, 1),
+                    "updates_per_sec": round(len(payloads) / processed, 1),
+                    "ack": _percentiles(latencies),
+                    "statuses": statuses,
+                    "bot_api_calls": dict(session.calls),
+                })
+            results["runs"] = runs
+    finally:
+        await runner.cleanup()
+        await worker_pool.close()
+        await close_db()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Нагрузка на webhook‑режим бота")
+    parser.add_argument("--kind", choices=["start", "question"], default="start")
+    parser.add_argument("--updates", type=int, default=1000, help="апдейтов на прогон")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 16, 64], help="одновременных POST")
+    parser.add_argument("--docs", type=int, default=20, help="документов в источнике")
+    parser.add_argument("--timeout", type=float, default=300, help="ждать обработки, сек")
+    parser.add_argument("--embed-latency", type=float, default=0.0)
+    parser.add_argument("--chat-latency", type=float, default=0.2)
+    parser.add_argument("--token-delay", type=float, default=0.0)
+    parser.add_argument("--dim", type=int, default=1536)
+    args = parser.parse_args()
+    server, workdir = offline_env(args)
+
+    results = {"params": vars(args)}
+    with contextlib.redirect_stdout(sys.stderr):
+        results.update(asyncio.run(run(args)))
+    results["stub"] = {"embedding_requests": server.requests, "chat_requests": server.chat_requests}
+    server.shutdown()
+    print(json.dumps(results, ensure_ascii=False, indent=2))
+
+
+if __name__ == "__main__":
+    main()
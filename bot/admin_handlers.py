@@ -1,7 +1,6 @@
 # bot/admin_handlers.py
 from __future__ import annotations
 
-import asyncio
 import logging
 
 from aiogram import Dispatcher, types, F
@@ -10,9 +9,9 @@ from aiogram.filters import Command, CommandObject
 from db.db_data import (
     add_site_data,
     delete_site_data_by_source,
-    get_all_sources,
 )
-from rag.pipeline import refresh_chain
+from bot.catalog import source_catalog
+from rag.rebuild import rebuild_queue
 
 # ────────────────────────────────────────────────
 ADMIN_IDS = {123456789, 504895191}
@@ -104,20 +103,17 @@ async def handle_admin_file(message: types.Message):
     # 1) сохраняем в БД
     await add_site_data(alias, title, content)
 
-    # 2) уведомляем админа и сразу же НЕ фоново, а inline делаем rebuild
-    await message.reply("📥 Файл сохранён, индекс обновляется… Пожалуйста, подождите.")
-
-    # ниже — синхронный вызов, но в executor, чтобы не блокировать event‑loop слишком долго
-    refresh_chain()
-    # 3) и наконец сообщаем об окончании
-    await message.reply("✅ Индекс обновлён и готов к работе!")
+    # 2) ставим обновление индекса в фоновую очередь — статус придёт сообщениями,
+    #    а бот пока отвечает остальным по старой версии индекса
+    await message.reply("📥 Файл сохранён, индекс обновится в фоне.")
+    _rebuild_index(alias, message.chat.id, message.bot)
 
     logging.info(f"Admin {message.from_user.id}: импортировал {alias}/{title}")
 
 
-async def _rebuild_index(chat_id: int, bot: types.Bot):
-    refresh_chain()
-    await bot.send_message(chat_id, "✅ Индекс обновлён.")
+def _rebuild_index(source: str, chat_id: int, bot: types.Bot):
+    """Ставит пересборку шарда в фоновую очередь; прогресс уходит в chat_id."""
+    rebuild_queue.request(source, notify=lambda text: bot.send_message(chat_id, text))
 
 
 # ────────────────────────────────────────────────
@@ -126,23 +122,19 @@ async def _rebuild_index(chat_id: int, bot: types.Bot):
 async def del_btn_pressed(message: types.Message):
     if message.from_user.id not in ADMIN_IDS:
         return
-    sources = await get_all_sources()
-    if not sources:
+    await source_catalog.ensure_loaded()
+    if not source_catalog.sources:
         await message.reply("Источники не найдены.")
         return
-    ikb = types.InlineKeyboardMarkup(
-        inline_keyboard=[[types.InlineKeyboardButton(text=s, callback_data=f"del:{s}")]
-                         for s in sources]
-    )
-    await message.reply("Выберите источник для удаления:", reply_markup=ikb)
+    await message.reply("Выберите источник для удаления:",
+                        reply_markup=source_catalog.delete_keyboard)
 
 
 @staticmethod
 async def _delete_and_refresh(src: str, chat_id: int, bot: types.Bot):
     rows = await delete_site_data_by_source(src)
-    refresh_chain()
-    await bot.send_message(chat_id, f"🗑 Удалено {rows} записей источника «{src}»."
-                                    "\n✅ Индекс обновлён.")
+    await bot.send_message(chat_id, f"🗑 Удалено {rows} записей источника «{src}».")
+    _rebuild_index(src, chat_id, bot)
 
 
 @staticmethod
@@ -151,11 +143,52 @@ async def confirm_delete(callback: types.CallbackQuery):
         return
     source = callback.data.split(":", 1)[1]
     await callback.answer("Удаляем…", show_alert=False)
-    asyncio.create_task(
-        _delete_and_refresh(source, callback.message.chat.id, callback.bot)
-    )
     await callback.message.edit_text(f"Удаление «{source}» запущено.",
                                      reply_markup=None)
+    await _delete_and_refresh(source, callback.message.chat.id, callback.bot)
+
+
+# ────────────────────────────────────────────────
+#   /index_status — состояние фоновой пересборки
+# ────────────────────────────────────────────────
+async def index_status(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    st = rebuild_queue.status()
+    lines = [
+        f"Сейчас собирается: {st['running'] or '—'}",
+        f"В очереди: {', '.join(st['pending']) or '—'}",
+        f"Сборок выполнено: {st['builds']}",
+    ]
+    if st["last_duration"] is not None:
+        lines.append(f"Последняя сборка: {st['last_duration']:.1f} с")
+    if st["last_error"]:
+        lines.append(f"Последняя ошибка: {st['last_error']}")
+    await message.reply("\n".join(lines))
+
+
+# ────────────────────────────────────────────────
+#   /cache_status — кэши ответов и схлопывание вопросов
+# ────────────────────────────────────────────────
+async def cache_status(message: types.Message):
+    if message.from_user.id not in ADMIN_IDS:
+        return
+    from rag.answer_cache import answer_cache
+    from rag.embeddings import get_embeddings
+    from rag.singleflight import inflight
+
+    cs = answer_cache.stats()
+    qs = get_embeddings().query_stats()
+    fs = inflight.stats()
+    lines = [
+        f"Кэш ответов: {cs['hits']} попаданий / {cs['misses']} промахов "
+        f"({cs['hit_rate']:.0%}), записей {cs['size']}",
+        f"Кэш эмбеддингов вопросов: {qs['hits']} попаданий / {qs['misses']} промахов "
+        f"({qs['hit_rate']:.0%}), записей {qs['size']}",
+        f"Одинаковые вопросы: посчитано {fs['leaders']}, схлопнуто {fs['collapsed']} "
+        f"({fs['collapse_rate']:.0%}), в работе {fs['in_flight']}",
+    ]
+    await message.reply("\n".join(lines))
 
 
 # ────────────────────────────────────────────────
@@ -217,5 +250,7 @@ def register_admin_handlers(dp: Dispatcher):
 
     dp.callback_query.register(confirm_delete, lambda c: c.data and c.data.startswith("del:"))
 
+    dp.message.register(index_status, Command("index_status"), flags={"block": True})
+    dp.message.register(cache_status, Command("cache_status"), flags={"block": True})
     dp.message.register(admin_reply, Command("reply"), flags={"block": True})
     dp.message.register(relay_admin_reply, lambda m: m.reply_to_message is not None)
\ No newline at end of file
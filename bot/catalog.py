@@ -0,0 +1,83 @@
+# bot/catalog.py
+import asyncio
+import logging
+from typing import Optional
+
+from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
+
+from db.db_data import add_source_listener, get_all_sources
+
+
+class SourceCatalog:
+    """
+    Список источников в памяти вместе с готовыми inline‑клавиатурами.
+    Загружается один раз и обновляется по уведомлениям db_data,
+    так что /start и «Сменить сервис» не ходят в БД.
+    """
+
+    def __init__(self):
+        self._sources: list[str] = []
+        self._loaded = False
+        self._reload_task: Optional[asyncio.Task] = None
+        self._dirty = False        # изменения, пришедшие во время перечитывания
+        self.keyboard: Optional[InlineKeyboardMarkup] = None          # выбор сервиса
+        self.delete_keyboard: Optional[InlineKeyboardMarkup] = None   # удаление (админ)
+
+    @property
+    def sources(self) -> list[str]:
+        return self._sources
+
+    async def ensure_loaded(self):
+        if not self._loaded:
+            await self.load()
+
+    async def load(self):
+        self._set(await get_all_sources())
+        self._loaded = True
+
+    def on_change(self, source: str, action: str):
+        reloading = self._reload_task is not None and not self._reload_task.done()
+        if action == "add":
+            if source not in self._sources:
+                self._set(self._sources + [source])
+            # идущее чтение могло начаться до вставки и затереть источник
+            self._dirty = self._dirty or reloading
+            return
+        # после удаления строк источник мог и остаться — перечитываем список из БД
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._loaded = False
+            return
+        if reloading:
+            self._dirty = True     # текущее чтение могло его не увидеть
+        else:
+            self._reload_task = loop.create_task(self._reload())
+
+    async def _reload(self):
+        # перечитываем, пока за время чтения не перестанут приходить изменения
+        while True:
+            self._dirty = False
+            try:
+                await self.load()
+            except Exception:
+                logging.exception("Не удалось перечитать список источников")
+                self._loaded = False
+                return
+            if not self._dirty:
+                return
+
+    def _set(self, sources: list[str]):
+        self._sources = list(sources)
+        self.keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text=s, callback_data=s)]
+                             for s in self._sources]
+        )
+        self.delete_keyboard = InlineKeyboardMarkup(
+            inline_keyboard=[[InlineKeyboardButton(text=s, callback_data=f"del:{s}")]
+                             for s in self._sources]
+        )
+
+
+source_catalog = SourceCatalog()
+add_source_listener(source_catalog.on_change)
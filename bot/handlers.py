@@ -1,21 +1,27 @@
 # bot/handlers.py
+import asyncio
 import logging
-from datetime import date
+import time
 from aiogram.enums import ContentType
 from aiogram import F, Dispatcher
 from aiogram.filters import Command
+from aiogram.exceptions import TelegramBadRequest, TelegramRetryAfter
 from aiogram.types import (
     Message,
     CallbackQuery,
-    InlineKeyboardMarkup,
-    InlineKeyboardButton,
     ReplyKeyboardMarkup,
     KeyboardButton,
 )
 
-from bot.state import support_store
-from rag.pipeline import get_rag_chain, get_answer
-from db.db_data import get_all_sources
+from bot.state import user_state
+from rag.config import STREAM_ANSWERS, STREAM_EDIT_INTERVAL, WORKER_PROCESSES
+if WORKER_PROCESSES:
+    # ответы считают процессы‑воркеры (rag.workers), сигнатуры те же
+    from rag.workers import worker_pool
+    aget_answer, astream_answer = worker_pool.aget_answer, worker_pool.astream_answer
+else:
+    from rag.pipeline import aget_answer, astream_answer
+from bot.catalog import source_catalog
 
 # ────────────────────────────────────────────────
 # Константы
@@ -25,14 +31,7 @@ SUPPORT_BUTTON_TEXT = "Обращение в службу поддержки"
 CHANGE_SOURCE_BUTTON_TEXT = "Сменить сервис"
 END_SUPPORT_TEXT = "Завершить чат с оператором"
 MAX_DAILY_REQUESTS = 10  # максимум вопросов к LLM в день
-
-# ────────────────────────────────────────────────
-# Хранилища
-# ────────────────────────────────────────────────
-user_sources: dict[int, str] = {}      # выбранный сервис
-user_requests: dict[int, dict] = {}    # счётчики запросов: {user_id: {"date": date, "count": int}}
-
-rag_chain = get_rag_chain()
+MAX_MESSAGE_LEN = 4096   # лимит Telegram на длину сообщения
 
 # reply‑клавиатура, которая отображается ВСЕГДА
 main_reply_kb = ReplyKeyboardMarkup(
@@ -47,21 +46,17 @@ main_reply_kb = ReplyKeyboardMarkup(
 # /start
 # ────────────────────────────────────────────────
 async def cmd_start(message: Message):
-    sources = await get_all_sources()
-    if not sources:
+    await source_catalog.ensure_loaded()
+    if not source_catalog.sources:
         await message.answer(
             "Источники данных не найдены. Загрузите данные, пожалуйста.",
             reply_markup=main_reply_kb,
         )
         return
 
-    inline_kb = InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text=src, callback_data=src)] for src in sources]
-    )
-
     await message.answer(
         "Привет! Я бот, который помогает пользователям с их вопросами о различных сервисах. Выберите сервис:",
-        reply_markup=inline_kb,
+        reply_markup=source_catalog.keyboard,
     )
     await message.answer(
         "В любой момент можете вызвать оператора или сменить сервис через кнопки ниже.",
@@ -73,7 +68,7 @@ async def cmd_start(message: Message):
 # ────────────────────────────────────────────────
 async def handle_source_selection(callback: CallbackQuery):
     selected = callback.data
-    user_sources[callback.from_user.id] = selected
+    await user_state.set_source(callback.from_user.id, selected)
     logging.info(f"{callback.from_user.id=}: выбран сервис {selected!r}")
     await callback.answer(f"Вы выбрали сервис: {selected}")
     await callback.message.answer(
@@ -82,15 +77,12 @@ async def handle_source_selection(callback: CallbackQuery):
     )
 
 async def send_source_list(chat_id: int, bot):
-    sources = await get_all_sources()
-    if not sources:
+    await source_catalog.ensure_loaded()
+    if not source_catalog.sources:
         await bot.send_message(chat_id, "Источники данных не найдены.", reply_markup=main_reply_kb)
         return
 
-    kb = InlineKeyboardMarkup(
-        inline_keyboard=[[InlineKeyboardButton(text=s, callback_data=s)] for s in sources]
-    )
-    await bot.send_message(chat_id, "Выберите сервис:", reply_markup=kb)
+    await bot.send_message(chat_id, "Выберите сервис:", reply_markup=source_catalog.keyboard)
 
 # ────────────────────────────────────────────────
 # RAG‑вопрос с лимитом
@@ -99,7 +91,8 @@ async def process_rag_question(message: Message):
     user_id = message.from_user.id
 
     # Проверка, выбрал ли сервис
-    if user_id not in user_sources:
+    source = await user_state.get_source(user_id)
+    if source is None:
         await message.answer(
             "Сначала выберите сервис командой /start.", reply_markup=main_reply_kb
         )
@@ -111,30 +104,51 @@ async def process_rag_question(message: Message):
         return
 
     # Лимитирование запросов в день
-    today = date.today()
-    entry = user_requests.get(user_id)
-    if entry and entry["date"] == today:
-        if entry["count"] >= MAX_DAILY_REQUESTS:
-            await message.answer(
-                f"Извините, вы исчерпали {MAX_DAILY_REQUESTS} запросов к LLM за сегодня. Попробуйте завтра.",
-                reply_markup=main_reply_kb,
-            )
-            return
-        entry["count"] += 1
-    else:
-        # Новый день или первый запрос
-        user_requests[user_id] = {"date": today, "count": 1}
+    count = await user_state.take_quota(user_id, MAX_DAILY_REQUESTS)
+    if count is None:
+        await message.answer(
+            f"Извините, вы исчерпали {MAX_DAILY_REQUESTS} запросов к LLM за сегодня. Попробуйте завтра.",
+            reply_markup=main_reply_kb,
+        )
+        return
 
     # Логируем номер запроса
-    logging.info(
-        f"Пользователь {user_id} запрос №{user_requests[user_id]['count']} за {today}: {text!r}"
-    )
+    logging.info(f"Пользователь {user_id} запрос №{count} за сегодня: {text!r}")
 
     # Получаем и отправляем ответ
-    source = user_sources[user_id]
-    answer = get_answer(text, source)
+    if STREAM_ANSWERS:
+        await _stream_answer(message, user_id, text, source)
+        return
+    answer = await aget_answer(user_id, text, source)
     await message.answer(answer, reply_markup=main_reply_kb)
 
+async def _stream_answer(message: Message, user_id: int, text: str, source: str):
+    """
+    Отправляет заглушку и дописывает в неё ответ по мере генерации.
+    Правки идут не чаще STREAM_EDIT_INTERVAL, финальная добавляет источники.
+    Заглушка — без reply‑клавиатуры: сообщения с ней Telegram не даёт
+    редактировать (клавиатура от прошлых сообщений остаётся на экране).
+    """
+    placeholder = await message.answer("⏳ Ищу ответ…")
+    partial, shown, last_edit = "", "", 0.0
+    final = {"answer": "", "sources": []}
+    async for event in astream_answer(user_id, text, source):
+        if "token" not in event:
+            final = event
+            continue
+        partial += event["token"]
+        now = time.monotonic()
+        if now - last_edit >= STREAM_EDIT_INTERVAL and partial.strip() != shown:
+            shown = partial.strip()
+            last_edit = now
+            await _edit_text(placeholder, shown + " ▌")
+
+    answer = final["answer"]
+    if final["sources"]:
+        answer += "\n\nИсточники: " + ", ".join(final["sources"])
+    if not await _edit_text(placeholder, answer):
+        await message.answer(answer[:MAX_MESSAGE_LEN], reply_markup=main_reply_kb, parse_mode=None)
+
 # ────────────────────────────────────────────────
 # Поддержка
 # ────────────────────────────────────────────────
@@ -147,16 +161,16 @@ async def process_support_request(message: Message):
             resize_keyboard=True,
         ),
     )
-    await support_store.enter(message.from_user.id)
+    await user_state.support_enter(message.from_user.id)
     # Уведомляем операторов
     await _copy_to_admins(message)
 
 async def end_support_session(message: Message):
-    if not await support_store.active(message.from_user.id):
+    if not await user_state.support_active(message.from_user.id):
         await message.answer("Вы не в чате с оператором.")
         return
 
-    await support_store.leave(message.from_user.id)
+    await user_state.support_leave(message.from_user.id)
     await message.answer(
         "Чат с оператором завершён. Можете продолжить работу с ботом.",
         reply_markup=main_reply_kb,
@@ -184,7 +198,7 @@ async def user_message_router(message: Message):
         await send_source_list(message.chat.id, message.bot)
         return
 
-    if await support_store.active(message.from_user.id):
+    if await user_state.support_active(message.from_user.id):
         await _copy_to_admins(message)
         return
 
@@ -212,6 +226,25 @@ async def _copy_to_admins(msg: Message):
         except Exception as exc:
             logging.error(f"Не удалось переслать админу {admin_id}: {exc}")
 
+async def _edit_text(msg: Message, text: str) -> bool:
+    """
+    edit_text без HTML‑разметки, с обрезкой и уважением к flood‑лимитам Telegram.
+    Возвращает False, если отредактировать не удалось.
+    """
+    text = text[:MAX_MESSAGE_LEN]
+    try:
+        try:
+            await msg.edit_text(text, parse_mode=None)
+        except TelegramRetryAfter as exc:
+            await asyncio.sleep(exc.retry_after)
+            await msg.edit_text(text, parse_mode=None)
+    except TelegramBadRequest as exc:
+        if "message is not modified" in str(exc):
+            return True
+        logging.warning(f"Не удалось отредактировать сообщение: {exc}")
+        return False
+    return True
+
 async def handle_non_text_message(message: Message):
     from bot.admin_handlers import ADMIN_IDS        # локальный импорт, чтобы избежать циклов
     if message.from_user.id in ADMIN_IDS:
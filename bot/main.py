@@ -4,29 +4,79 @@ import logging
 
 from aiogram import Bot, Dispatcher
 from aiogram.client.default import DefaultBotProperties
-from aiogram.fsm.storage.memory import MemoryStorage       # ← добавить
-from rag.config import TELEGRAM_BOT_TOKEN
-from db.db_data import init_db_documents
+from aiogram.fsm.storage.memory import MemoryStorage
+from rag.config import TELEGRAM_BOT_TOKEN, STATE_BACKEND, REDIS_URL, BOT_MODE
+from db.db_data import init_db_documents, open_db, close_db
+from rag.pipeline import add_refresh_listener, warm_up
+from rag.vectorestore import list_sources
+from rag.workers import worker_pool
+from rag.history import history_store
 
+from bot.catalog import source_catalog
+from bot.state import user_state
 from bot.handlers import register_handlers
 from bot.admin_handlers import register_admin_handlers
+from bot.monitoring import setup_metrics
+
+
+async def _warm_up():
+    await asyncio.to_thread(warm_up)
+    if worker_pool.enabled:
+        # прогрев мог пересобрать шарды, которые воркеры уже открыли
+        for source in await asyncio.to_thread(list_sources):
+            worker_pool.refresh(source)
+
+
+def _warm_up_done(task: asyncio.Task) -> None:
+    if not task.cancelled() and task.exception() is not None:
+        # без этого исключение фоновой задачи тихо теряется
+        logging.error("❌  Не удалось открыть шарды при старте", exc_info=task.exception())
 
 
 async def main():
+    await open_db()
     await init_db_documents()
+    await source_catalog.load()
+    await user_state.open()
 
     bot = Bot(
         token=TELEGRAM_BOT_TOKEN,
         default=DefaultBotProperties(parse_mode="HTML"),
     )
 
-    storage = MemoryStorage()             # ← инициализируем
-    dp = Dispatcher(storage=storage)      # ← передаём в Dispatcher
+    if STATE_BACKEND == "redis":
+        from aiogram.fsm.storage.redis import RedisStorage
+        storage = RedisStorage.from_url(REDIS_URL)
+    else:
+        storage = MemoryStorage()
+    dp = Dispatcher(storage=storage)
 
     register_admin_handlers(dp)
     register_handlers(dp)
+    metrics_runner = await setup_metrics(dp, bot)
+    if worker_pool.enabled:
+        await worker_pool.start()
+        add_refresh_listener(worker_pool.refresh)
+
+    # шарды индекса поднимаем в фоне: приём апдейтов стартует сразу,
+    # а сохранённые коллекции открываются параллельно
+    warmup = asyncio.create_task(_warm_up())
+    warmup.add_done_callback(_warm_up_done)
 
-    await dp.start_polling(bot, skip_updates=True)
+    try:
+        if BOT_MODE == "webhook":
+            from bot.webhook import run_webhook
+            await run_webhook(dp, bot)
+        else:
+            await dp.start_polling(bot, skip_updates=True)
+    finally:
+        warmup.cancel()
+        history_store.save()
+        await worker_pool.close()
+        await user_state.close()
+        if metrics_runner is not None:
+            await metrics_runner.cleanup()
+        await close_db()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,86 @@
+# bot/monitoring.py
+import logging
+import time
+
+from aiogram import Bot, Dispatcher
+
+from rag.answer_cache import answer_cache
+from rag.config import METRICS_HOST, METRICS_PORT
+from rag.metrics import metrics, start_metrics_server
+from rag.rebuild import rebuild_queue
+from rag.singleflight import inflight
+
+
+async def _time_bot_api(make_request, bot, method):
+    """Middleware сессии Bot: длительность каждого вызова Bot API."""
+    started = time.perf_counter()
+    try:
+        return await make_request(bot, method)
+    finally:
+        metrics.observe("rag_telegram_seconds", time.perf_counter() - started,
+                        method=type(method).__name__)
+
+
+async def _time_update(handler, event, data):
+    """Outer‑middleware диспетчера: полная обработка апдейта."""
+    started = time.perf_counter()
+    try:
+        return await handler(event, data)
+    finally:
+        metrics.observe("rag_handler_seconds", time.perf_counter() - started,
+                        update=event.event_type)
+
+
+def _cache_gauges():
+    from rag.embeddings import get_embeddings
+
+    embeddings = get_embeddings()
+    stored = embeddings.stats()
+    lookups = stored["hits"] + stored["misses"]
+    queries = embeddings.query_stats()
+    answers = answer_cache.stats()
+    return {
+        (("cache", "answers"),): answers["hit_rate"],
+        (("cache", "query_embeddings"),): queries["hit_rate"],
+        (("cache", "embeddings"),): stored["hits"] / lookups if lookups else 0.0,
+    }
+
+
+def _flights():
+    st = inflight.stats()
+    return {
+        (("result", "computed"),): st["leaders"],
+        (("result", "collapsed"),): st["collapsed"],
+    }
+
+
+def _cache_sizes():
+    from rag.embeddings import get_embeddings
+
+    embeddings = get_embeddings()
+    return {
+        (("cache", "answers"),): answer_cache.stats()["size"],
+        (("cache", "query_embeddings"),): embeddings.query_stats()["size"],
+        (("cache", "embeddings"),): embeddings.stats()["size"],
+    }
+
+
+async def setup_metrics(dp: Dispatcher, bot: Bot):
+    """
+    Подключает замеры хэндлеров и Bot API и поднимает /metrics.
+    Возвращает aiohttp‑runner (или None, если METRICS_ENABLED=0).
+    """
+    if not metrics.enabled:
+        return None
+    bot.session.middleware(_time_bot_api)
+    dp.update.outer_middleware(_time_update)
+    metrics.gauge("rag_cache_hit_rate", "Доля попаданий кэшей", _cache_gauges)
+    metrics.gauge("rag_cache_entries", "Записей в кэшах", _cache_sizes)
+    metrics.gauge("rag_rebuild_pending", "Источников в очереди на пересборку",
+                  lambda: {(): len(rebuild_queue.status()["pending"])})
+    metrics.gauge("rag_answer_requests", "Вопросы после кэша ответов: посчитанные и схлопнутые", _flights)
+    metrics.gauge("rag_answer_in_flight", "Ответов, которые считаются прямо сейчас",
+                  lambda: {(): inflight.stats()["in_flight"]})
+    runner = await start_metrics_server(METRICS_HOST, METRICS_PORT)
+    logging.info(f"📈  Метрики: http://{METRICS_HOST}:{METRICS_PORT}/metrics")
+    return runner
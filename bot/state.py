@@ -1,23 +1,272 @@
 # bot/state.py
+"""
+Состояние пользователей: выбранный сервис, дневная квота вопросов к LLM
+и флаг «в чате с оператором». Бэкенд выбирается STATE_BACKEND:
+
+  memory — LRU в памяти процесса на STATE_MAX_USERS пользователей;
+  sqlite — тот же LRU как кэш + отложенная пакетная запись в STATE_PATH,
+           состояние переживает рестарт;
+  redis  — всё в Redis (REDIS_URL), общее для нескольких процессов бота.
+
+Квота хранится как (день, счётчик): вчерашний счётчик просто считается
+нулём при следующем обращении, так что ежедневная чистка не нужна.
+"""
+from __future__ import annotations
+
 import asyncio
+import logging
+from collections import OrderedDict
+from datetime import date
+from typing import Dict, Optional
+
+from rag.config import (
+    STATE_BACKEND,
+    STATE_MAX_USERS,
+    STATE_PATH,
+    STATE_FLUSH_INTERVAL,
+    REDIS_URL,
+)
+
+
+def _today() -> int:
+    return date.today().toordinal()
+
+
+class _UserState:
+    __slots__ = ("source", "quota_day", "quota_count", "support")
+
+    def __init__(self, source: Optional[str] = None, quota_day: int = 0,
+                 quota_count: int = 0, support: bool = False):
+        self.source = source
+        self.quota_day = quota_day
+        self.quota_count = quota_count
+        self.support = support
+
+    def row(self, user_id: int) -> tuple:
+        return user_id, self.source, self.quota_day, self.quota_count, int(self.support)
+
+
+class MemoryState:
+    """
+    LRU на max_users пользователей. Все операции — O(1) и без блокировок:
+    хэндлеры работают в одном event‑loop, а между await состояние
+    не может поменяться «под ногами».
+    """
+
+    def __init__(self, max_users: int = STATE_MAX_USERS):
+        self._max_users = max_users
+        self._users: OrderedDict[int, _UserState] = OrderedDict()
+
+    async def open(self) -> None:
+        pass
+
+    async def close(self) -> None:
+        pass
+
+    # ── выбор сервиса ──
+    async def get_source(self, user_id: int) -> Optional[str]:
+        return (await self._get(user_id)).source
+
+    async def set_source(self, user_id: int, source: str) -> None:
+        st = await self._get(user_id)
+        st.source = source
+        self._changed(user_id, st)
+
+    # ── дневная квота ──
+    async def take_quota(self, user_id: int, limit: int) -> Optional[int]:
+        """
+        Засчитывает вопрос пользователя в квоту на сегодня.
+        Возвращает его номер за день или None, если лимит исчерпан.
+        """
+        st = await self._get(user_id)
+        today = _today()
+        if st.quota_day != today:
+            st.quota_day, st.quota_count = today, 0
+        if st.quota_count >= limit:
+            return None
+        st.quota_count += 1
+        self._changed(user_id, st)
+        return st.quota_count
+
+    # ── чат с оператором ──
+    async def support_enter(self, user_id: int) -> None:
+        await self._set_support(user_id, True)
+
+    async def support_leave(self, user_id: int) -> None:
+        await self._set_support(user_id, False)
+
+    async def support_active(self, user_id: int) -> bool:
+        return (await self._get(user_id)).support
+
+    async def _set_support(self, user_id: int, value: bool) -> None:
+        st = await self._get(user_id)
+        st.support = value
+        self._changed(user_id, st)
+
+    # ── LRU ──
+    async def _get(self, user_id: int) -> _UserState:
+        st = self._users.get(user_id)
+        if st is None:
+            st = await self._load(user_id)
+            # пока грузили, параллельный запрос мог уже положить запись
+            st = self._users.setdefault(user_id, st)
+            if len(self._users) > self._max_users:
+                self._users.popitem(last=False)
+        else:
+            self._users.move_to_end(user_id)
+        return st
+
+    async def _load(self, user_id: int) -> _UserState:
+        return _UserState()
+
+    def _changed(self, user_id: int, st: _UserState) -> None:
+        pass
+
+
+class SQLiteState(MemoryState):
+    """
+    MemoryState + SQLite. Изменения копятся в памяти и раз в flush_interval
+    секунд пишутся одной транзакцией (executemany); при промахе LRU
+    пользователь подгружается из файла. close() дописывает остаток.
+    """
+
+    def __init__(self, path: str = STATE_PATH, max_users: int = STATE_MAX_USERS,
+                 flush_interval: float = STATE_FLUSH_INTERVAL):
+        from db.db_data import Database
+
+        super().__init__(max_users)
+        self._db = Database(path, readers=1)
+        self._flush_interval = flush_interval
+        self._dirty: Dict[int, tuple] = {}
+        self._flushing: Dict[int, tuple] = {}     # уже отданы в транзакцию, но не закоммичены
+        self._task: Optional[asyncio.Task] = None
+
+    async def open(self) -> None:
+        async with self._db.transaction() as conn:
+            await conn.execute('''
+                CREATE TABLE IF NOT EXISTS user_state (
+                    user_id INTEGER PRIMARY KEY,
+                    source TEXT,
+                    quota_day INTEGER NOT NULL DEFAULT 0,
+                    quota_count INTEGER NOT NULL DEFAULT 0,
+                    support INTEGER NOT NULL DEFAULT 0
+                )
+            ''')
+        self._task = asyncio.create_task(self._flush_loop(), name="state-flush")
+
+    async def close(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        await self.flush()
+        await self._db.close()
+
+    async def flush(self) -> None:
+        if not self._dirty:
+            return
+        self._flushing, self._dirty = self._dirty, {}
+        rows = list(self._flushing.values())
+        try:
+            await self._write(rows)
+        except BaseException:
+            # вернём несохранённое, более свежие изменения не затираем
+            self._dirty = {**self._flushing, **self._dirty}
+            raise
+        finally:
+            self._flushing = {}
+
+    async def _write(self, rows: list) -> None:
+        async with self._db.transaction() as conn:
+            await conn.executemany('''
+                INSERT INTO user_state (user_id, source, quota_day, quota_count, support)
+                VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT(user_id) DO UPDATE SET
+                    source = excluded.source,
+                    quota_day = excluded.quota_day,
+                    quota_count = excluded.quota_count,
+                    support = excluded.support
+            ''', rows)
+
+    async def _flush_loop(self) -> None:
+        while True:
+            await asyncio.sleep(self._flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                logging.exception("Не удалось сохранить состояние пользователей")
+
+    async def _load(self, user_id: int) -> _UserState:
+        pending = self._dirty.get(user_id) or self._flushing.get(user_id)
+        if pending is not None:          # вытеснен из LRU, но ещё не записан
+            return _UserState(pending[1], pending[2], pending[3], bool(pending[4]))
+        async with self._db.reader() as conn:
+            cursor = await conn.execute(
+                "SELECT source, quota_day, quota_count, support FROM user_state WHERE user_id = ?",
+                (user_id,),
+            )
+            row = await cursor.fetchone()
+        if row is None:
+            return _UserState()
+        return _UserState(row[0], row[1], row[2], bool(row[3]))
+
+    def _changed(self, user_id: int, st: _UserState) -> None:
+        self._dirty[user_id] = st.row(user_id)
+
+
+class RedisState:
+    """
+    Состояние в Redis: хэш user:<id> (source, support) и счётчик
+    quota:<id>:<день> с TTL двое суток — просроченные квоты удаляет сам Redis.
+    client можно передать готовый (например, fakeredis для локальной проверки).
+    """
+
+    def __init__(self, url: str = REDIS_URL, client=None):
+        if client is None:
+            from redis.asyncio import Redis
+            client = Redis.from_url(url, decode_responses=True)
+        self._redis = client
+
+    async def open(self) -> None:
+        await self._redis.ping()
+
+    async def close(self) -> None:
+        await self._redis.aclose()
+
+    async def get_source(self, user_id: int) -> Optional[str]:
+        return await self._redis.hget(f"user:{user_id}", "source")
+
+    async def set_source(self, user_id: int, source: str) -> None:
+        await self._redis.hset(f"user:{user_id}", "source", source)
+
+    async def take_quota(self, user_id: int, limit: int) -> Optional[int]:
+        key = f"quota:{user_id}:{_today()}"
+        pipe = self._redis.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, 2 * 24 * 60 * 60)
+        count, _ = await pipe.execute()
+        if count > limit:
+            await self._redis.decr(key)
+            return None
+        return count
+
+    async def support_enter(self, user_id: int) -> None:
+        await self._redis.hset(f"user:{user_id}", "support", 1)
 
-class SupportStore:
-    """Потокобезопасное in‑memory хранилище обращений."""
-    def __init__(self):
-        self._lock = asyncio.Lock()
-        self._sessions: set[int] = set()     # user_ids
+    async def support_leave(self, user_id: int) -> None:
+        await self._redis.hdel(f"user:{user_id}", "support")
 
-    async def enter(self, user_id: int):
-        async with self._lock:
-            self._sessions.add(user_id)
+    async def support_active(self, user_id: int) -> bool:
+        return bool(await self._redis.hexists(f"user:{user_id}", "support"))
 
-    async def leave(self, user_id: int):
-        async with self._lock:
-            self._sessions.discard(user_id)
 
-    async def active(self, user_id: int) -> bool:
-        async with self._lock:
-            return user_id in self._sessions
+def make_state(backend: str = STATE_BACKEND):
+    if backend == "sqlite":
+        return SQLiteState()
+    if backend == "redis":
+        return RedisState()
+    if backend != "memory":
+        raise ValueError(f"Неизвестный STATE_BACKEND: {backend!r}")
+    return MemoryState()
 
 
-support_store = SupportStore()
\ No newline at end of file
+user_state = make_state()
@@ -0,0 +1,60 @@
+# bot/webhook.py
+"""
+Приём апдейтов через webhook вместо long polling.
+
+aiohttp‑сервер слушает WEBHOOK_HOST:WEBHOOK_PORT, путь WEBHOOK_PATH.
+Заголовок X-Telegram-Bot-Api-Secret-Token сверяется с секретом
+(иначе 401), а апдейт отдаётся диспетчеру фоновой задачей — Telegram
+получает 200 сразу, не дожидаясь поиска и LLM.
+"""
+import asyncio
+import logging
+import secrets
+from typing import Optional
+
+from aiogram import Bot, Dispatcher
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
+
+from rag.config import WEBHOOK_URL, WEBHOOK_PATH, WEBHOOK_HOST, WEBHOOK_PORT, WEBHOOK_SECRET
+
+
+def build_app(dp: Dispatcher, bot: Bot, secret: Optional[str], path: str = WEBHOOK_PATH) -> web.Application:
+    """aiohttp‑приложение с обработчиком апдейтов на path."""
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp,
+        bot=bot,
+        handle_in_background=True,
+        secret_token=secret,
+    ).register(app, path=path)
+    # startup/shutdown диспетчера и закрытие сессии бота — вместе с приложением
+    setup_application(app, dp, bot=bot)
+    return app
+
+
+async def run_webhook(dp: Dispatcher, bot: Bot) -> None:
+    """
+    Регистрирует webhook в Telegram (если задан WEBHOOK_URL) и обслуживает
+    его до отмены. Без WEBHOOK_SECRET секрет генерируется на запуск.
+    """
+    secret = WEBHOOK_SECRET
+    if WEBHOOK_URL:
+        secret = secret or secrets.token_urlsafe(32)
+        await bot.set_webhook(
+            WEBHOOK_URL.rstrip("/") + WEBHOOK_PATH,
+            secret_token=secret,
+            drop_pending_updates=True,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+    elif not secret:
+        logging.warning("⚠️  WEBHOOK_SECRET не задан: подпись входящих запросов не проверяется")
+
+    runner = web.AppRunner(build_app(dp, bot, secret), access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, WEBHOOK_HOST, WEBHOOK_PORT).start()
+    logging.info(f"🌐  Webhook: http://{WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await runner.cleanup()
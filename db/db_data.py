@@ -1,13 +1,130 @@
 # db/db_data.py
-import aiosqlite
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
 from datetime import datetime
+from typing import Callable, Iterable, Optional
+
+import aiosqlite
+
+from rag.metrics import metrics
 
 DATABASE_PATH = "data.db"  # имя файла базы данных
+READ_POOL_SIZE = 4         # сколько соединений держим под чтение
+
+# настройки каждого соединения: WAL позволяет читать параллельно с записью
+_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA busy_timeout=5000",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA cache_size=-16000",      # ~16 МБ страничного кэша
+    "PRAGMA mmap_size=134217728",    # 128 МБ
+)
+
+# подписчики на изменения данных источника: callback(source, action),
+# action — "add" или "delete"
+_source_listeners: list[Callable[[str, str], None]] = []
+
+def add_source_listener(callback: Callable[[str, str], None]):
+    """Регистрирует callback, который вызывается после изменения данных источника."""
+    _source_listeners.append(callback)
+
+def content_hash(content: str) -> str:
+    return hashlib.sha256(content.encode("utf-8")).hexdigest()
+
+def _notify(source: str, action: str):
+    for callback in _source_listeners:
+        try:
+            callback(source, action)
+        except Exception:
+            logging.exception(f"Ошибка подписчика на изменение источника {source!r}")
+
+
+class Database:
+    """
+    Долгоживущие соединения aiosqlite вместо connect() на каждый вызов:
+    одно соединение на запись (под asyncio.Lock) и пул на чтение.
+    Каждое соединение aiosqlite — это отдельный поток, поэтому
+    их число фиксировано и не растёт с числом запросов.
+    """
+
+    def __init__(self, path: str, readers: int = READ_POOL_SIZE):
+        self._path = path
+        self._readers_count = readers
+        self._writer: Optional[aiosqlite.Connection] = None
+        self._write_lock = asyncio.Lock()
+        self._readers: Optional[asyncio.Queue] = None
+        self._open_lock = asyncio.Lock()
+
+    async def _connect(self) -> aiosqlite.Connection:
+        # isolation_level=None — транзакциями управляем явно
+        conn = await aiosqlite.connect(self._path, isolation_level=None)
+        for pragma in _PRAGMAS:
+            await conn.execute(pragma)
+        return conn
+
+    async def open(self):
+        async with self._open_lock:
+            if self._writer is not None:
+                return
+            self._writer = await self._connect()
+            readers: asyncio.Queue = asyncio.Queue()
+            for _ in range(self._readers_count):
+                readers.put_nowait(await self._connect())
+            self._readers = readers
+
+    async def close(self):
+        async with self._open_lock:
+            if self._writer is None:
+                return
+            while not self._readers.empty():
+                await self._readers.get_nowait().close()
+            await self._writer.close()
+            self._writer, self._readers = None, None
+
+    @asynccontextmanager
+    async def reader(self):
+        """Соединение для чтения из пула."""
+        if self._writer is None:
+            await self.open()
+        readers = self._readers
+        conn = await readers.get()
+        try:
+            yield conn
+        finally:
+            readers.put_nowait(conn)
+
+    @asynccontextmanager
+    async def transaction(self):
+        """Единственное соединение на запись внутри BEGIN … COMMIT."""
+        if self._writer is None:
+            await self.open()
+        async with self._write_lock:
+            conn = self._writer
+            await conn.execute("BEGIN IMMEDIATE")
+            try:
+                yield conn
+            except BaseException:
+                await conn.execute("ROLLBACK")
+                raise
+            await conn.execute("COMMIT")
+
+
+db = Database(DATABASE_PATH)
+
+async def open_db():
+    """Открывает пул соединений (вызывается при старте бота)."""
+    await db.open()
+
+async def close_db():
+    await db.close()
 
 async def init_db_documents():
     """Инициализирует таблицу для хранения данных из сайтов."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute('''
+    async with db.transaction() as conn:
+        await conn.execute('''
             CREATE TABLE IF NOT EXISTS site_data (
                 id INTEGER PRIMARY KEY AUTOINCREMENT,
                 source TEXT,
@@ -16,21 +133,88 @@ async def init_db_documents():
                 created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
             )
         ''')
-        await db.commit()
+        # DISTINCT source и DELETE … WHERE source не сканируют тяжёлые content
+        await conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_site_data_source ON site_data(source)"
+        )
+        # хэш содержимого — чтобы повторный импорт не плодил дубликаты
+        cursor = await conn.execute("PRAGMA table_info(site_data)")
+        columns = {row[1] for row in await cursor.fetchall()}
+        if "content_hash" not in columns:
+            await conn.execute("ALTER TABLE site_data ADD COLUMN content_hash TEXT")
+        cursor = await conn.execute(
+            "SELECT id, content FROM site_data WHERE content_hash IS NULL"
+        )
+        backfill = [(content_hash(content), row_id) for row_id, content in await cursor.fetchall()]
+        if backfill:
+            await conn.executemany(
+                "UPDATE site_data SET content_hash = ? WHERE id = ?", backfill
+            )
 
 async def add_site_data(source: str, title: str, content: str):
     """Добавляет новую запись в таблицу site_data."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        await db.execute('''
-            INSERT INTO site_data (source, title, content, created_at)
-            VALUES (?, ?, ?, ?)
-        ''', (source, title, content, datetime.utcnow().isoformat()))
-        await db.commit()
+    await add_site_data_many([(source, title, content)])
+
+async def add_site_data_many(rows: Iterable[tuple[str, str, str]]):
+    """
+    Добавляет пачку записей (source, title, content) одной транзакцией.
+    Возвращает количество добавленных строк.
+    """
+    rows = list(rows)
+    if not rows:
+        return 0
+    await apply_site_data_changes(rows, [])
+    return len(rows)
+
+@metrics.timed("rag_db_seconds", op="apply_changes")
+async def apply_site_data_changes(inserts: Iterable[tuple[str, str, str]],
+                                  delete_ids: Iterable[int]):
+    """
+    Одной транзакцией удаляет строки по id и добавляет новые (source, title, content).
+    Подписчики получают уведомления по всем затронутым источникам.
+    """
+    now = datetime.utcnow().isoformat()
+    params = [(source, title, content, content_hash(content), now)
+              for source, title, content in inserts]
+    delete_ids = [(row_id,) for row_id in delete_ids]
+    if not params and not delete_ids:
+        return
+    async with db.transaction() as conn:
+        deleted_sources: dict[str, None] = {}
+        for i in range(0, len(delete_ids), 500):    # лимит переменных SQLite
+            part = [row_id for (row_id,) in delete_ids[i:i + 500]]
+            cursor = await conn.execute(
+                f"SELECT DISTINCT source FROM site_data WHERE id IN ({','.join('?' * len(part))})",
+                part,
+            )
+            deleted_sources.update((row[0], None) for row in await cursor.fetchall())
+        if delete_ids:
+            await conn.executemany("DELETE FROM site_data WHERE id = ?", delete_ids)
+        if params:
+            await conn.executemany('''
+                INSERT INTO site_data (source, title, content, content_hash, created_at)
+                VALUES (?, ?, ?, ?, ?)
+            ''', params)
+    # сначала удаления, потом добавления: при замене файла источник остаётся
+    for source in deleted_sources:
+        _notify(source, "delete")
+    for source in dict.fromkeys(p[0] for p in params):
+        _notify(source, "add")
+
+@metrics.timed("rag_db_seconds", op="get_hashes")
+async def get_site_data_hashes():
+    """Возвращает [(id, source, title, content_hash)] без загрузки самих текстов."""
+    async with db.reader() as conn:
+        cursor = await conn.execute(
+            "SELECT id, source, title, content_hash FROM site_data"
+        )
+        return await cursor.fetchall()
 
+@metrics.timed("rag_db_seconds", op="get_sources")
 async def get_all_sources():
     """Возвращает список уникальных источников (source) из таблицы site_data."""
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute("SELECT DISTINCT source FROM site_data")
+    async with db.reader() as conn:
+        cursor = await conn.execute("SELECT DISTINCT source FROM site_data")
         rows = await cursor.fetchall()
         # Вернём список источников (если строка пуста — не добавим)
         return [row[0] for row in rows]
@@ -40,10 +224,22 @@ async def delete_site_data_by_source(source: str):
     Удаляет все записи из site_data с указанным source.
     Возвращает количество удалённых строк.
     """
-    async with aiosqlite.connect(DATABASE_PATH) as db:
-        cursor = await db.execute(
-            "DELETE FROM site_data WHERE source = ?",
-            (source,)
-        )
-        await db.commit()
-        return cursor.rowcount
\ No newline at end of file
+    return (await delete_site_data_by_sources([source]))[source]
+
+@metrics.timed("rag_db_seconds", op="delete_sources")
+async def delete_site_data_by_sources(sources: Iterable[str]):
+    """
+    Удаляет записи нескольких источников одной транзакцией.
+    Возвращает {source: количество удалённых строк}.
+    """
+    deleted: dict[str, int] = {}
+    async with db.transaction() as conn:
+        for source in dict.fromkeys(sources):
+            cursor = await conn.execute(
+                "DELETE FROM site_data WHERE source = ?",
+                (source,)
+            )
+            deleted[source] = cursor.rowcount
+    for source in deleted:
+        _notify(source, "delete")
+    return deleted
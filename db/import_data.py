@@ -1,31 +1,103 @@
 # db/import_data.py
-import os
+#
+# Запуск из корня проекта:  python -m db.import_data [--workers 8]
+import argparse
 import asyncio
-from db_data import init_db_documents, add_site_data
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from db.db_data import (
+    init_db_documents,
+    close_db,
+    content_hash,
+    get_site_data_hashes,
+    apply_site_data_changes,
+)
 
 # Каталог, в котором лежат папки с данными.
 DATA_DIR = "data"
 
-async def import_all_data():
-    # Инициализируем таблицу, если ещё не создана.
-    await init_db_documents()
-    
+
+def _scan(data_dir: str):
+    """Возвращает [(source, title, path)] для всех .txt в подпапках data_dir."""
+    files = []
     # Проходим по всем элементам в каталоге DATA_DIR.
-    for entry in os.listdir(DATA_DIR):
-        subdir = os.path.join(DATA_DIR, entry)
+    for entry in sorted(os.listdir(data_dir)):
+        subdir = os.path.join(data_dir, entry)
         # Если элемент — папка, считаем её именем источника.
         if os.path.isdir(subdir):
-            source = entry  # имя папки будет использоваться как source
-            # Проходим по файлам внутри папки.
-            for filename in os.listdir(subdir):
+            for filename in sorted(os.listdir(subdir)):
                 if filename.endswith(".txt"):
-                    file_path = os.path.join(subdir, filename)
-                    with open(file_path, "r", encoding="utf-8") as f:
-                        content = f.read()
                     # Название файла (без расширения) используем как title.
                     title = os.path.splitext(filename)[0]
-                    await add_site_data(source, title, content)
-                    print(f"Импортирован файл: {source}/{filename}")
+                    files.append((entry, title, os.path.join(subdir, filename)))
+    return files
+
+
+def _read(path: str) -> str:
+    with open(path, "r", encoding="utf-8") as f:
+        return f.read()
+
+
+async def import_all_data(data_dir: str = DATA_DIR, workers: int = 8):
+    """
+    Идемпотентный импорт: файлы читаются параллельно, неизменённые
+    (по хэшу содержимого) пропускаются, изменённые заменяются,
+    всё пишется одной транзакцией.
+    """
+    started = time.perf_counter()
+    # Инициализируем таблицу, если ещё не создана.
+    await init_db_documents()
+
+    files = _scan(data_dir)
+    loop = asyncio.get_running_loop()
+    with ThreadPoolExecutor(max_workers=workers) as pool:
+        contents = await asyncio.gather(
+            *(loop.run_in_executor(pool, _read, path) for _, _, path in files)
+        )
+
+    # что уже лежит в БД: {(source, title): [(id, hash), …]}
+    existing: dict[tuple[str, str], list[tuple[int, str]]] = {}
+    for row_id, source, title, digest in await get_site_data_hashes():
+        existing.setdefault((source, title), []).append((row_id, digest))
+
+    inserts, delete_ids = [], []
+    skipped = replaced = added = 0
+    for (source, title, path), content in zip(files, contents):
+        rows = existing.get((source, title), [])
+        digest = content_hash(content)
+        keep = next((row_id for row_id, h in rows if h == digest), None)
+        if keep is not None:
+            # файл не менялся; заодно чистим дубликаты прошлых запусков
+            delete_ids.extend(row_id for row_id, _ in rows if row_id != keep)
+            skipped += 1
+            continue
+        delete_ids.extend(row_id for row_id, _ in rows)
+        inserts.append((source, title, content))
+        if rows:
+            replaced += 1
+            print(f"Обновлён файл: {source}/{os.path.basename(path)}")
+        else:
+            added += 1
+            print(f"Импортирован файл: {source}/{os.path.basename(path)}")
+
+    await apply_site_data_changes(inserts, delete_ids)
+    await close_db()
+
+    elapsed = time.perf_counter() - started
+    total_bytes = sum(len(c.encode("utf-8")) for c in contents)
+    print(
+        f"Файлов: {len(files)} (новых {added}, обновлено {replaced}, без изменений {skipped}), "
+        f"удалено устаревших строк: {len(delete_ids)}\n"
+        f"{total_bytes / 1e6:.2f} МБ за {elapsed:.2f} с — "
+        f"{len(files) / elapsed:.1f} файлов/с, {total_bytes / 1e6 / elapsed:.2f} МБ/с"
+    )
+
 
 if __name__ == "__main__":
-    asyncio.run(import_all_data())
\ No newline at end of file
+    parser = argparse.ArgumentParser(description="Импорт data/<source>/*.txt в site_data")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--workers", type=int, default=8, help="потоков чтения файлов")
+    args = parser.parse_args()
+    asyncio.run(import_all_data(args.data_dir, args.workers))
@@ -0,0 +1,137 @@
+# rag/answer_cache.py
+from __future__ import annotations
+
+import math
+import operator
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional, Tuple
+
+from .config import (
+    ANSWER_CACHE_MAX_ENTRIES,
+    ANSWER_CACHE_TTL,
+    ANSWER_CACHE_SIMILARITY,
+)
+from .text import normalize_question
+
+CacheKey = Tuple[str, str]              # (source, нормализованный вопрос)
+
+
+class _Entry:
+    __slots__ = ("answer", "vector", "expires_at")
+
+    def __init__(self, answer: str, vector: Optional[List[float]], expires_at: float):
+        self.answer = answer
+        self.vector = vector
+        self.expires_at = expires_at
+
+
+def _unit(vec: List[float]) -> List[float]:
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+def _dot(a: List[float], b: List[float]) -> float:
+    return sum(map(operator.mul, a, b))
+
+
+class AnswerCache:
+    """
+    Кэш готовых ответов в рамках одного source.
+    Попадание — точное совпадение нормализованного вопроса или
+    косинусная близость эмбеддингов не ниже threshold.
+    Записи живут ttl секунд, при переполнении вытесняются по LRU.
+    """
+
+    def __init__(self, max_entries: int, ttl: float, threshold: float,
+                 embed: Optional[Callable[[str], List[float]]] = None):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._threshold = threshold
+        self._embed = embed if threshold > 0 else None
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[CacheKey, _Entry] = OrderedDict()
+        self._by_source: Dict[str, Dict[str, _Entry]] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def lookup(self, source: str, question: str) -> Optional[str]:
+        key = (source, normalize_question(question))
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry.answer
+            if not self._embed or not self._by_source.get(source):
+                self.misses += 1
+                return None
+
+        # эмбеддинг считаем вне блокировки — он может уйти в сеть
+        query = _unit(self._embed(key[1]))
+        with self._lock:
+            best_key, best_score = None, self._threshold
+            for norm, entry in self._by_source.get(source, {}).items():
+                if entry.vector is None or entry.expires_at <= now:
+                    continue
+                score = _dot(query, entry.vector)
+                if score >= best_score:
+                    best_key, best_score = (source, norm), score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key].answer
+
+    def store(self, source: str, question: str, answer: str) -> None:
+        norm = normalize_question(question)
+        vector = _unit(self._embed(norm)) if self._embed else None
+        entry = _Entry(answer, vector, time.time() + self._ttl)
+        with self._lock:
+            self._drop((source, norm))
+            self._entries[(source, norm)] = entry
+            self._by_source.setdefault(source, {})[norm] = entry
+            while len(self._entries) > self._max_entries:
+                self._drop(next(iter(self._entries)))
+
+    def invalidate(self, source: str) -> None:
+        """Забывает все ответы по источнику — вызывается при изменении его данных."""
+        with self._lock:
+            for norm in list(self._by_source.get(source, ())):
+                self._drop((source, norm))
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
+
+    # вызывается под self._lock
+    def _drop(self, key: CacheKey) -> None:
+        if self._entries.pop(key, None) is None:
+            return
+        source, norm = key
+        bucket = self._by_source.get(source)
+        if bucket is not None:
+            bucket.pop(norm, None)
+            if not bucket:
+                del self._by_source[source]
+
+
+def _embed_question(text: str) -> List[float]:
+    from .embeddings import get_embeddings
+    return get_embeddings().embed_query(text)
+
+
+answer_cache = AnswerCache(
+    max_entries=ANSWER_CACHE_MAX_ENTRIES,
+    ttl=ANSWER_CACHE_TTL,
+    threshold=ANSWER_CACHE_SIMILARITY,
+    embed=_embed_question,
+)
@@ -0,0 +1,131 @@
+# rag/compact.py
+"""
+Уборка каталога vectorstore/ от того, что уже никто не читает:
+
+  • всё в корне, что не является шардом src_* — сегменты UUID и
+    chroma.sqlite3 от старого единого индекса;
+  • шарды источников, которых больше нет в site_data;
+  • версии шарда старше KEEP_VERSIONS и недостроенные версии старше CURRENT;
+  • сегменты UUID внутри версии Chroma, на которые не ссылается её chroma.sqlite3;
+  • забытые *.tmp после прерванной записи.
+
+    python -m rag.compact --dry-run
+    python -m rag.compact
+"""
+from __future__ import annotations
+
+import argparse
+import re
+import shutil
+import sqlite3
+from pathlib import Path
+from typing import List, Tuple
+
+from .vectorestore import (
+    BASE_DIR,
+    CURRENT_NAME,
+    KEEP_VERSIONS,
+    MANIFEST_NAME,
+    list_sources,
+    shard_name,
+)
+
+_UUID = re.compile(r"^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}$")
+
+
+def _size(path: Path) -> int:
+    if path.is_file():
+        return path.stat().st_size
+    return sum(p.stat().st_size for p in path.rglob("*") if p.is_file())
+
+
+def _chroma_segments(version: Path) -> set[str] | None:
+    """id сегментов, известных chroma.sqlite3 версии (None — это не Chroma)."""
+    db_path = version / "chroma.sqlite3"
+    if not db_path.exists():
+        return None
+    conn = sqlite3.connect(f"file:{db_path}?mode=ro", uri=True)
+    try:
+        return {row[0] for row in conn.execute("SELECT id FROM segments")}
+    except sqlite3.Error:
+        return None
+    finally:
+        conn.close()
+
+
+def _orphans_in_shard(root: Path) -> List[Path]:
+    orphans = [p for p in root.glob("*.tmp")]
+    try:
+        current = (root / CURRENT_NAME).read_text(encoding="utf-8").strip()
+    except OSError:
+        current = None
+    versions = sorted(p for p in root.iterdir() if p.is_dir() and p.name.startswith("v"))
+    keep = {p.name for p in versions[-KEEP_VERSIONS:]}
+    for version in versions:
+        if version.name == current:
+            continue
+        if version.name not in keep:
+            orphans.append(version)
+        elif current and version.name < current and not (version / MANIFEST_NAME).exists():
+            # сборка, прерванная до записи манифеста; более новые могут ещё строиться
+            orphans.append(version)
+
+    for version in versions:
+        if version in orphans:
+            continue
+        orphans.extend(version.glob("*.tmp"))
+        segments = _chroma_segments(version)
+        if segments is None:
+            continue
+        orphans.extend(
+            p for p in version.iterdir()
+            if p.is_dir() and _UUID.match(p.name) and p.name not in segments
+        )
+    return orphans
+
+
+def find_orphans() -> List[Path]:
+    if not BASE_DIR.exists():
+        return []
+    live = {shard_name(source) for source in list_sources()}
+    orphans = []
+    for path in sorted(BASE_DIR.iterdir()):
+        if not path.name.startswith("src_") or not path.is_dir():
+            orphans.append(path)                 # наследие единого индекса
+        elif path.name not in live:
+            orphans.append(path)                 # источник удалён из БД
+        else:
+            orphans.extend(_orphans_in_shard(path))
+    return orphans
+
+
+def compact(dry_run: bool = False) -> List[Tuple[Path, int]]:
+    """Удаляет осиротевшие файлы и каталоги. Возвращает [(путь, байт)]."""
+    removed = []
+    for path in find_orphans():
+        size = _size(path)
+        removed.append((path, size))
+        if dry_run:
+            continue
+        if path.is_dir():
+            shutil.rmtree(path, ignore_errors=True)
+        else:
+            path.unlink(missing_ok=True)
+    return removed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Удаляет осиротевшие сегменты из vectorstore/")
+    parser.add_argument("--dry-run", action="store_true", help="только показать, что будет удалено")
+    args = parser.parse_args()
+
+    removed = compact(dry_run=args.dry_run)
+    for path, size in removed:
+        print(f"{'🔎' if args.dry_run else '🗑'}  {path} ({size / 1024:.1f} КБ)")
+    total = sum(size for _, size in removed)
+    verb = "Будет освобождено" if args.dry_run else "Освобождено"
+    print(f"{verb}: {total / 2**20:.2f} МБ, объектов: {len(removed)}")
+
+
+if __name__ == "__main__":
+    main()
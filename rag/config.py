@@ -11,4 +11,104 @@ DATA_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "info.txt")
 
 # Общие настройки для LLM (параметры ChatGPT)
 LLM_MODEL_NAME = "gpt-4o-mini"
-TEMPERATURE = 1.0
\ No newline at end of file
+TEMPERATURE = 1.0
+
+# Эмбеддинги и их локальный кэш
+EMBEDDING_MODEL_NAME = os.getenv("EMBEDDING_MODEL_NAME", "text-embedding-ada-002")
+EMBED_CACHE_PATH = os.getenv("EMBED_CACHE_PATH", "embeddings_cache.db")
+EMBED_CACHE_MAX_ENTRIES = int(os.getenv("EMBED_CACHE_MAX_ENTRIES", "200000"))
+
+# Ответы: сколько вопросов обрабатываем одновременно и сколько ждём ответа (сек)
+ANSWER_CONCURRENCY = int(os.getenv("ANSWER_CONCURRENCY", "8"))
+ANSWER_TIMEOUT = float(os.getenv("ANSWER_TIMEOUT", "60"))
+
+# История диалогов: по (пользователь, сервис), с лимитом по токенам
+HISTORY_MAX_SESSIONS = int(os.getenv("HISTORY_MAX_SESSIONS", "10000"))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", "1000"))
+HISTORY_IDLE_TTL = float(os.getenv("HISTORY_IDLE_TTL", str(6 * 60 * 60)))
+HISTORY_PATH = os.getenv("HISTORY_PATH")  # если задан (например, history.json) — история переживает рестарт
+HISTORY_SAVE_INTERVAL = float(os.getenv("HISTORY_SAVE_INTERVAL", "30"))  # сек между сохранениями на диск
+
+# Кэш готовых ответов по самостоятельному вопросу (после переформулировки по
+# истории): точное совпадение нормализованного текста или близость эмбеддингов.
+# Поиск по близости по умолчанию выключен (0 — только точное): у ada-002 косинус
+# коротких вопросов почти всегда > 0.9, и «как оплатить картой» совпадает
+# с «как оплатить наличными» сильнее, чем многие настоящие перефразы друг с другом,
+# так что общего безопасного порога нет. Размеченных пар перефраз по data/ у нас
+# нет, поэтому и подобранного значения тоже: включайте порог (обычно 0.97–0.98),
+# только проверив его на вопросах своего сервиса.
+ANSWER_CACHE_MAX_ENTRIES = int(os.getenv("ANSWER_CACHE_MAX_ENTRIES", "2000"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 60 * 60)))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", "0"))
+
+# Фоновая пересборка индекса: сколько секунд копим заявки перед сборкой
+REBUILD_DEBOUNCE = float(os.getenv("REBUILD_DEBOUNCE", "2"))
+
+# Эмбеддинг при сборке индекса: размер батча в токенах, параллелизм, ретраи на 429
+OPENAI_API_BASE = os.getenv("OPENAI_API_BASE")  # например, локальный stub‑сервер
+EMBED_BATCH_TOKENS = int(os.getenv("EMBED_BATCH_TOKENS", "8000"))
+EMBED_CONCURRENCY = int(os.getenv("EMBED_CONCURRENCY", "4"))
+EMBED_MAX_RETRIES = int(os.getenv("EMBED_MAX_RETRIES", "6"))
+
+# Стриминг ответа в Telegram: включён ли и как часто можно редактировать сообщение (сек)
+STREAM_ANSWERS = os.getenv("STREAM_ANSWERS", "1") == "1"
+STREAM_EDIT_INTERVAL = float(os.getenv("STREAM_EDIT_INTERVAL", "1.0"))
+
+# Поиск: гибрид BM25 + векторы со слиянием по RRF
+HYBRID_SEARCH = os.getenv("HYBRID_SEARCH", "1") == "1"
+RETRIEVER_K = int(os.getenv("RETRIEVER_K", "5"))
+RETRIEVER_FETCH_K = int(os.getenv("RETRIEVER_FETCH_K", "20"))   # кандидатов из каждого поиска
+RRF_K = int(os.getenv("RRF_K", "60"))
+# быстрый путь без эмбеддинга запроса: лучший BM25‑score не ниже MIN_SCORE
+# и во столько раз выше второго (0 — выключено)
+LEXICAL_FAST_MIN_SCORE = float(os.getenv("LEXICAL_FAST_MIN_SCORE", "8"))
+LEXICAL_FAST_RATIO = float(os.getenv("LEXICAL_FAST_RATIO", "2"))
+
+# Сборка контекста для LLM: склейка соседних чанков, отсев дублей, MMR
+# и упаковка в бюджет токенов; ретривер отдаёт CONTEXT_FETCH_K кандидатов
+CONTEXT_ASSEMBLY = os.getenv("CONTEXT_ASSEMBLY", "1") == "1"
+CONTEXT_FETCH_K = int(os.getenv("CONTEXT_FETCH_K", "12"))
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+CONTEXT_MMR_LAMBDA = float(os.getenv("CONTEXT_MMR_LAMBDA", "0.7"))      # 1 — только релевантность
+CONTEXT_DEDUP_SIMILARITY = float(os.getenv("CONTEXT_DEDUP_SIMILARITY", "0.95"))
+
+# Хранилище векторов шарда: "chroma" или "numpy" (точный поиск по memmap‑матрице)
+VECTOR_BACKEND = os.getenv("VECTOR_BACKEND", "chroma")
+# Компактное хранение для numpy‑бэкенда: "none", "int8" или "float16";
+# кандидатов на точный пересчёт по float32 — k × VECTOR_RESCORE
+VECTOR_QUANTIZATION = os.getenv("VECTOR_QUANTIZATION", "none")
+VECTOR_RESCORE = int(os.getenv("VECTOR_RESCORE", "4"))
+# int8 проверен только на синтетических векторах (bench.quant_bench --stub):
+# recall на настоящих эмбеддингах корпусов data/ не измерен. Без явного
+# VECTOR_INT8_UNVALIDATED=1 режим int8 заменяется точным float32 (см. rag.vectorestore)
+VECTOR_INT8_UNVALIDATED = os.getenv("VECTOR_INT8_UNVALIDATED", "0") == "1"
+
+# Кэш эмбеддингов вопросов в памяти: повторный вопрос не ходит ни в SQLite, ни в сеть
+QUERY_EMBED_CACHE_SIZE = int(os.getenv("QUERY_EMBED_CACHE_SIZE", "2000"))
+QUERY_EMBED_CACHE_TTL = float(os.getenv("QUERY_EMBED_CACHE_TTL", str(24 * 60 * 60)))
+
+# Метрики Prometheus на локальном HTTP‑эндпоинте /metrics (по умолчанию выключены)
+METRICS_ENABLED = os.getenv("METRICS_ENABLED", "0") == "1"
+METRICS_HOST = os.getenv("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.getenv("METRICS_PORT", "9108"))
+
+# Состояние пользователей (выбранный сервис, квота, чат с оператором): memory | sqlite | redis
+STATE_BACKEND = os.getenv("STATE_BACKEND", "memory")
+STATE_MAX_USERS = int(os.getenv("STATE_MAX_USERS", "100000"))      # размер LRU в памяти
+STATE_PATH = os.getenv("STATE_PATH", "state.db")
+STATE_FLUSH_INTERVAL = float(os.getenv("STATE_FLUSH_INTERVAL", "2"))  # пакетная запись, сек
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+
+# Приём апдейтов: "polling" или "webhook" (aiohttp‑сервер, обычно за nginx с TLS)
+BOT_MODE = os.getenv("BOT_MODE", "polling")
+WEBHOOK_URL = os.getenv("WEBHOOK_URL")          # публичный https‑адрес; без него set_webhook не вызываем
+WEBHOOK_PATH = os.getenv("WEBHOOK_PATH", "/telegram")
+WEBHOOK_HOST = os.getenv("WEBHOOK_HOST", "127.0.0.1")
+WEBHOOK_PORT = int(os.getenv("WEBHOOK_PORT", "8080"))
+WEBHOOK_SECRET = os.getenv("WEBHOOK_SECRET")    # X-Telegram-Bot-Api-Secret-Token
+
+# Пул процессов для ответов: 0 — всё в процессе бота; N — вопросы уходят в N воркеров
+# по user_id % N (история пользователя живёт в одном воркере). Воркерам ставится
+# INDEX_READ_ONLY=1: они только открывают текущие версии шардов, собирает их бот.
+WORKER_PROCESSES = int(os.getenv("WORKER_PROCESSES", "0"))
+INDEX_READ_ONLY = os.getenv("INDEX_READ_ONLY", "0") == "1"
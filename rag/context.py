@@ -0,0 +1,193 @@
+# rag/context.py
+"""
+Сборка контекста между поиском и генерацией. Из кандидатов ретривера:
+  1) соседние чанки одной строки БД склеиваются в один фрагмент
+     (перекрытие CHUNK_OVERLAP при этом не повторяется);
+  2) почти‑дубликаты (косинус ≥ CONTEXT_DEDUP_SIMILARITY) отбрасываются;
+  3) порядок выбирается MMR: релевантность по рангу ретривера
+     против похожести на уже выбранное;
+  4) фрагменты упаковываются в CONTEXT_MAX_TOKENS токенов tiktoken.
+Векторы чанков читаются из самого шарда (посчитаны при его сборке):
+ни эмбеддера, ни записей в SQLite‑кэш эмбеддингов на вопрос.
+Сэкономленные токены — в метрике rag_context_tokens и в debug‑логе.
+"""
+from __future__ import annotations
+
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .config import (
+    RETRIEVER_K,
+    CONTEXT_MAX_TOKENS,
+    CONTEXT_MMR_LAMBDA,
+    CONTEXT_DEDUP_SIMILARITY,
+)
+from .metrics import TOKEN_BUCKETS, metrics
+from .tokens import count_tokens, truncate_tokens
+
+metrics.histogram("rag_context_tokens", "Токены контекста: исходные, после сборки, сэкономлено",
+                  TOKEN_BUCKETS)
+
+# перекрытие соседних чанков не длиннее этого (с запасом к CHUNK_OVERLAP)
+_MAX_OVERLAP = 300
+
+
+def _join(left: str, right: str) -> str:
+    """Склеивает соседние чанки, убирая общий хвост/начало."""
+    for n in range(min(len(left), len(right), _MAX_OVERLAP), 0, -1):
+        if left.endswith(right[:n]):
+            return left + right[n:]
+    return left + "\n" + right
+
+
+def _merge_adjacent(docs: List[Document]) -> List[Tuple[Document, List[int]]]:
+    """
+    Склеивает идущие подряд чанки одной строки. Возвращает фрагменты
+    в порядке лучшего ранга их частей и индексы частей во входном списке.
+    """
+    rows: Dict[Any, List[int]] = {}
+    for i, doc in enumerate(docs):
+        rows.setdefault((doc.metadata.get("source"), doc.metadata.get("row_id")), []).append(i)
+
+    merged: List[Tuple[int, Document, List[int]]] = []
+    for indices in rows.values():
+        indices.sort(key=lambda i: docs[i].metadata.get("chunk", 0))
+        run = [indices[0]]
+        for i in indices[1:]:
+            if docs[i].metadata.get("chunk", 0) == docs[run[-1]].metadata.get("chunk", 0) + 1:
+                run.append(i)
+            else:
+                merged.append(_fragment(docs, run))
+                run = [i]
+        merged.append(_fragment(docs, run))
+    merged.sort(key=lambda item: item[0])
+    return [(doc, parts) for _, doc, parts in merged]
+
+
+def _fragment(docs: List[Document], run: List[int]) -> Tuple[int, Document, List[int]]:
+    first = docs[run[0]]
+    if len(run) == 1:
+        return run[0], first, run
+    text = first.page_content
+    for i in run[1:]:
+        text = _join(text, docs[i].page_content)
+    metadata = {**first.metadata, "chunks": [docs[i].metadata.get("chunk") for i in run]}
+    return min(run), Document(page_content=text, metadata=metadata), run
+
+
+def _mmr(vectors: np.ndarray, k: int, mmr_lambda: float,
+         dedup_similarity: float) -> Tuple[List[int], int]:
+    """
+    MMR по нормированным векторам; вход уже упорядочен по релевантности.
+    Возвращает выбранные индексы и число отброшенных почти‑дубликатов.
+    """
+    n = len(vectors)
+    relevance = 1.0 - np.arange(n) / max(n, 1)
+    similarity = vectors @ vectors.T
+    selected: List[int] = []
+    max_sim = np.full(n, -np.inf)
+    alive = np.ones(n, dtype=bool)
+    duplicates = 0
+    while len(selected) < k and alive.any():
+        scores = np.where(alive, mmr_lambda * relevance
+                          - (1 - mmr_lambda) * np.maximum(max_sim, 0), -np.inf)
+        best = int(np.argmax(scores))
+        selected.append(best)
+        alive[best] = False
+        max_sim = np.maximum(max_sim, similarity[best])
+        dups = alive & (similarity[best] >= dedup_similarity)
+        duplicates += int(dups.sum())
+        alive &= ~dups
+    return selected, duplicates
+
+
+def assemble(docs: List[Document], vectors: Optional[List[Any]] = None, k: int = RETRIEVER_K,
+             max_tokens: int = CONTEXT_MAX_TOKENS, mmr_lambda: float = CONTEXT_MMR_LAMBDA,
+             dedup_similarity: float = CONTEXT_DEDUP_SIMILARITY) -> Tuple[List[Document], Dict[str, int]]:
+    """
+    Собирает контекст из кандидатов docs (по убыванию релевантности).
+    vectors — векторы docs в том же порядке; без них (или если какого‑то
+    нет) дубликаты отсеиваются только по точному совпадению текста.
+    Возвращает документы для промпта и статистику токенов.
+    """
+    raw_tokens = sum(count_tokens(d.page_content) for d in docs[:k])
+    fragments = _merge_adjacent(docs)
+
+    if vectors is not None and len(fragments) > 1 and all(v is not None for v in vectors):
+        parts = np.asarray(vectors, dtype=np.float32)
+        vectors = np.stack([parts[indices].sum(axis=0) for _, indices in fragments])
+        vectors /= np.maximum(np.linalg.norm(vectors, axis=1, keepdims=True), 1e-12)
+        order, duplicates = _mmr(vectors, k, mmr_lambda, dedup_similarity)
+    else:
+        seen = set()
+        order = []
+        for i, (doc, _) in enumerate(fragments):
+            if doc.page_content not in seen:
+                seen.add(doc.page_content)
+                order.append(i)
+        duplicates = len(fragments) - len(order)
+        order = order[:k]
+
+    packed: List[Document] = []
+    used = 0
+    for i in order:
+        doc = fragments[i][0]
+        tokens = count_tokens(doc.page_content)
+        if used + tokens > max_tokens:
+            if packed:
+                continue                 # может влезть следующий, покороче
+            # самый релевантный фрагмент берём всегда, пусть и обрезанным
+            doc = Document(page_content=truncate_tokens(doc.page_content, max_tokens),
+                           metadata=doc.metadata)
+            tokens = max_tokens
+        packed.append(doc)
+        used += tokens
+
+    stats = {
+        "raw_tokens": raw_tokens,
+        "tokens": used,
+        "saved_tokens": max(raw_tokens - used, 0),
+        "merged": len(docs) - len(fragments),
+        "duplicates": duplicates,
+    }
+    return packed, stats
+
+
+class ContextRetriever(BaseRetriever):
+    """
+    Обёртка над ретривером шарда: берёт у base расширенный список
+    кандидатов и отдаёт цепочке собранный контекст (см. assemble).
+    Векторы кандидатов читаются из vectorstore — того же шарда, что у base.
+    """
+
+    base: BaseRetriever
+    vectorstore: Optional[Any] = None
+    k: int = RETRIEVER_K
+    max_tokens: int = CONTEXT_MAX_TOKENS
+    mmr_lambda: float = CONTEXT_MMR_LAMBDA
+    dedup_similarity: float = CONTEXT_DEDUP_SIMILARITY
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        candidates = self.base.invoke(query, config={"callbacks": run_manager.get_child()})
+        with metrics.timer("rag_stage_seconds", stage="context"):
+            vectors = None
+            if self.vectorstore is not None and len(candidates) > 1:
+                from .vectorestore import stored_vectors
+                vectors = stored_vectors(self.vectorstore, candidates)
+            docs, stats = assemble(candidates, vectors, self.k, self.max_tokens,
+                                   self.mmr_lambda, self.dedup_similarity)
+        metrics.observe("rag_context_tokens", stats["raw_tokens"], kind="raw")
+        metrics.observe("rag_context_tokens", stats["tokens"], kind="packed")
+        metrics.observe("rag_context_tokens", stats["saved_tokens"], kind="saved")
+        logging.debug(
+            f"✂️  Контекст: {stats['raw_tokens']} → {stats['tokens']} токенов "
+            f"(−{stats['saved_tokens']}), склеено {stats['merged']}, дублей {stats['duplicates']}"
+        )
+        return docs
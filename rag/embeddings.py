@@ -0,0 +1,316 @@
+# rag/embeddings.py
+from __future__ import annotations
+
+import hashlib
+import random
+import sqlite3
+import threading
+import time
+from array import array
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from typing import Callable, Dict, List, Optional, Tuple
+
+from langchain_core.embeddings import Embeddings
+from langchain_openai import OpenAIEmbeddings
+
+from .config import (
+    OPENAI_API_KEY,
+    OPENAI_API_BASE,
+    EMBEDDING_MODEL_NAME,
+    EMBED_CACHE_PATH,
+    EMBED_CACHE_MAX_ENTRIES,
+    EMBED_BATCH_TOKENS,
+    EMBED_CONCURRENCY,
+    EMBED_MAX_RETRIES,
+    QUERY_EMBED_CACHE_SIZE,
+    QUERY_EMBED_CACHE_TTL,
+)
+from .metrics import metrics
+from .text import normalize_question
+from .tokens import count_tokens
+
+_SQL_CHUNK = 500                        # не упираемся в лимит переменных SQLite
+_MAX_BATCH_TEXTS = 2048                 # лимит OpenAI на число входов в одном запросе
+
+OnBatch = Callable[[List[int], List[List[float]]], None]
+
+
+def _text_hash(text: str) -> str:
+    return hashlib.sha256(text.encode("utf-8")).hexdigest()
+
+
+def _is_rate_limit(exc: Exception) -> bool:
+    return getattr(exc, "status_code", None) == 429 or type(exc).__name__ == "RateLimitError"
+
+
+class QueryEmbeddingCache:
+    """
+    Маленький LRU‑кэш эмбеддингов вопросов в памяти процесса, с TTL.
+    Ключ — нормализованный вопрос, так что «Как отменить подписку?» и
+    «как отменить подписку» дают одно попадание без SQLite и без сети.
+    """
+
+    def __init__(self, max_entries: int, ttl: float):
+        self._max_entries = max_entries
+        self._ttl = ttl
+        self._lock = threading.Lock()
+        self._entries: OrderedDict[str, Tuple[List[float], float]] = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: str) -> Optional[List[float]]:
+        now = time.monotonic()
+        with self._lock:
+            item = self._entries.get(key)
+            if item is not None and item[1] > now:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return item[0]
+            if item is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key: str, vector: List[float]) -> None:
+        if self._max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (vector, time.monotonic() + self._ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self._max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, float]:
+        total = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / total if total else 0.0,
+            "size": len(self._entries),
+        }
+
+
+class CachedEmbeddings(Embeddings):
+    """
+    Обёртка над эмбеддером с постоянным кэшем на диске (SQLite).
+    Ключ — (модель, sha256 текста), значение — float32‑вектор.
+    При превышении max_entries вытесняются давно не использованные записи.
+    Промахи кэша эмбеддятся батчами по batch_tokens токенов,
+    не более concurrency запросов одновременно.
+    Вопросы (embed_query) сперва ищутся в QueryEmbeddingCache в памяти.
+    """
+
+    def __init__(self, inner: Embeddings, model: str,
+                 path: str | Path, max_entries: int,
+                 batch_tokens: int = EMBED_BATCH_TOKENS,
+                 concurrency: int = EMBED_CONCURRENCY,
+                 max_retries: int = EMBED_MAX_RETRIES):
+        self._inner = inner
+        self._model = model
+        self._max_entries = max_entries
+        self._batch_tokens = batch_tokens
+        self._concurrency = concurrency
+        self._max_retries = max_retries
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(str(path), check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute('''
+            CREATE TABLE IF NOT EXISTS embeddings (
+                model TEXT NOT NULL,
+                hash TEXT NOT NULL,
+                vector BLOB NOT NULL,
+                used_at REAL NOT NULL,
+                PRIMARY KEY (model, hash)
+            )
+        ''')
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS idx_embeddings_used_at ON embeddings(used_at)"
+        )
+        self._conn.commit()
+        self._size = self._conn.execute("SELECT COUNT(*) FROM embeddings").fetchone()[0]
+        self.hits = 0
+        self.misses = 0
+        self.queries = QueryEmbeddingCache(QUERY_EMBED_CACHE_SIZE, QUERY_EMBED_CACHE_TTL)
+
+    # ────────────────────────────────────────────────
+    #   Embeddings API
+    # ────────────────────────────────────────────────
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        result: List[Optional[List[float]]] = [None] * len(texts)
+
+        def put(indices: List[int], vectors: List[List[float]]) -> None:
+            for i, vec in zip(indices, vectors):
+                result[i] = vec
+
+        self.embed_streaming(texts, put)
+        return result
+
+    @metrics.timed("rag_stage_seconds", stage="embed_query")
+    def embed_query(self, text: str) -> List[float]:
+        # нормализованный вопрос — только ключ кэша в памяти; эмбеддим
+        # (и ищем в SQLite) исходный текст, чтобы вектор поиска не менялся
+        key = normalize_question(text) or text
+        vec = self.queries.get(key)
+        if vec is not None:
+            return vec
+        h = _text_hash(text)
+        found = self._lookup([h])
+        with self._lock:
+            if h in found:
+                self.hits += 1
+            else:
+                self.misses += 1
+        if h in found:
+            vec = found[h]
+        else:
+            vec = self._inner.embed_query(text)
+            self._store({h: vec})
+        self.queries.put(key, vec)
+        return vec
+
+    def embed_streaming(self, texts: List[str], on_batch: OnBatch) -> None:
+        """
+        Эмбеддит texts, отдавая результат по частям: on_batch(индексы, векторы)
+        вызывается в текущем потоке сразу для попаданий в кэш, а затем по мере
+        готовности каждого батча промахов — векторы можно сразу писать в хранилище.
+        """
+        hashes = [_text_hash(t) for t in texts]
+        found = self._lookup(hashes)
+
+        positions: Dict[str, List[int]] = {}
+        for i, h in enumerate(hashes):
+            positions.setdefault(h, []).append(i)
+        # каждый уникальный промах считаем и эмбеддим один раз
+        missing = [(h, texts[pos[0]]) for h, pos in positions.items() if h not in found]
+
+        with self._lock:
+            self.hits += sum(1 for h in hashes if h in found)
+            self.misses += len(missing)
+
+        cached = [i for i, h in enumerate(hashes) if h in found]
+        if cached:
+            on_batch(cached, [found[hashes[i]] for i in cached])
+        if not missing:
+            return
+
+        with ThreadPoolExecutor(max_workers=self._concurrency) as pool:
+            futures = {
+                pool.submit(self._embed_with_retry, [t for _, t in batch]): batch
+                for batch in self._pack(missing)
+            }
+            for future in as_completed(futures):
+                batch = futures[future]
+                computed = {h: vec for (h, _), vec in zip(batch, future.result())}
+                self._store(computed)
+                indices = [i for h in computed for i in positions[h]]
+                on_batch(indices, [computed[hashes[i]] for i in indices])
+
+    def stats(self) -> Dict[str, int]:
+        return {"hits": self.hits, "misses": self.misses, "size": self._size}
+
+    def query_stats(self) -> Dict[str, float]:
+        """Статистика кэша эмбеддингов вопросов в памяти."""
+        return self.queries.stats()
+
+    # ────────────────────────────────────────────────
+    #   Внутренности
+    # ────────────────────────────────────────────────
+    def _pack(self, items: List[Tuple[str, str]]) -> List[List[Tuple[str, str]]]:
+        """Жадно раскладывает тексты по батчам не больше batch_tokens токенов."""
+        batches: List[List[Tuple[str, str]]] = []
+        current: List[Tuple[str, str]] = []
+        tokens = 0
+        for item in items:
+            n = count_tokens(item[1], self._model)
+            if current and (tokens + n > self._batch_tokens or len(current) >= _MAX_BATCH_TEXTS):
+                batches.append(current)
+                current, tokens = [], 0
+            current.append(item)
+            tokens += n
+        if current:
+            batches.append(current)
+        return batches
+
+    def _embed_with_retry(self, batch: List[str]) -> List[List[float]]:
+        delay = 1.0
+        for attempt in range(self._max_retries + 1):
+            try:
+                return self._inner.embed_documents(batch)
+            except Exception as exc:
+                if not _is_rate_limit(exc) or attempt == self._max_retries:
+                    raise
+                # экспоненциальная пауза с джиттером, чтобы потоки не били в API хором
+                time.sleep(delay + random.uniform(0, delay))
+                delay = min(delay * 2, 60.0)
+
+    def _lookup(self, hashes: List[str]) -> Dict[str, List[float]]:
+        unique = list(dict.fromkeys(hashes))
+        found: Dict[str, List[float]] = {}
+        now = time.time()
+        with self._lock:
+            for i in range(0, len(unique), _SQL_CHUNK):
+                part = unique[i:i + _SQL_CHUNK]
+                marks = ",".join("?" * len(part))
+                rows = self._conn.execute(
+                    f"SELECT hash, vector FROM embeddings WHERE model = ? AND hash IN ({marks})",
+                    (self._model, *part),
+                ).fetchall()
+                for h, blob in rows:
+                    vec = array("f")
+                    vec.frombytes(blob)
+                    found[h] = vec.tolist()
+            if found:
+                self._conn.executemany(
+                    "UPDATE embeddings SET used_at = ? WHERE model = ? AND hash = ?",
+                    [(now, self._model, h) for h in found],
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, vectors: Dict[str, List[float]]) -> None:
+        now = time.time()
+        with self._lock:
+            cur = self._conn.executemany(
+                "INSERT OR IGNORE INTO embeddings (model, hash, vector, used_at) "
+                "VALUES (?, ?, ?, ?)",
+                [(self._model, h, array("f", v).tobytes(), now) for h, v in vectors.items()],
+            )
+            self._size += max(cur.rowcount, 0)
+            overflow = self._size - self._max_entries
+            if overflow > 0:
+                cur = self._conn.execute(
+                    "DELETE FROM embeddings WHERE rowid IN "
+                    "(SELECT rowid FROM embeddings ORDER BY used_at LIMIT ?)",
+                    (overflow,),
+                )
+                self._size -= max(cur.rowcount, 0)
+            self._conn.commit()
+
+
+# единственный на процесс эмбеддер
+_embeddings: Optional[CachedEmbeddings] = None
+
+
+def get_embeddings() -> CachedEmbeddings:
+    """
+    Возвращает общий эмбеддер с кэшем.
+    Используется и при построении индекса, и для эмбеддинга запросов.
+    """
+    global _embeddings
+    if _embeddings is None:
+        kwargs = {"openai_api_base": OPENAI_API_BASE} if OPENAI_API_BASE else {}
+        inner = OpenAIEmbeddings(
+            openai_api_key=OPENAI_API_KEY,
+            model=EMBEDDING_MODEL_NAME,
+            **kwargs,
+        )
+        _embeddings = CachedEmbeddings(
+            inner,
+            model=EMBEDDING_MODEL_NAME,
+            path=EMBED_CACHE_PATH,
+            max_entries=EMBED_CACHE_MAX_ENTRIES,
+        )
+    return _embeddings
@@ -0,0 +1,158 @@
+# rag/history.py
+from __future__ import annotations
+
+import json
+import logging
+import threading
+import time
+from collections import OrderedDict
+from pathlib import Path
+from typing import List, Optional, Tuple
+
+from .config import (
+    HISTORY_MAX_SESSIONS,
+    HISTORY_TOKEN_BUDGET,
+    HISTORY_IDLE_TTL,
+    HISTORY_PATH,
+    HISTORY_SAVE_INTERVAL,
+)
+from .tokens import count_tokens, truncate_tokens
+
+SessionKey = Tuple[int, str]            # (user_id, source)
+
+
+class _Session:
+    __slots__ = ("turns", "tokens", "used_at")
+
+    def __init__(self):
+        self.turns: List[Tuple[str, str, int]] = []   # (вопрос, ответ, токены)
+        self.tokens = 0
+        self.used_at = time.time()
+
+
+class HistoryStore:
+    """
+    История диалогов по (user_id, source).
+    - хранит не больше max_sessions сессий, лишние и простаивающие
+      дольше idle_ttl секунд вытесняются (LRU);
+    - в каждой сессии держит только последние реплики,
+      укладывающиеся в token_budget токенов;
+    - с path раз в save_interval секунд сохраняет изменения на диск
+      фоновым потоком, так что падение процесса теряет не больше интервала.
+    """
+
+    def __init__(self, max_sessions: int, token_budget: int,
+                 idle_ttl: float, path: Optional[str] = None,
+                 save_interval: float = 0):
+        self._max_sessions = max_sessions
+        self._token_budget = token_budget
+        self._idle_ttl = idle_ttl
+        self._path = Path(path) if path else None
+        self._lock = threading.Lock()
+        self._save_lock = threading.Lock()      # автосохранение и save() при выходе
+        self._sessions: OrderedDict[SessionKey, _Session] = OrderedDict()
+        self._dirty = False
+        if self._path and self._path.exists():
+            self.load()
+        if self._path and save_interval > 0:
+            threading.Thread(target=self._autosave, args=(save_interval,),
+                             daemon=True, name="history-autosave").start()
+
+    def get(self, user_id: int, source: str) -> List[Tuple[str, str]]:
+        """История в формате chat_history для ConversationalRetrievalChain."""
+        with self._lock:
+            session = self._sessions.get((user_id, source))
+            if session is None:
+                return []
+            return [(q, a) for q, a, _ in session.turns]
+
+    def append(self, user_id: int, source: str, question: str, answer: str) -> None:
+        key = (user_id, source)
+        tokens = count_tokens(question) + count_tokens(answer)
+        if tokens > self._token_budget:
+            # реплика длиннее всего бюджета: ужимаем её саму, а не стираем сессию
+            question = truncate_tokens(question, self._token_budget // 2)
+            answer = truncate_tokens(answer, self._token_budget - count_tokens(question))
+            tokens = count_tokens(question) + count_tokens(answer)
+        with self._lock:
+            session = self._sessions.get(key)
+            if session is None:
+                session = self._sessions[key] = _Session()
+            self._sessions.move_to_end(key)
+            session.used_at = time.time()
+            session.turns.append((question, answer, tokens))
+            session.tokens += tokens
+            # самые старые реплики выпадают первыми; последняя остаётся всегда
+            while session.tokens > self._token_budget and len(session.turns) > 1:
+                session.tokens -= session.turns.pop(0)[2]
+            self._evict()
+            self._dirty = True
+
+    def clear(self, user_id: int, source: str) -> None:
+        with self._lock:
+            if self._sessions.pop((user_id, source), None) is not None:
+                self._dirty = True
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    # ────────────────────────────────────────────────
+    #   Сохранение на диск
+    # ────────────────────────────────────────────────
+    def save(self) -> None:
+        if self._path is None:
+            return
+        with self._save_lock:
+            with self._lock:
+                data = [
+                    {"user_id": uid, "source": src, "used_at": s.used_at, "turns": s.turns}
+                    for (uid, src), s in self._sessions.items()
+                ]
+                self._dirty = False
+            try:
+                tmp = self._path.with_suffix(self._path.suffix + ".tmp")
+                tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+                tmp.replace(self._path)
+            except BaseException:
+                self._dirty = True       # попробуем в следующий раз
+                raise
+
+    def _autosave(self, interval: float) -> None:
+        while True:
+            time.sleep(interval)
+            if not self._dirty:
+                continue
+            try:
+                self.save()
+            except Exception:
+                logging.exception("Не удалось сохранить историю диалогов")
+
+    def load(self) -> None:
+        data = json.loads(self._path.read_text(encoding="utf-8"))
+        with self._lock:
+            self._sessions.clear()
+            for item in data:
+                session = _Session()
+                session.used_at = item["used_at"]
+                session.turns = [tuple(t) for t in item["turns"]]
+                session.tokens = sum(t[2] for t in session.turns)
+                self._sessions[(item["user_id"], item["source"])] = session
+            self._evict()
+
+    # вызывается под self._lock
+    def _evict(self) -> None:
+        deadline = time.time() - self._idle_ttl
+        while self._sessions:
+            key, oldest = next(iter(self._sessions.items()))
+            if len(self._sessions) <= self._max_sessions and oldest.used_at >= deadline:
+                break
+            del self._sessions[key]
+
+
+history_store = HistoryStore(
+    max_sessions=HISTORY_MAX_SESSIONS,
+    token_budget=HISTORY_TOKEN_BUDGET,
+    idle_ttl=HISTORY_IDLE_TTL,
+    path=HISTORY_PATH,
+    save_interval=HISTORY_SAVE_INTERVAL,
+)
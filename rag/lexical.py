@@ -0,0 +1,97 @@
+# rag/lexical.py
+from __future__ import annotations
+
+import json
+import math
+import re
+from collections import Counter
+from pathlib import Path
+from typing import Dict, List, Tuple
+
+BM25_NAME = "bm25.json"
+
+# номера пунктов вида 3.2.1 держим целиком, остальное — по словам
+_TOKEN = re.compile(r"\d+(?:\.\d+)+|\w+")
+STEM_LEN = 6                            # грубый стемминг: обрезаем длинные слова до префикса
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Токены для BM25: нижний регистр, ё→е, длинные слова обрезаны до
+    STEM_LEN символов, чтобы «подписки»/«подписку» совпадали.
+    """
+    tokens = []
+    for tok in _TOKEN.findall(text.lower().replace("ё", "е")):
+        if tok.isalpha() and len(tok) > STEM_LEN:
+            tok = tok[:STEM_LEN]
+        tokens.append(tok)
+    return tokens
+
+
+class BM25Index:
+    """
+    Инвертированный индекс BM25 по чанкам одного шарда.
+    Хранит тексты и метаданные чанков, чтобы отдавать их без обращения к Chroma.
+    """
+
+    def __init__(self, texts: List[str], metadatas: List[Dict],
+                 k1: float = 1.5, b: float = 0.75):
+        self.texts = texts
+        self.metadatas = metadatas
+        self.k1 = k1
+        self.b = b
+        self.lengths: List[int] = []
+        self.postings: Dict[str, List[Tuple[int, int]]] = {}
+        for i, text in enumerate(texts):
+            counts = Counter(tokenize(text))
+            self.lengths.append(sum(counts.values()))
+            for term, tf in counts.items():
+                self.postings.setdefault(term, []).append((i, tf))
+        self._prepare()
+
+    def _prepare(self) -> None:
+        n = len(self.lengths)
+        self.avgdl = (sum(self.lengths) / n) if n else 0.0
+        self.idf = {
+            term: math.log(1 + (n - len(posts) + 0.5) / (len(posts) + 0.5))
+            for term, posts in self.postings.items()
+        }
+
+    def search(self, query: str, k: int) -> List[Tuple[int, float]]:
+        """Возвращает до k пар (номер чанка, BM25‑score) по убыванию score."""
+        scores: Dict[int, float] = {}
+        for term in set(tokenize(query)):
+            idf = self.idf.get(term)
+            if idf is None:
+                continue
+            for i, tf in self.postings[term]:
+                norm = self.k1 * (1 - self.b + self.b * self.lengths[i] / (self.avgdl or 1))
+                scores[i] = scores.get(i, 0.0) + idf * tf * (self.k1 + 1) / (tf + norm)
+        return sorted(scores.items(), key=lambda item: item[1], reverse=True)[:k]
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    # ────────────────────────────────────────────────
+    #   Хранение рядом с версией шарда
+    # ────────────────────────────────────────────────
+    def save(self, dir_: Path) -> None:
+        data = {
+            "k1": self.k1, "b": self.b,
+            "texts": self.texts, "metadatas": self.metadatas,
+            "lengths": self.lengths, "postings": self.postings,
+        }
+        tmp = dir_ / (BM25_NAME + ".tmp")
+        tmp.write_text(json.dumps(data, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(dir_ / BM25_NAME)
+
+    @classmethod
+    def load(cls, dir_: Path) -> "BM25Index":
+        data = json.loads((dir_ / BM25_NAME).read_text(encoding="utf-8"))
+        index = cls.__new__(cls)
+        index.k1, index.b = data["k1"], data["b"]
+        index.texts, index.metadatas = data["texts"], data["metadatas"]
+        index.lengths = data["lengths"]
+        index.postings = {t: [tuple(p) for p in posts] for t, posts in data["postings"].items()}
+        index._prepare()
+        return index
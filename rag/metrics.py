@@ -0,0 +1,265 @@
+# rag/metrics.py
+"""
+Метрики горячего пути в формате Prometheus: гистограммы длительностей
+по этапам (эмбеддинг вопроса, поиск, переформулировка, генерация,
+отправка в Telegram, БД), токены промпта/ответа, доли попаданий кэшей,
+длительности пересборок. Отдаются HTTP‑эндпоинтом /metrics (aiohttp),
+который поднимает bot/main.py.
+
+При METRICS_ENABLED=0 (по умолчанию) декораторы возвращают функцию
+как есть, а timer()/observe() — пустые операции.
+"""
+from __future__ import annotations
+
+import asyncio
+import functools
+import threading
+import time
+from contextlib import contextmanager, nullcontext
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+from uuid import UUID
+
+from .config import METRICS_ENABLED, METRICS_HOST, METRICS_PORT
+
+Labels = Tuple[Tuple[str, str], ...]
+
+# границы корзин: секунды (от 1 мс до 2 мин) и токены
+TIME_BUCKETS = (0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+TOKEN_BUCKETS = (16, 32, 64, 128, 256, 512, 1024, 2048, 4096, 8192, 16384)
+
+_NULL = nullcontext()
+
+
+class _Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets: Tuple[float, ...]):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+class Metrics:
+    """Реестр метрик процесса. Потокобезопасен: пишут и event‑loop, и потоки."""
+
+    def __init__(self, enabled: bool):
+        self.enabled = enabled
+        self._lock = threading.Lock()
+        self._histograms: Dict[str, Dict[Labels, _Histogram]] = {}
+        self._buckets: Dict[str, Tuple[float, ...]] = {}
+        self._help: Dict[str, str] = {}
+        self._gauges: Dict[str, Tuple[str, Callable[[], Dict[Labels, float]]]] = {}
+
+    # ────────────────────────────────────────────────
+    #   Запись
+    # ────────────────────────────────────────────────
+    def histogram(self, name: str, help_: str, buckets: Tuple[float, ...] = TIME_BUCKETS) -> None:
+        self._buckets[name] = buckets
+        self._help[name] = help_
+
+    def observe(self, name: str, value: float, **labels: str) -> None:
+        if not self.enabled:
+            return
+        key = tuple(sorted(labels.items()))
+        with self._lock:
+            series = self._histograms.setdefault(name, {})
+            hist = series.get(key)
+            if hist is None:
+                hist = series[key] = _Histogram(self._buckets.get(name, TIME_BUCKETS))
+            hist.observe(value)
+
+    def timer(self, name: str, **labels: str):
+        """with metrics.timer("rag_stage_seconds", stage="retrieval"): …"""
+        if not self.enabled:
+            return _NULL
+        return self._timer(name, labels)
+
+    @contextmanager
+    def _timer(self, name: str, labels: Dict[str, str]) -> Iterator[None]:
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(name, time.perf_counter() - started, **labels)
+
+    def timed(self, name: str, **labels: str):
+        """Декоратор для sync/async функций; при выключенных метриках ничего не оборачивает."""
+        def decorate(func):
+            if not self.enabled:
+                return func
+            if asyncio.iscoroutinefunction(func):
+                @functools.wraps(func)
+                async def async_wrapper(*args, **kwargs):
+                    with self._timer(name, labels):
+                        return await func(*args, **kwargs)
+                return async_wrapper
+
+            @functools.wraps(func)
+            def wrapper(*args, **kwargs):
+                with self._timer(name, labels):
+                    return func(*args, **kwargs)
+            return wrapper
+        return decorate
+
+    def gauge(self, name: str, help_: str, collect: Callable[[], Dict[Labels, float]]) -> None:
+        """Gauge, который вычисляется в момент запроса /metrics."""
+        self._gauges[name] = (help_, collect)
+
+    # ────────────────────────────────────────────────
+    #   Экспорт
+    # ────────────────────────────────────────────────
+    def render(self) -> str:
+        lines: List[str] = []
+        with self._lock:
+            snapshot = {
+                name: {key: (list(h.counts), h.sum, h.count, h.buckets) for key, h in series.items()}
+                for name, series in self._histograms.items()
+            }
+        for name, series in sorted(snapshot.items()):
+            if name in self._help:
+                lines.append(f"# HELP {name} {self._help[name]}")
+            lines.append(f"# TYPE {name} histogram")
+            for key, (counts, total, count, buckets) in sorted(series.items()):
+                cumulative = 0
+                for bound, n in zip(buckets, counts):
+                    cumulative += n
+                    lines.append(f"{name}_bucket{_fmt(key + (('le', _num(bound)),))} {cumulative}")
+                lines.append(f"{name}_bucket{_fmt(key + (('le', '+Inf'),))} {count}")
+                lines.append(f"{name}_sum{_fmt(key)} {total:.6f}")
+                lines.append(f"{name}_count{_fmt(key)} {count}")
+        for name, (help_, collect) in sorted(self._gauges.items()):
+            lines.append(f"# HELP {name} {help_}")
+            lines.append(f"# TYPE {name} gauge")
+            try:
+                values = collect()
+            except Exception:
+                continue
+            for key, value in sorted(values.items()):
+                lines.append(f"{name}{_fmt(key)} {value}")
+        return "\n".join(lines) + "\n"
+
+
+def _num(value: float) -> str:
+    return repr(float(value))
+
+
+def _fmt(labels: Labels) -> str:
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{k}="{_escape(v)}"' for k, v in labels) + "}"
+
+
+def _escape(value: Any) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+metrics = Metrics(enabled=METRICS_ENABLED)
+
+metrics.histogram("rag_stage_seconds", "Длительность этапов ответа")
+metrics.histogram("rag_answer_seconds", "Полное время ответа на вопрос")
+metrics.histogram("rag_llm_tokens", "Токены промпта и ответа LLM (tiktoken)", TOKEN_BUCKETS)
+metrics.histogram("rag_db_seconds", "Длительность операций БД")
+metrics.histogram("rag_telegram_seconds", "Длительность вызовов Bot API")
+metrics.histogram("rag_handler_seconds", "Полная обработка апдейта Telegram")
+metrics.histogram("rag_rebuild_seconds", "Длительность пересборки шарда")
+
+
+# ────────────────────────────────────────────────
+#   Этапы цепочки LangChain
+# ────────────────────────────────────────────────
+def _stage_callbacks():
+    from langchain_core.callbacks import BaseCallbackHandler
+
+    from .tokens import count_tokens
+
+    class StageCallbacks(BaseCallbackHandler):
+        """
+        Засекает этапы ConversationalRetrievalChain: поиск (ретривер),
+        переформулировку вопроса и генерацию ответа (по тегу LLM),
+        считает токены промпта и ответа через tiktoken.
+        """
+
+        def __init__(self, answer_tag: str):
+            self._answer_tag = answer_tag
+            self._started: Dict[UUID, Tuple[str, float]] = {}
+
+        def _stage(self, tags: Optional[List[str]]) -> str:
+            return "generate" if tags and self._answer_tag in tags else "condense"
+
+        def on_retriever_start(self, serialized, query, *, run_id, parent_run_id=None,
+                               **kwargs: Any) -> None:
+            if parent_run_id in self._started:
+                return      # вложенный ретривер (база ContextRetriever) уже внутри замера
+            self._started[run_id] = ("retrieval", time.perf_counter())
+
+        def on_retriever_end(self, documents, *, run_id, **kwargs: Any) -> None:
+            self._finish(run_id)
+
+        def on_chat_model_start(self, serialized, messages, *, run_id, tags=None, **kwargs: Any) -> None:
+            stage = self._stage(tags)
+            self._started[run_id] = (stage, time.perf_counter())
+            prompt = sum(count_tokens(str(m.content)) for batch in messages for m in batch)
+            metrics.observe("rag_llm_tokens", prompt, stage=stage, kind="prompt")
+
+        def on_llm_end(self, response, *, run_id, **kwargs: Any) -> None:
+            stage = self._finish(run_id)
+            if stage is None:
+                return
+            text = "".join(g.text for gens in response.generations for g in gens)
+            metrics.observe("rag_llm_tokens", count_tokens(text), stage=stage, kind="completion")
+
+        def on_llm_error(self, error, *, run_id, **kwargs: Any) -> None:
+            self._finish(run_id)
+
+        def on_retriever_error(self, error, *, run_id, **kwargs: Any) -> None:
+            self._finish(run_id)
+
+        def _finish(self, run_id: UUID) -> Optional[str]:
+            item = self._started.pop(run_id, None)
+            if item is None:
+                return None
+            stage, started = item
+            metrics.observe("rag_stage_seconds", time.perf_counter() - started, stage=stage)
+            return stage
+
+    return StageCallbacks
+
+
+_callbacks = None
+
+
+def chain_config(answer_tag: str) -> Dict[str, Any]:
+    """config для chain.invoke/astream_events: с колбэком этапов, если метрики включены."""
+    global _callbacks
+    if not metrics.enabled:
+        return {}
+    if _callbacks is None:
+        _callbacks = _stage_callbacks()(answer_tag)
+    return {"callbacks": [_callbacks]}
+
+
+# ────────────────────────────────────────────────
+#   HTTP‑эндпоинт
+# ────────────────────────────────────────────────
+async def start_metrics_server(host: str = METRICS_HOST, port: int = METRICS_PORT):
+    """Поднимает GET /metrics на host:port. Возвращает runner (для cleanup())."""
+    from aiohttp import web
+
+    async def handle(_request):
+        return web.Response(text=metrics.render(), content_type="text/plain", charset="utf-8")
+
+    app = web.Application()
+    app.router.add_get("/metrics", handle)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    await web.TCPSite(runner, host, port).start()
+    return runner
@@ -0,0 +1,276 @@
+# rag/numpy_store.py
+from __future__ import annotations
+
+import json
+import os
+from pathlib import Path
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+VECTORS_NAME = "vectors.f32"            # матрица n × dim, float32, строки нормированы
+META_NAME = "vectors.json"              # ids, тексты и метаданные в порядке строк
+CODES_NAME = "vectors.{mode}"           # квантованная копия матрицы: vectors.int8 / vectors.float16
+SCALES_NAME = "scales.{mode}.f32"      # масштабы строк своего режима (у float16 — единицы)
+QUANTIZATION_MODES = ("none", "int8", "float16")
+_BLOCK = 1024                           # строк квантованной матрицы за один шаг поиска
+
+
+class NumpyVectorStore(VectorStore):
+    """
+    Точный (brute‑force) косинусный поиск по шарду одного источника.
+    На сервис приходится максимум несколько тысяч чанков, поэтому одно
+    произведение матрицы на вектор + argpartition быстрее HNSW Chroma
+    и не тянет за собой SQLite и фоновые процессы.
+
+    На диске — сырой float32‑файл, который открывается через np.memmap
+    (страницы подгружает ОС, общие для всех процессов), и JSON рядом.
+    Изменения (upsert/delete) копят матрицу в памяти до flush().
+
+    С quantization="int8"/"float16" в памяти держится только компактная
+    копия матрицы (в 4/2 раза меньше): по ней отбираются k × rescore
+    кандидатов, и лишь их строки читаются из float32‑memmap для точного
+    пересчёта. Остальная float32‑матрица в RSS не попадает.
+
+    read_only=True — для процессов‑воркеров: каталог версии не меняется,
+    недостающая квантованная копия строится только в памяти.
+    """
+
+    def __init__(self, dir_: Path, embedding_function: Embeddings,
+                 quantization: str = "none", rescore: int = 4, read_only: bool = False):
+        if quantization not in QUANTIZATION_MODES:
+            raise ValueError(f"Неизвестный режим квантования: {quantization!r}")
+        self._dir = Path(dir_)
+        self._embedding = embedding_function
+        self._quantization = quantization
+        self._rescore = rescore
+        self._read_only = read_only
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict] = []
+        self._matrix: np.ndarray = np.empty((0, 0), dtype=np.float32)
+        self._codes: Optional[np.ndarray] = None
+        self._scales: Optional[np.ndarray] = None
+        self._positions: Optional[Dict[str, int]] = None    # id → строка матрицы
+        self._load()
+
+    # ────────────────────────────────────────────────
+    #   Хранение
+    # ────────────────────────────────────────────────
+    def _load(self) -> None:
+        try:
+            meta = json.loads((self._dir / META_NAME).read_text(encoding="utf-8"))
+        except (OSError, ValueError):
+            return
+        self._ids, self._texts, self._metadatas = meta["ids"], meta["texts"], meta["metadatas"]
+        self._positions = None
+        n, dim = len(self._ids), meta["dim"]
+        if n:
+            self._matrix = np.memmap(self._dir / VECTORS_NAME, dtype=np.float32,
+                                     mode="r", shape=(n, dim))
+        else:
+            self._matrix = np.empty((0, dim), dtype=np.float32)
+        self._load_codes()
+
+    def _load_codes(self) -> None:
+        """Читает квантованную копию; если её нет (режим только что включили) — строит."""
+        self._codes = self._scales = None
+        n = len(self._ids)
+        if self._quantization == "none" or not n:
+            return
+        dtype = np.dtype(self._quantization)
+        path = self._dir / CODES_NAME.format(mode=self._quantization)
+        scales_path = self._dir / SCALES_NAME.format(mode=self._quantization)
+        if not (_has_size(path, self._matrix.size * dtype.itemsize)
+                and _has_size(scales_path, n * 4)):
+            if self._read_only:
+                self._codes, self._scales = quantize(self._matrix, self._quantization)
+            else:
+                self._write_codes()
+            return
+        # memmap, а не fromfile: процессы‑воркеры делят эти страницы через page cache
+        self._codes = np.memmap(path, dtype=dtype, mode="r").reshape(self._matrix.shape)
+        self._scales = np.memmap(scales_path, dtype=np.float32, mode="r")
+
+    def _write_codes(self) -> None:
+        """
+        Пишет квантованную копию через tmp + replace: файл может быть открыт
+        через memmap другими процессами, перезапись на месте уронила бы их (SIGBUS).
+        Сначала масштабы, потом коды — их правильный размер значит «копия готова».
+        """
+        codes, scales = quantize(self._matrix, self._quantization)
+        for array, name in ((scales, SCALES_NAME), (codes, CODES_NAME)):
+            target = self._dir / name.format(mode=self._quantization)
+            tmp = target.with_name(f"{target.name}.{os.getpid()}.tmp")
+            array.tofile(tmp)
+            tmp.replace(target)
+        self._codes, self._scales = codes, scales
+
+    def flush(self) -> None:
+        """Атомарно записывает матрицу и метаданные и переоткрывает их через memmap."""
+        self._dir.mkdir(parents=True, exist_ok=True)
+        tmp = self._dir / (VECTORS_NAME + ".tmp")
+        np.ascontiguousarray(self._matrix, dtype=np.float32).tofile(tmp)
+        tmp.replace(self._dir / VECTORS_NAME)
+
+        meta = {"dim": int(self._matrix.shape[1]), "ids": self._ids,
+                "texts": self._texts, "metadatas": self._metadatas}
+        tmp = self._dir / (META_NAME + ".tmp")
+        tmp.write_text(json.dumps(meta, ensure_ascii=False), encoding="utf-8")
+        tmp.replace(self._dir / META_NAME)
+        if self._quantization != "none" and len(self._ids):
+            self._write_codes()
+        self._load()
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    # ────────────────────────────────────────────────
+    #   Запись — тот же интерфейс, что у коллекции Chroma
+    # ────────────────────────────────────────────────
+    def upsert(self, ids: List[str], embeddings: List[List[float]],
+               metadatas: List[Dict], documents: List[str]) -> None:
+        vectors = _normalize(np.asarray(embeddings, dtype=np.float32))
+        positions = {id_: i for i, id_ in enumerate(self._ids)}
+        matrix = np.array(self._matrix) if len(self._ids) else \
+            np.empty((0, vectors.shape[1]), dtype=np.float32)
+        new_rows = []
+        for id_, vec, meta, text in zip(ids, vectors, metadatas, documents):
+            i = positions.get(id_)
+            if i is None:
+                positions[id_] = len(self._ids)
+                self._ids.append(id_)
+                self._texts.append(text)
+                self._metadatas.append(meta)
+                new_rows.append(vec)
+            else:
+                matrix[i] = vec
+                self._texts[i], self._metadatas[i] = text, meta
+        if new_rows:
+            matrix = np.vstack([matrix, np.stack(new_rows)])
+        self._matrix = matrix
+        self._positions = positions
+        self._codes = self._scales = None     # до flush() ищем по точной матрице
+
+    def get(self, include: Optional[List[str]] = None) -> Dict[str, List[Any]]:
+        return {"ids": list(self._ids)}
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        drop = set(ids or ())
+        keep = [i for i, id_ in enumerate(self._ids) if id_ not in drop]
+        self._matrix = np.array(self._matrix[keep])
+        self._ids = [self._ids[i] for i in keep]
+        self._texts = [self._texts[i] for i in keep]
+        self._metadatas = [self._metadatas[i] for i in keep]
+        self._positions = None
+        self._codes = self._scales = None
+        return True
+
+    def get_vectors(self, ids: List[str]) -> Dict[str, np.ndarray]:
+        """Нормированные векторы чанков по id (отсутствующих в шарде нет в ответе)."""
+        if self._positions is None:
+            self._positions = {id_: i for i, id_ in enumerate(self._ids)}
+        rows = {id_: self._positions[id_] for id_ in ids if id_ in self._positions}
+        return {id_: np.asarray(self._matrix[i]) for id_, i in rows.items()}
+
+    # ────────────────────────────────────────────────
+    #   Интерфейс VectorStore
+    # ────────────────────────────────────────────────
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[Dict]] = None,
+                  ids: Optional[List[str]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        ids = ids or [str(len(self._ids) + i) for i in range(len(texts))]
+        self.upsert(ids, self._embedding.embed_documents(texts), metadatas, texts)
+        self.flush()
+        return ids
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings,
+                   metadatas: Optional[List[Dict]] = None, *,
+                   persist_directory: str, **kwargs: Any) -> "NumpyVectorStore":
+        store = cls(Path(persist_directory), embedding)
+        store.add_texts(texts, metadatas, **kwargs)
+        return store
+
+    def similarity_search_by_vector_with_score(self, embedding: List[float],
+                                               k: int = 4) -> List[Tuple[Document, float]]:
+        n = len(self._ids)
+        if not n:
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        k = min(k, n)
+        if self._codes is None:
+            scores = self._matrix @ query
+            top = _top_k(scores, k)
+            pairs = [(i, scores[i]) for i in top]
+        else:
+            # кандидаты — по компактной матрице, итоговый порядок — по точным float32
+            candidates = np.sort(_top_k(self._approx_scores(query), min(k * self._rescore, n)))
+            exact = np.asarray(self._matrix[candidates]) @ query
+            pairs = [(candidates[j], exact[j]) for j in _top_k(exact, k)]
+        return [
+            (Document(page_content=self._texts[i], metadata=self._metadatas[i]), float(score))
+            for i, score in pairs
+        ]
+
+    def _approx_scores(self, query: np.ndarray) -> np.ndarray:
+        """
+        Скоры по квантованной матрице. Коды переводятся в float32 блоками,
+        чтобы временная копия не съела выигрыш по памяти.
+        """
+        scores = np.empty(len(self._codes), dtype=np.float32)
+        for i in range(0, len(self._codes), _BLOCK):
+            scores[i:i + _BLOCK] = self._codes[i:i + _BLOCK].astype(np.float32) @ query
+        return scores * self._scales
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4,
+                                    **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_by_vector_with_score(embedding, k)]
+
+    def similarity_search_with_score(self, query: str, k: int = 4,
+                                     **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(self._embedding.embed_query(query), k)
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k)]
+
+    def _select_relevance_score_fn(self):
+        # score — уже косинус в [-1, 1]
+        return lambda score: (score + 1) / 2
+
+
+def _has_size(path: Path, size: int) -> bool:
+    return path.exists() and path.stat().st_size == size
+
+
+def quantize(matrix: np.ndarray, mode: str) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Компактная копия матрицы: int8 с масштабом на строку (max|x| / 127)
+    или float16 (масштаб 1). Возвращает (коды, масштабы).
+    """
+    matrix = np.asarray(matrix, dtype=np.float32)
+    if mode == "float16":
+        return matrix.astype(np.float16), np.ones(len(matrix), dtype=np.float32)
+    scales = np.abs(matrix).max(axis=1) / 127
+    scales[scales == 0] = 1
+    codes = np.rint(matrix / scales[:, None]).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def _top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Индексы k лучших score по убыванию: argpartition + сортировка только k штук."""
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    return vectors / np.where(norms == 0, 1, norms)
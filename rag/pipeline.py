@@ -1,71 +1,400 @@
 # rag/pipeline.py
+from __future__ import annotations
+
+import asyncio
+import contextlib
 import logging
-from typing import Optional
+import threading
+from typing import TYPE_CHECKING, AsyncIterator, Callable, Dict, List, Optional
+
+from db.db_data import add_source_listener
+
+from .vectorestore import list_sources, load_lexical, open_current, open_shard, shard_lock, update_shard
+from .history import history_store
+from .answer_cache import answer_cache
+from .metrics import chain_config, metrics
+from .singleflight import flight_key, inflight
+from .config import (
+    OPENAI_API_KEY,
+    OPENAI_API_BASE,
+    LLM_MODEL_NAME,
+    TEMPERATURE,
+    ANSWER_CONCURRENCY,
+    ANSWER_TIMEOUT,
+    HYBRID_SEARCH,
+    RETRIEVER_K,
+    CONTEXT_ASSEMBLY,
+    CONTEXT_FETCH_K,
+    INDEX_READ_ONLY,
+)
+
+# langchain тянет за собой много модулей — импортируем его только при сборке цепочки
+if TYPE_CHECKING:
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain_core.vectorstores import VectorStore
+
+# открытые шарды и готовые цепочки по источникам {source: ...}
+_shards: Dict[str, VectorStore] = {}
+_chains: Dict[str, ConversationalRetrievalChain] = {}
+_chain_lock = threading.Lock()
+# ограничивает число одновременных обращений к LLM
+_answer_slots = asyncio.Semaphore(ANSWER_CONCURRENCY)
+
+# тег LLM, генерирующей итоговый ответ (в отличие от переформулировки вопроса)
+ANSWER_TAG = "rag_answer"
 
-from langchain.chains import ConversationalRetrievalChain
-from langchain_openai import ChatOpenAI
-from langchain.memory import ConversationBufferMemory
+NOT_FOUND_TEXT = "Не нашли информацию по вашему запросу."
+TIMEOUT_TEXT = "Сервис отвечает слишком долго. Попробуйте повторить вопрос чуть позже."
 
-from .vectorestore import create_fresh_vectorstore
-from .config import OPENAI_API_KEY, LLM_MODEL_NAME, TEMPERATURE
+# любые изменения данных источника делают его кэшированные ответы устаревшими
+add_source_listener(lambda source, _action: answer_cache.invalidate(source))
 
-# единственный глобальный объект
-rag_chain: Optional[ConversationalRetrievalChain] = None
+# кого известить после refresh_chain(source) — например, пул воркеров
+_refresh_listeners: List[Callable[[str], None]] = []
 
-def _make_chain(vs) -> ConversationalRetrievalChain:
+def add_refresh_listener(callback: Callable[[str], None]):
+    """Регистрирует callback(source), вызываемый после обновления шарда."""
+    _refresh_listeners.append(callback)
+
+def _make_retriever(source: str, vs):
+    """
+    Гибридный BM25 + векторный ретривер шарда (или чисто векторный);
+    при CONTEXT_ASSEMBLY он отдаёт CONTEXT_FETCH_K кандидатов в сборку контекста.
     """
-    Создаёт новую RAG‑цепочку на основе переданного векторстора.
+    k = CONTEXT_FETCH_K if CONTEXT_ASSEMBLY else RETRIEVER_K
+    lexical = load_lexical(source) if HYBRID_SEARCH else None
+    if lexical is None:
+        retriever = vs.as_retriever(search_kwargs={"k": k})
+    else:
+        from .retrieval import HybridRetriever
+        retriever = HybridRetriever(vectorstore=vs, lexical=lexical, k=k)
+    if not CONTEXT_ASSEMBLY:
+        return retriever
+    from .context import ContextRetriever
+    return ContextRetriever(base=retriever, vectorstore=vs)
+
+def _make_chain(source: str, vs) -> ConversationalRetrievalChain:
     """
+    Создаёт новую RAG‑цепочку на основе шарда одного источника.
+    Своей памяти у цепочки нет: историю пользователя передаём в chat_history.
+    """
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain_openai import ChatOpenAI
+
+    kwargs = {"openai_api_base": OPENAI_API_BASE} if OPENAI_API_BASE else {}
     llm = ChatOpenAI(
         openai_api_key=OPENAI_API_KEY,
         model_name=LLM_MODEL_NAME,
         temperature=TEMPERATURE,
+        streaming=True,
+        tags=[ANSWER_TAG],
+        **kwargs,
     )
-    memory = ConversationBufferMemory(
-        memory_key="chat_history",
-        return_messages=True,
-        output_key="answer",
+    condense_llm = ChatOpenAI(
+        openai_api_key=OPENAI_API_KEY,
+        model_name=LLM_MODEL_NAME,
+        temperature=TEMPERATURE,
+        **kwargs,
     )
     chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
-        retriever=vs.as_retriever(search_kwargs={"k": 5}),
-        memory=memory,
+        condense_question_llm=condense_llm,
+        retriever=_make_retriever(source, vs),
         return_source_documents=True,
         output_key="answer",
     )
     return chain
 
-def get_rag_chain() -> ConversationalRetrievalChain:
+def get_shard(source: str) -> Optional[VectorStore]:
+    """
+    Роутер: возвращает шард источника, при первом обращении открывая
+    сохранённый (пересборка — только если он не совпадает с БД).
+    None — у источника нет данных.
+    Открытие идёт под shard_lock источника — тем же, что у refresh_chain,
+    так что сборка из запроса и из очереди пересборки не пересекаются,
+    а другие источники при этом не ждут.
+    """
+    vs = _shards.get(source)
+    if vs is None:
+        with shard_lock(source):
+            vs = _shards.get(source)
+            if vs is None:
+                vs = open_current(source) if INDEX_READ_ONLY else open_shard(source)
+                if vs is not None:
+                    _shards[source] = vs
+    return vs
+
+def warm_up() -> None:
+    """Открывает шарды всех источников заранее, чтобы первый вопрос не ждал."""
+    logging.info("🔄  Открываем шарды векторного индекса…")
+    for source in list_sources():
+        get_shard(source)
+    logging.info(f"✅  Шардов готово: {len(_shards)}")
+
+def get_rag_chain(source: str) -> Optional[ConversationalRetrievalChain]:
+    """
+    Возвращает RAG‑цепочку для источника, создавая её при первом обращении.
+    Цепочки разных источников работают с разными шардами параллельно.
+    """
+    chain = _chains.get(source)
+    if chain is None:
+        vs = get_shard(source)
+        if vs is None:
+            return None
+        with _chain_lock:
+            chain = _chains.get(source)
+            if chain is None:
+                # пока открывали шард, refresh_chain мог его подменить или удалить
+                vs = _shards.get(source)
+                if vs is None:
+                    return None
+                chain = _chains[source] = _make_chain(source, vs)
+    return chain
+
+def refresh_chain(source: str) -> None:
+    """
+    Приводит шард источника в соответствие с БД и сбрасывает его цепочку.
+    Эмбеддятся только новые чанки, векторы удалённых строк удаляются;
+    если данных источника не осталось — шард удаляется целиком.
+    Вызывайте его после любых изменений данных источника.
+    """
+    logging.info(f"🔄  Обновляем шард «{source}»…")
+    # сборка идёт в новой версии шарда, читатели её не ждут; get_shard того же
+    # источника ждёт подмены и не строит шард параллельно
+    with shard_lock(source):
+        vs = update_shard(source)
+        with _chain_lock:
+            # запросы, уже взявшие старую цепочку, спокойно доработают с ней
+            _chains.pop(source, None)
+            if vs is None:
+                _shards.pop(source, None)
+            else:
+                _shards[source] = vs
+    # ответы, закэшированные по старому шарду между записью в БД и подменой, —
+    # устаревшие: сбрасываем ещё раз, уже после подмены
+    answer_cache.invalidate(source)
+    logging.info(f"✅  Шард «{source}» обновлён")
+    for callback in _refresh_listeners:
+        callback(source)
+
+def reopen_shard(source: str) -> None:
+    """
+    Забывает открытый шард и цепочку источника (и его кэш ответов):
+    следующий вопрос откроет текущую версию. Для воркеров с INDEX_READ_ONLY,
+    которым пересобранный шард подменил основной процесс.
     """
-    При первом вызове создаёт RAG‑цепочку.
-    Повторные — возвращают уже готовую.
+    with _chain_lock:
+        _chains.pop(source, None)
+        _shards.pop(source, None)
+    answer_cache.invalidate(source)
+
+@metrics.timed("rag_answer_seconds", path="sync")
+def get_answer(user_id: int, question: str, source: str) -> str:
     """
-    global rag_chain
-    if rag_chain is None:
-        logging.info("🔄  Создаём RAG‑цепочку впервые…")
-        vs = create_fresh_vectorstore()
-        rag_chain = _make_chain(vs)
-        logging.info("✅  RAG‑цепочка создана")
-    return rag_chain
+    Возвращает ответ на вопрос по документам источника source
+    с учётом истории диалога пользователя с этим источником.
+    """
+    chat_history = history_store.get(user_id, source)
+    chain = get_rag_chain(source) if chat_history else None
+    standalone = _condense(chain, question, chat_history)
+    cached = _lookup_cached(user_id, source, question, standalone)
+    if cached is not None:
+        return cached
+    chain = chain or get_rag_chain(source)
+    if chain is None:
+        return NOT_FOUND_TEXT
+    result = chain.invoke({"question": standalone, "chat_history": []},
+                          config=chain_config(ANSWER_TAG))
+    return _remember(user_id, source, question, standalone, result)
+
+@metrics.timed("rag_answer_seconds", path="async")
+async def aget_answer(user_id: int, question: str, source: str) -> str:
+    """
+    Асинхронный вариант get_answer: не блокирует event‑loop,
+    ограничен ANSWER_CONCURRENCY одновременными запросами
+    и таймаутом ANSWER_TIMEOUT секунд. Одинаковые одновременные
+    (после переформулировки по истории) вопросы считаются один раз
+    (rag.singleflight).
+    """
+    try:
+        standalone = await _astandalone(user_id, question, source)
+    except asyncio.TimeoutError:
+        logging.warning(f"Таймаут переформулировки ({ANSWER_TIMEOUT}s) для {source!r}: {question!r}")
+        return TIMEOUT_TEXT
+    cached = await asyncio.to_thread(_lookup_cached, user_id, source, question, standalone)
+    if cached is not None:
+        return cached
+    answer, shared = await inflight.call(
+        flight_key(source, standalone), lambda: _aget_answer(user_id, question, standalone, source)
+    )
+    if shared:
+        _share_history(user_id, source, question, answer)
+    return answer
 
-def refresh_chain() -> None:
+async def _aget_answer(user_id: int, question: str, standalone: str, source: str) -> str:
+    async with _answer_slots:
+        chain = await _achain(source)
+        if chain is None:
+            return NOT_FOUND_TEXT
+        try:
+            result = await asyncio.wait_for(
+                chain.ainvoke({"question": standalone, "chat_history": []},
+                              config=chain_config(ANSWER_TAG)),
+                timeout=ANSWER_TIMEOUT,
+            )
+        except asyncio.TimeoutError:
+            logging.warning(f"Таймаут ответа ({ANSWER_TIMEOUT}s) для {source!r}: {question!r}")
+            return TIMEOUT_TEXT
+    # запись в кэш эмбеддит вопрос — тоже не в event‑loop
+    return await asyncio.to_thread(_remember, user_id, source, question, standalone, result)
+
+async def astream_answer(user_id: int, question: str, source: str) -> AsyncIterator[dict]:
     """
-    Полностью пересоздаёт векторное хранилище и RAG‑цепочку.
-    Вызывайте его после любых изменений данных.
+    Стриминговый вариант aget_answer. Отдаёт события:
+      {"token": str}                         — очередной кусок ответа;
+      {"answer": str, "sources": [title…]}   — финал, ровно один раз в конце.
+    Лимиты те же: ANSWER_CONCURRENCY и общий таймаут ANSWER_TIMEOUT;
+    одинаковые одновременные вопросы получают один общий стрим.
     """
-    global rag_chain
-    logging.info("🔄  Пересоздаём векторный индекс и RAG‑цепочку…")
-    vs = create_fresh_vectorstore()
-    rag_chain = _make_chain(vs)
-    logging.info("✅  RAG‑цепочка обновлена")
+    with metrics.timer("rag_answer_seconds", path="stream"):
+        try:
+            standalone = await _astandalone(user_id, question, source)
+        except asyncio.TimeoutError:
+            logging.warning(f"Таймаут переформулировки ({ANSWER_TIMEOUT}s) для {source!r}: {question!r}")
+            yield {"answer": TIMEOUT_TEXT, "sources": []}
+            return
+        cached = await asyncio.to_thread(_lookup_cached, user_id, source, question, standalone)
+        if cached is not None:
+            yield {"answer": cached, "sources": []}
+            return
+        stream, shared = inflight.stream(
+            flight_key(source, standalone),
+            lambda: _astream_answer(user_id, question, standalone, source),
+        )
+        async with contextlib.aclosing(stream) as events:
+            async for event in events:
+                if shared and "answer" in event:
+                    _share_history(user_id, source, question, event["answer"])
+                yield event
+
+async def _astream_answer(user_id: int, question: str, standalone: str,
+                          source: str) -> AsyncIterator[dict]:
+    async with _answer_slots:
+        chain = await _achain(source)
+        if chain is None:
+            yield {"answer": NOT_FOUND_TEXT, "sources": []}
+            return
+        events = chain.astream_events(
+            {"question": standalone, "chat_history": []},
+            version="v2", config=chain_config(ANSWER_TAG),
+        )
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + ANSWER_TIMEOUT
+        result = None
+        try:
+            while True:
+                try:
+                    event = await asyncio.wait_for(
+                        events.__anext__(), timeout=max(deadline - loop.time(), 0)
+                    )
+                except StopAsyncIteration:
+                    break
+                kind = event["event"]
+                if kind == "on_chat_model_stream" and ANSWER_TAG in event.get("tags", []):
+                    token = event["data"]["chunk"].content
+                    if token:
+                        yield {"token": token}
+                elif kind == "on_chain_end" and not event.get("parent_ids"):
+                    result = event["data"]["output"]
+        except asyncio.TimeoutError:
+            logging.warning(f"Таймаут ответа ({ANSWER_TIMEOUT}s) для {source!r}: {question!r}")
+            yield {"answer": TIMEOUT_TEXT, "sources": []}
+            return
+        finally:
+            await events.aclose()
+    if result is None:
+        yield {"answer": NOT_FOUND_TEXT, "sources": []}
+        return
+    answer = await asyncio.to_thread(_remember, user_id, source, question, standalone, result)
+    yield {"answer": answer, "sources": _source_titles(result)}
+
+async def _achain(source: str) -> Optional[ConversationalRetrievalChain]:
+    chain = _chains.get(source)
+    if chain is None:
+        # первая сборка индекса/цепочки тяжёлая — уносим её из event‑loop
+        chain = await asyncio.to_thread(get_rag_chain, source)
+    return chain
 
-def get_answer(question: str, source: str) -> str:
+# ────────────────────────────────────────────────
+#   Самостоятельный вопрос (шаг condense цепочки)
+# ────────────────────────────────────────────────
+def _condense(chain: Optional[ConversationalRetrievalChain], question: str,
+              chat_history: List) -> str:
     """
-    Возвращает ответ на вопрос, фильтруя по метаданным source.
+    Вопрос, который цепочка построила бы сама на шаге condense: без истории —
+    сам вопрос, с историей — его переформулировка по ней. По нему ключуются
+    кэш ответов и singleflight: «а сколько он стоит?» у разных пользователей
+    становится разными вопросами, а повтор уже заданного — тем же самым.
+    Дальше цепочка получает его с пустой историей: промпт ответа историю
+    не видит (в нём только контекст и вопрос), так что ответ не меняется.
     """
-    chain = get_rag_chain()
-    # обновляем фильтр на источник
-    chain.retriever.search_kwargs["filter"] = {"source": source}
-    result = chain({"question": question})
+    if not chat_history or chain is None:
+        return question
+    generator = chain.question_generator
+    result = generator.invoke(
+        {"question": question, "chat_history": _history_text(chain, chat_history)},
+        config=chain_config(ANSWER_TAG),
+    )
+    return result[generator.output_key].strip() or question
+
+async def _astandalone(user_id: int, question: str, source: str) -> str:
+    """Асинхронный _condense под общими ANSWER_CONCURRENCY и ANSWER_TIMEOUT."""
+    chat_history = history_store.get(user_id, source)
+    if not chat_history:
+        return question
+    chain = await _achain(source)
+    if chain is None:
+        return question
+    generator = chain.question_generator
+    async with _answer_slots:
+        result = await asyncio.wait_for(
+            generator.ainvoke(
+                {"question": question, "chat_history": _history_text(chain, chat_history)},
+                config=chain_config(ANSWER_TAG),
+            ),
+            timeout=ANSWER_TIMEOUT,
+        )
+    return result[generator.output_key].strip() or question
+
+def _history_text(chain: ConversationalRetrievalChain, chat_history: List) -> str:
+    from langchain.chains.conversational_retrieval.base import _get_chat_history
+    return (chain.get_chat_history or _get_chat_history)(chat_history)
+
+# ────────────────────────────────────────────────
+#   Кэш ответов и история
+# ────────────────────────────────────────────────
+def _share_history(user_id: int, source: str, question: str, answer: str) -> None:
+    """История для запроса, дождавшегося чужого ответа (ответ в кэш уже положен)."""
+    if answer not in (NOT_FOUND_TEXT, TIMEOUT_TEXT):
+        history_store.append(user_id, source, question, answer)
+
+def _source_titles(result: dict) -> List[str]:
+    titles = (d.metadata.get("title") for d in result.get("source_documents") or [])
+    return list(dict.fromkeys(t for t in titles if t))
+
+def _lookup_cached(user_id: int, source: str, question: str, standalone: str) -> Optional[str]:
+    """Готовый ответ на самостоятельный вопрос; в историю пишется исходный."""
+    with metrics.timer("rag_stage_seconds", stage="answer_cache"):
+        cached = answer_cache.lookup(source, standalone)
+    if cached is not None:
+        history_store.append(user_id, source, question, cached)
+    return cached
+
+def _remember(user_id: int, source: str, question: str, standalone: str, result: dict) -> str:
+    """Пишет ответ в историю (по исходному вопросу) и в кэш (по самостоятельному)."""
     docs = result.get("source_documents") or []
-    return result["answer"] if docs else "Не нашли информацию по вашему запросу."
\ No newline at end of file
+    if not docs:
+        return NOT_FOUND_TEXT
+    history_store.append(user_id, source, question, result["answer"])
+    answer_cache.store(source, standalone, result["answer"])
+    return result["answer"]
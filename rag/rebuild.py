@@ -0,0 +1,104 @@
+# rag/rebuild.py
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from typing import Awaitable, Callable, Dict, List, Optional
+
+from .config import REBUILD_DEBOUNCE
+from .metrics import metrics
+from .pipeline import refresh_chain
+
+Notify = Callable[[str], Awaitable[object]]
+
+
+class RebuildQueue:
+    """
+    Единственный фоновый воркер обновления индекса.
+    Заявки на один и тот же source, пришедшие пока воркер ждёт или занят,
+    склеиваются в одну пересборку. Сама пересборка идёт в отдельном потоке
+    в новой версии шарда (см. rag.vectorestore), поэтому вопросы
+    пользователей всё это время обслуживаются старой версией.
+    """
+
+    def __init__(self, debounce: float):
+        self._debounce = debounce
+        self._pending: Dict[str, List[Notify]] = {}
+        self._wakeup: Optional[asyncio.Event] = None
+        self._task: Optional[asyncio.Task] = None
+        self.current: Optional[str] = None
+        self.last_error: Optional[str] = None
+        self.last_duration: Optional[float] = None
+        self.builds = 0
+
+    def request(self, source: str, notify: Optional[Notify] = None) -> bool:
+        """
+        Ставит source в очередь на обновление.
+        Возвращает False, если заявка склеилась с уже ожидающей.
+        """
+        self._ensure_worker()
+        merged = source in self._pending
+        callbacks = self._pending.setdefault(source, [])
+        if notify is not None:
+            callbacks.append(notify)
+        self._wakeup.set()
+        return not merged
+
+    def status(self) -> Dict[str, object]:
+        return {
+            "running": self.current,
+            "pending": list(self._pending),
+            "builds": self.builds,
+            "last_duration": self.last_duration,
+            "last_error": self.last_error,
+        }
+
+    def _ensure_worker(self) -> None:
+        if self._task is None or self._task.done():
+            self._wakeup = asyncio.Event()
+            self._task = asyncio.create_task(self._run(), name="index-rebuild")
+
+    async def _run(self) -> None:
+        while True:
+            await self._wakeup.wait()
+            # даём серии загрузок «досыпаться», чтобы собрать их в одну сборку
+            await asyncio.sleep(self._debounce)
+            self._wakeup.clear()
+            batch, self._pending = self._pending, {}
+            total = len(batch)
+            for i, (source, callbacks) in enumerate(batch.items(), start=1):
+                await self._build(source, callbacks, i, total)
+
+    async def _build(self, source: str, callbacks: List[Notify], i: int, total: int) -> None:
+        self.current = source
+        await _notify_all(callbacks, f"🔄 Обновляем индекс «{source}» ({i}/{total})…")
+        started = time.monotonic()
+        try:
+            await asyncio.to_thread(refresh_chain, source)
+        except Exception as exc:
+            logging.exception(f"Не удалось обновить шард «{source}»")
+            self.last_error = f"{source}: {exc}"
+            await _notify_all(callbacks, f"❌ Не удалось обновить индекс «{source}»: {exc}")
+            return
+        finally:
+            self.current = None
+        self.builds += 1
+        self.last_duration = time.monotonic() - started
+        metrics.observe("rag_rebuild_seconds", self.last_duration)
+        self.last_error = None
+        await _notify_all(
+            callbacks,
+            f"✅ Индекс «{source}» обновлён за {self.last_duration:.1f} с и готов к работе!",
+        )
+
+
+async def _notify_all(callbacks: List[Notify], text: str) -> None:
+    for callback in callbacks:
+        try:
+            await callback(text)
+        except Exception as exc:
+            logging.error(f"Не удалось отправить статус пересборки: {exc}")
+
+
+rebuild_queue = RebuildQueue(debounce=REBUILD_DEBOUNCE)
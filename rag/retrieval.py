@@ -0,0 +1,71 @@
+# rag/retrieval.py
+from __future__ import annotations
+
+from typing import Any, Dict, List
+
+from langchain_core.callbacks import CallbackManagerForRetrieverRun
+from langchain_core.documents import Document
+from langchain_core.retrievers import BaseRetriever
+
+from .config import (
+    RETRIEVER_K,
+    RETRIEVER_FETCH_K,
+    RRF_K,
+    LEXICAL_FAST_MIN_SCORE,
+    LEXICAL_FAST_RATIO,
+)
+from .metrics import metrics
+
+
+def _key(doc: Document) -> str:
+    meta = doc.metadata
+    return f"{meta.get('row_id')}:{meta.get('chunk')}:{meta.get('hash')}"
+
+
+class HybridRetriever(BaseRetriever):
+    """
+    Гибридный поиск по шарду: BM25 (lexical) + векторный (vectorstore),
+    результаты сливаются reciprocal rank fusion.
+    Если BM25 уверен в лидере, эмбеддинг запроса и векторный поиск пропускаются.
+    """
+
+    vectorstore: Any
+    lexical: Any
+    k: int = RETRIEVER_K
+    fetch_k: int = RETRIEVER_FETCH_K
+    rrf_k: int = RRF_K
+    fast_min_score: float = LEXICAL_FAST_MIN_SCORE
+    fast_ratio: float = LEXICAL_FAST_RATIO
+
+    def _lexical_docs(self, query: str) -> List[tuple]:
+        return [
+            (Document(page_content=self.lexical.texts[i],
+                      metadata=self.lexical.metadatas[i]), score)
+            for i, score in self.lexical.search(query, self.fetch_k)
+        ]
+
+    def _confident(self, hits: List[tuple]) -> bool:
+        if not self.fast_ratio or not hits or hits[0][1] < self.fast_min_score:
+            return False
+        return len(hits) == 1 or hits[0][1] >= self.fast_ratio * hits[1][1]
+
+    def _get_relevant_documents(
+        self, query: str, *, run_manager: CallbackManagerForRetrieverRun
+    ) -> List[Document]:
+        with metrics.timer("rag_stage_seconds", stage="lexical_search"):
+            lexical = self._lexical_docs(query)
+        if self._confident(lexical):
+            return [doc for doc, _ in lexical[:self.k]]
+
+        # включает эмбеддинг вопроса — он отдельно виден как stage="embed_query"
+        with metrics.timer("rag_stage_seconds", stage="vector_search"):
+            vector = self.vectorstore.similarity_search(query, k=self.fetch_k)
+        scores: Dict[str, float] = {}
+        docs: Dict[str, Document] = {}
+        for ranking in (vector, [doc for doc, _ in lexical]):
+            for rank, doc in enumerate(ranking):
+                key = _key(doc)
+                docs.setdefault(key, doc)
+                scores[key] = scores.get(key, 0.0) + 1.0 / (self.rrf_k + rank + 1)
+        best = sorted(scores, key=scores.get, reverse=True)[:self.k]
+        return [docs[key] for key in best]
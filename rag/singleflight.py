@@ -0,0 +1,131 @@
+# rag/singleflight.py
+"""
+Схлопывание одинаковых одновременных запросов (single flight).
+Пока ответ на (источник, нормализованный вопрос) считается, повторные
+вопросы не запускают свой эмбеддинг, поиск и LLM, а ждут уже идущий.
+
+Вычисление идёт отдельной задачей: отмена первого запроса (таймаут
+хэндлера, закрытый стрим) не обрывает тех, кто к нему присоединился,
+а готовый ответ всё равно попадёт в кэш ответов.
+"""
+from __future__ import annotations
+
+import asyncio
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Hashable, List, Tuple
+
+from .text import normalize_question
+
+
+def flight_key(source: str, question: str) -> Tuple[str, str]:
+    """
+    Ключ как у кэша ответов: (источник, нормализованный вопрос).
+    Годится только для вопросов без истории диалога — с историей
+    цепочка переписывает вопрос по-своему для каждого пользователя.
+    """
+    return source, normalize_question(question)
+
+
+class _Broadcast:
+    """Буфер событий стрима: каждый подписчик читает его с начала."""
+
+    def __init__(self):
+        self.events: List[Any] = []
+        self.done = False
+        self.error: BaseException | None = None
+        self.changed = asyncio.Condition()
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Task] = {}
+        self._streams: Dict[Hashable, _Broadcast] = {}
+        self.leaders = 0      # запросов, которые действительно считались
+        self.collapsed = 0    # запросов, дождавшихся чужого вычисления
+
+    # ────────────────────────────────────────────────
+    #   Обычный вызов
+    # ────────────────────────────────────────────────
+    async def call(self, key: Hashable, compute: Callable[[], Awaitable[Any]]) -> Tuple[Any, bool]:
+        """
+        Возвращает (результат, shared): shared=True — результат
+        посчитан для другого запроса с тем же ключом.
+        """
+        task = self._calls.get(key)
+        shared = task is not None
+        if shared:
+            self.collapsed += 1
+        else:
+            self.leaders += 1
+            task = asyncio.ensure_future(compute())
+            self._calls[key] = task
+            task.add_done_callback(lambda t: self._finished(self._calls, key, t))
+        return await asyncio.shield(task), shared
+
+    # ────────────────────────────────────────────────
+    #   Стрим
+    # ────────────────────────────────────────────────
+    def stream(self, key: Hashable, produce: Callable[[], AsyncIterator[Any]]) -> Tuple[AsyncIterator[Any], bool]:
+        """
+        Как call(), но для асинхронного генератора событий: все
+        подписчики получают одну и ту же последовательность целиком,
+        присоединившиеся позже — сначала уже накопленную часть.
+        """
+        feed = self._streams.get(key)
+        shared = feed is not None
+        if shared:
+            self.collapsed += 1
+        else:
+            self.leaders += 1
+            feed = self._streams[key] = _Broadcast()
+            task = asyncio.ensure_future(self._pump(feed, produce()))
+            task.add_done_callback(lambda t: self._finished(self._streams, key, t))
+        return self._subscribe(feed), shared
+
+    @staticmethod
+    async def _pump(feed: _Broadcast, events: AsyncIterator[Any]) -> None:
+        try:
+            async for event in events:
+                async with feed.changed:
+                    feed.events.append(event)
+                    feed.changed.notify_all()
+        except BaseException as exc:
+            feed.error = exc
+        finally:
+            async with feed.changed:
+                feed.done = True
+                feed.changed.notify_all()
+
+    @staticmethod
+    async def _subscribe(feed: _Broadcast) -> AsyncIterator[Any]:
+        seen = 0
+        while True:
+            async with feed.changed:
+                await feed.changed.wait_for(lambda: seen < len(feed.events) or feed.done)
+                batch = feed.events[seen:]
+                finished = feed.done
+            seen += len(batch)
+            for event in batch:
+                yield event
+            if finished:
+                if feed.error is not None:
+                    raise feed.error
+                return
+
+    # ────────────────────────────────────────────────
+    @staticmethod
+    def _finished(calls: Dict[Hashable, Any], key: Hashable, task: asyncio.Task) -> None:
+        calls.pop(key, None)
+        if not task.cancelled():
+            task.exception()          # ошибку уже получили ожидающие; не шумим в лог
+
+    def stats(self) -> Dict[str, float]:
+        total = self.leaders + self.collapsed
+        return {
+            "leaders": self.leaders,
+            "collapsed": self.collapsed,
+            "collapse_rate": self.collapsed / total if total else 0.0,
+            "in_flight": len(self._calls) + len(self._streams),
+        }
+
+
+inflight = SingleFlight()
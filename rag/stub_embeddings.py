@@ -0,0 +1,206 @@
+# rag/stub_embeddings.py
+"""
+Локальный stub OpenAI‑совместимых эндпоинтов /v1/embeddings и
+/v1/chat/completions для тестов и бенчмарков без сети и без расходов на API.
+
+    python -m rag.stub_embeddings --port 8765 --latency 0.05 --rate-limit-every 10
+    OPENAI_API_BASE=http://127.0.0.1:8765/v1 OPENAI_API_KEY=stub python -m bot.main
+
+Векторы детерминированы: один и тот же вход всегда даёт один и тот же
+единичный вектор, так что поиск по индексу работает предсказуемо.
+Чат‑модель тоже фальшивая: ждёт chat_latency, затем отдаёт (или стримит
+по token_delay на слово) кусок последнего сообщения; на просьбу
+переформулировать вопрос возвращает сам вопрос.
+"""
+from __future__ import annotations
+
+import argparse
+import base64
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from array import array
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List
+
+
+def fake_vector(item, dim: int) -> List[float]:
+    """Детерминированный единичный вектор для строки или списка токенов."""
+    key = item if isinstance(item, str) else json.dumps(item)
+    rnd = random.Random(hashlib.sha256(key.encode("utf-8")).digest())
+    vec = [rnd.gauss(0.0, 1.0) for _ in range(dim)]
+    norm = math.sqrt(sum(x * x for x in vec)) or 1.0
+    return [x / norm for x in vec]
+
+
+class StubEmbeddingServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, address, dim: int = 1536, latency: float = 0.0,
+                 rate_limit_every: int = 0, chat_latency: float = 0.0,
+                 token_delay: float = 0.0, answer_words: int = 40):
+        super().__init__(address, _Handler)
+        self.dim = dim
+        self.latency = latency
+        self.rate_limit_every = rate_limit_every
+        self.chat_latency = chat_latency
+        self.token_delay = token_delay
+        self.answer_words = answer_words
+        self.requests = 0
+        self.inputs = 0
+        self.chat_requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def base_url(self) -> str:
+        host, port = self.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> threading.Thread:
+        """Запускает сервер в фоновом потоке (удобно для бенчмарков)."""
+        thread = threading.Thread(target=self.serve_forever, daemon=True)
+        thread.start()
+        return thread
+
+
+class _Handler(BaseHTTPRequestHandler):
+    server: StubEmbeddingServer
+
+    def do_POST(self):
+        path = self.path.rstrip("/")
+        body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+        if path.endswith("/chat/completions"):
+            self._chat(body)
+        elif path.endswith("/embeddings"):
+            self._embeddings(body)
+        else:
+            self._reply(404, {"error": {"message": "not found"}})
+
+    def _embeddings(self, body: dict):
+        inputs = body.get("input", [])
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+
+        with self.server._lock:
+            self.server.requests += 1
+            n = self.server.requests
+            every = self.server.rate_limit_every
+            if not (every and n % every == 0):
+                self.server.inputs += len(inputs)
+        if every and n % every == 0:
+            self._reply(429, {"error": {"message": "stub rate limit", "type": "rate_limit"}},
+                        headers={"Retry-After": "0"})
+            return
+
+        if self.server.latency:
+            time.sleep(self.server.latency)
+
+        data = []
+        for i, item in enumerate(inputs):
+            vec = fake_vector(item, self.server.dim)
+            if body.get("encoding_format") == "base64":
+                payload = base64.b64encode(array("f", vec).tobytes()).decode("ascii")
+            else:
+                payload = vec
+            data.append({"object": "embedding", "index": i, "embedding": payload})
+        self._reply(200, {
+            "object": "list",
+            "data": data,
+            "model": body.get("model", "stub"),
+            "usage": {"prompt_tokens": 0, "total_tokens": 0},
+        })
+
+    def _chat(self, body: dict):
+        with self.server._lock:
+            self.server.chat_requests += 1
+        if self.server.chat_latency:
+            time.sleep(self.server.chat_latency)
+        words = _fake_answer(body.get("messages", []), self.server.answer_words).split(" ")
+        model = body.get("model", "stub")
+        if not body.get("stream"):
+            self._reply(200, {
+                "id": "chatcmpl-stub", "object": "chat.completion", "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "finish_reason": "stop",
+                             "message": {"role": "assistant", "content": " ".join(words)}}],
+                "usage": {"prompt_tokens": 0, "completion_tokens": len(words), "total_tokens": len(words)},
+            })
+            return
+
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.end_headers()
+        for i, word in enumerate(words):
+            if i and self.server.token_delay:
+                time.sleep(self.server.token_delay)
+            self._event(model, {"content": word if i == 0 else " " + word}, None)
+        self._event(model, {}, "stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+
+    def _event(self, model: str, delta: dict, finish_reason):
+        chunk = {
+            "id": "chatcmpl-stub", "object": "chat.completion.chunk", "created": int(time.time()),
+            "model": model,
+            "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+        }
+        self.wfile.write(b"data: " + json.dumps(chunk).encode("utf-8") + b"\n\n")
+        self.wfile.flush()
+
+    def _reply(self, status: int, payload: dict, headers: dict | None = None):
+        raw = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(raw)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(raw)
+
+    def log_message(self, format, *args):   # не засоряем вывод бенчмарков
+        pass
+
+
+_FOLLOW_UP = re.compile(r"Follow Up Input:\s*(.*?)\s*\n", re.S)
+
+
+def _fake_answer(messages: list, words: int) -> str:
+    """Детерминированный «ответ» по последнему сообщению."""
+    content = messages[-1].get("content", "") if messages else ""
+    if isinstance(content, list):
+        content = " ".join(part.get("text", "") for part in content)
+    question = _FOLLOW_UP.search(content)
+    if question:                        # переформулировка вопроса — возвращаем его же
+        return question.group(1)
+    return " ".join(content.split()[:words]) or "ok"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Stub OpenAI embeddings server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--dim", type=int, default=1536)
+    parser.add_argument("--latency", type=float, default=0.0,
+                        help="задержка ответа, сек")
+    parser.add_argument("--rate-limit-every", type=int, default=0,
+                        help="каждый N‑й запрос отвечает 429")
+    parser.add_argument("--chat-latency", type=float, default=0.0,
+                        help="задержка до первого токена чат‑модели, сек")
+    parser.add_argument("--token-delay", type=float, default=0.0,
+                        help="пауза между словами при стриминге, сек")
+    args = parser.parse_args()
+
+    server = StubEmbeddingServer((args.host, args.port), dim=args.dim,
+                                 latency=args.latency,
+                                 rate_limit_every=args.rate_limit_every,
+                                 chat_latency=args.chat_latency,
+                                 token_delay=args.token_delay)
+    print(f"🧪  Stub embeddings: {server.base_url}")
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,15 @@
+# rag/text.py
+import re
+
+_SPACES = re.compile(r"\s+")
+_TRAILING = re.compile(r"[\s?!.,;:…]+$")
+
+
+def normalize_question(text: str) -> str:
+    """
+    Приводит вопрос к каноническому виду для кэшей:
+    нижний регистр, ё→е, схлопнутые пробелы, без хвостовой пунктуации.
+    """
+    text = text.lower().replace("ё", "е")
+    text = _SPACES.sub(" ", text).strip()
+    return _TRAILING.sub("", text)
@@ -0,0 +1,28 @@
+# rag/tokens.py
+from functools import lru_cache
+from typing import Optional
+
+from .config import LLM_MODEL_NAME
+
+
+@lru_cache(maxsize=4)
+def _encoding(model: str):
+    import tiktoken
+    try:
+        return tiktoken.encoding_for_model(model)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def count_tokens(text: str, model: Optional[str] = None) -> int:
+    """Число токенов текста в кодировке модели (по умолчанию LLM_MODEL_NAME)."""
+    return len(_encoding(model or LLM_MODEL_NAME).encode(text))
+
+
+def truncate_tokens(text: str, limit: int, model: Optional[str] = None) -> str:
+    """Обрезает текст до limit токенов (по границе токена)."""
+    encoding = _encoding(model or LLM_MODEL_NAME)
+    tokens = encoding.encode(text)
+    if len(tokens) <= limit:
+        return text
+    return encoding.decode(tokens[:limit])
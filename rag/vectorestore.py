@@ -1,71 +1,452 @@
 # rag/vectorestore.py
 from __future__ import annotations
 
+import contextlib
+import hashlib
+import json
+import logging
 import shutil
 import sqlite3
-import tempfile
+import threading
+import time
+import weakref
 from pathlib import Path
-from typing import List
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
-from langchain_openai import OpenAIEmbeddings
-from langchain_chroma import Chroma
-from langchain.docstore.document import Document
-from langchain.text_splitter import RecursiveCharacterTextSplitter
+from .config import (
+    EMBEDDING_MODEL_NAME,
+    VECTOR_BACKEND,
+    VECTOR_QUANTIZATION,
+    VECTOR_RESCORE,
+    VECTOR_INT8_UNVALIDATED,
+    INDEX_READ_ONLY,
+)
+from .lexical import BM25_NAME, BM25Index
+from .metrics import metrics
 
-from .config import OPENAI_API_KEY
+# тяжёлые langchain/chromadb импортируются лениво, при первом обращении к индексу
+if TYPE_CHECKING:
+    from langchain_core.vectorstores import VectorStore
+    from langchain.docstore.document import Document
 
 DB_PATH = Path("data.db")
-BASE_DIR = Path("vectorstore")          # «актуальный» индекс живёт здесь
+BASE_DIR = Path("vectorstore")          # здесь живут шарды — по одному на source
+MANIFEST_NAME = "manifest.json"
+CURRENT_NAME = "CURRENT"                # указатель на актуальную версию шарда
+KEEP_VERSIONS = 2                       # актуальная + предыдущая, которую ещё могут читать
+CHUNK_SIZE = 1_000
+CHUNK_OVERLAP = 100
+UPSERT_CHUNK = 1_000                    # Chroma ограничивает размер одной записи
 
+# int8 включаем только по явному согласию: его recall на настоящих эмбеддингах не проверен
+QUANTIZATION = VECTOR_QUANTIZATION
+if QUANTIZATION == "int8" and not VECTOR_INT8_UNVALIDATED:
+    logging.warning("⚠️  VECTOR_QUANTIZATION=int8 не проверен на эмбеддингах data/ — "
+                    "ищем по float32 (включить всё равно: VECTOR_INT8_UNVALIDATED=1)")
+    QUANTIZATION = "none"
 
-def _load_docs() -> List[Document]:
+# сборки одного шарда не должны идти параллельно (copytree/_sync/_flip одного каталога)
+_shard_locks: Dict[str, threading.RLock] = {}
+_shard_locks_guard = threading.Lock()
+
+# версии шардов, открытые в этом процессе: каталог → число живых хранилищ.
+# Версию, которую _flip/drop_shard уже списали, удаляем, только когда её
+# последнее хранилище (и клиент Chroma) закрыто
+_open_versions: Dict[Path, int] = {}
+_retired: set = set()
+_versions_lock = threading.Lock()
+
+
+def shard_name(source: str) -> str:
+    """
+    Имя шарда (и коллекции Chroma) для источника.
+    Chroma допускает в именах только латиницу, поэтому берём хэш.
+    """
+    return "src_" + hashlib.sha1(source.encode("utf-8")).hexdigest()[:16]
+
+
+def shard_dir(source: str) -> Path:
+    """
+    Корень шарда. Внутри — версии v<ns>/ и файл CURRENT с именем актуальной.
+    Новая версия собирается рядом, а читатели переключаются на неё
+    атомарной заменой CURRENT, так что на диске всегда есть готовый индекс.
+    """
+    return BASE_DIR / shard_name(source)
+
+
+def shard_lock(source: str) -> threading.RLock:
+    """
+    Блокировка сборки шарда источника. Её берут build/update/open_shard
+    и rag.pipeline на время подмены шарда; она реентерабельна, так что
+    open_shard → update_shard → build_shard под ней не застревают.
+    """
+    with _shard_locks_guard:
+        lock = _shard_locks.get(source)
+        if lock is None:
+            lock = _shard_locks[source] = threading.RLock()
+        return lock
+
+
+def current_version(source: str) -> Optional[Path]:
+    try:
+        name = (shard_dir(source) / CURRENT_NAME).read_text(encoding="utf-8").strip()
+    except OSError:
+        return None
+    version = shard_dir(source) / name
+    return version if version.is_dir() else None
+
+
+def _new_version(source: str) -> Path:
+    root = shard_dir(source)
+    root.mkdir(parents=True, exist_ok=True)
+    return root / f"v{time.time_ns()}"
+
+
+def _flip(source: str, version: Path) -> None:
+    """Атомарно делает version актуальной и чистит старые версии."""
+    root = shard_dir(source)
+    tmp = root / (CURRENT_NAME + ".tmp")
+    tmp.write_text(version.name, encoding="utf-8")
+    tmp.replace(root / CURRENT_NAME)
+
+    versions = sorted(p for p in root.iterdir() if p.is_dir() and p.name.startswith("v"))
+    for old in versions[:-KEEP_VERSIONS]:
+        _retire(old)
+
+
+def _track(vs: VectorStore, dir_: Path, client=None) -> None:
+    """Считает хранилище vs читателем версии dir_ до его сборки мусором."""
+    key = dir_.resolve()
+    with _versions_lock:
+        _open_versions[key] = _open_versions.get(key, 0) + 1
+    weakref.finalize(vs, _release, key, client)
+
+
+def _release(key: Path, client) -> None:
+    if client is not None:
+        try:
+            client.close()
+        except Exception:
+            logging.exception(f"Не удалось закрыть клиент Chroma для {key}")
+    with _versions_lock:
+        left = _open_versions.pop(key, 1) - 1
+        if left > 0:
+            _open_versions[key] = left
+            return
+        if key not in _retired:
+            return
+        _retired.discard(key)
+    shutil.rmtree(key, ignore_errors=True)
+    with contextlib.suppress(OSError):
+        key.parent.rmdir()        # после drop_shard — последняя версия шарда
+
+
+def _retire(version: Path) -> None:
+    """Удаляет версию шарда сейчас или, если её ещё читают, — после закрытия."""
+    key = version.resolve()
+    with _versions_lock:
+        if _open_versions.get(key):
+            _retired.add(key)
+            return
+    shutil.rmtree(version, ignore_errors=True)
+
+
+def _doc_id(doc: Document) -> str:
+    """
+    Стабильный id чанка: строка site_data + номер чанка + хэш текста.
+    Одинаковый чанк всегда получает один и тот же id, поэтому
+    по набору id можно понять, что уже лежит в коллекции.
+    """
+    meta = doc.metadata
+    return f"{meta['row_id']}:{meta['chunk']}:{meta['hash']}"
+
+
+@metrics.timed("rag_db_seconds", op="load_rows")
+def _load_rows(source: str) -> List[tuple]:
     conn = sqlite3.connect(DB_PATH)
-    rows = conn.execute("SELECT source, content FROM site_data").fetchall()
+    rows = conn.execute(
+        "SELECT id, source, title, content FROM site_data WHERE source = ?", (source,)
+    ).fetchall()
     conn.close()
+    return rows
+
+
+def list_sources() -> List[str]:
+    conn = sqlite3.connect(DB_PATH)
+    rows = conn.execute("SELECT DISTINCT source FROM site_data").fetchall()
+    conn.close()
+    return [row[0] for row in rows]
+
+
+def _manifest(source: str, rows: List[tuple]) -> Dict:
+    """
+    Отпечаток данных, из которых построен шард: id строк, хэши их
+    содержимого и параметры разбиения/эмбеддинга.
+    """
+    return {
+        "source": source,
+        "embedding_model": EMBEDDING_MODEL_NAME,
+        "backend": VECTOR_BACKEND,
+        "chunk_size": CHUNK_SIZE,
+        "chunk_overlap": CHUNK_OVERLAP,
+        "rows": {
+            str(row_id): hashlib.sha1(content.encode("utf-8")).hexdigest()
+            for row_id, _source, _title, content in rows
+        },
+    }
+
+
+def _read_manifest(dir_: Path) -> Dict | None:
+    try:
+        return json.loads((dir_ / MANIFEST_NAME).read_text(encoding="utf-8"))
+    except (OSError, ValueError):
+        return None
+
+
+def _write_manifest(dir_: Path, manifest: Dict) -> None:
+    tmp = dir_ / (MANIFEST_NAME + ".tmp")
+    tmp.write_text(json.dumps(manifest, ensure_ascii=False), encoding="utf-8")
+    tmp.replace(dir_ / MANIFEST_NAME)
+
+
+def _load_docs(rows: List[tuple]) -> List[Document]:
+    from langchain.docstore.document import Document
+    from langchain.text_splitter import RecursiveCharacterTextSplitter
 
     splitter = RecursiveCharacterTextSplitter(
-        chunk_size=1_000, chunk_overlap=100,
+        chunk_size=CHUNK_SIZE, chunk_overlap=CHUNK_OVERLAP,
         separators=["\n\n", "\n", ".", "!", "?"],
     )
     docs = []
-    for source, content in rows:
-        for chunk in splitter.split_text(content):
-            docs.append(Document(page_content=chunk, metadata={"source": source}))
+    for row_id, source, title, content in rows:
+        for i, chunk in enumerate(splitter.split_text(content)):
+            digest = hashlib.sha1(chunk.encode("utf-8")).hexdigest()
+            docs.append(Document(
+                page_content=chunk,
+                metadata={
+                    "source": source,
+                    "title": title,
+                    "row_id": row_id,
+                    "chunk": i,
+                    "hash": digest,
+                },
+            ))
     return docs
 
 
-def _build_index(dir_: Path) -> Chroma:
-    docs = _load_docs()
-    print(f"📄  Строим индекс в {dir_}. Документов: {len(docs)}")
+def _open(source: str, dir_: Path) -> VectorStore:
+    """
+    Открывает версию шарда в выбранном бэкенде (VECTOR_BACKEND).
+    У Chroma на версию — свой PersistentClient; он закрывается вместе
+    с последним хранилищем этой версии (см. _track).
+    """
+    from .embeddings import get_embeddings
+
+    if VECTOR_BACKEND == "numpy":
+        from .numpy_store import NumpyVectorStore
+        vs = NumpyVectorStore(dir_, get_embeddings(), quantization=QUANTIZATION,
+                              rescore=VECTOR_RESCORE, read_only=INDEX_READ_ONLY)
+        _track(vs, dir_)
+        return vs
 
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-    return Chroma.from_documents(
-        documents=docs,
-        embedding=embeddings,
-        collection_name="rag_collection",
-        persist_directory=str(dir_),
+    import chromadb
+    from langchain_chroma import Chroma
+    client = chromadb.PersistentClient(path=str(dir_))
+    vs = Chroma(
+        collection_name=shard_name(source),
+        client=client,
+        embedding_function=get_embeddings(),
     )
+    _track(vs, dir_, client)
+    return vs
+
+
+def _write_docs(vs: VectorStore, docs: List[Document]) -> None:
+    """
+    Эмбеддит docs батчами (см. CachedEmbeddings.embed_streaming)
+    и пишет каждый готовый батч в коллекцию, не дожидаясь остальных.
+    """
+    from .embeddings import get_embeddings
+
+    ids = [_doc_id(d) for d in docs]
+    texts = [d.page_content for d in docs]
+
+    # у NumpyVectorStore upsert свой, у Chroma — у коллекции
+    upsert = vs.upsert if VECTOR_BACKEND == "numpy" else vs._collection.upsert
+
+    def write(indices: List[int], vectors: List[List[float]]) -> None:
+        for i in range(0, len(indices), UPSERT_CHUNK):
+            part = indices[i:i + UPSERT_CHUNK]
+            upsert(
+                ids=[ids[j] for j in part],
+                embeddings=vectors[i:i + UPSERT_CHUNK],
+                metadatas=[docs[j].metadata for j in part],
+                documents=[texts[j] for j in part],
+            )
+
+    get_embeddings().embed_streaming(texts, write)
+
+
+def _flush(vs: VectorStore) -> None:
+    """Chroma пишет на диск сама, NumpyVectorStore — только по flush()."""
+    if VECTOR_BACKEND == "numpy":
+        vs.flush()
+
+
+def stored_vectors(vs: VectorStore, docs: List[Document]) -> List[Optional[List[float]]]:
+    """
+    Векторы чанков docs, уже лежащие в шарде, — без обращения к эмбеддеру
+    и его кэшу. Для чанка, которого в шарде нет, — None.
+    """
+    ids = [_doc_id(d) for d in docs]
+    unique = list(dict.fromkeys(ids))
+    if VECTOR_BACKEND == "numpy":
+        found = vs.get_vectors(unique)
+    else:
+        got = vs._collection.get(ids=unique, include=["embeddings"])
+        found = dict(zip(got["ids"], got["embeddings"]))
+    return [found.get(id_) for id_ in ids]
+
+
+def _build_index(source: str, dir_: Path) -> VectorStore:
+    rows = _load_rows(source)
+    docs = _load_docs(rows)
+    print(f"📄  Строим шард «{source}» в {dir_}. Документов: {len(docs)}")
+
+    vs = _open(source, dir_)
+    _write_docs(vs, docs)
+    _flush(vs)
+    _save_lexical(docs, dir_)
+    _write_manifest(dir_, _manifest(source, rows))
+    return vs
+
+
+def _save_lexical(docs: List[Document], dir_: Path) -> None:
+    """BM25 строится из тех же чанков, что и векторы, и лежит в той же версии."""
+    BM25Index([d.page_content for d in docs], [d.metadata for d in docs]).save(dir_)
+
+
+def load_lexical(source: str) -> Optional[BM25Index]:
+    """BM25‑индекс актуальной версии шарда (None, если шарда нет)."""
+    current = current_version(source)
+    if current is None:
+        return None
+    if not (current / BM25_NAME).exists():
+        docs = _load_docs(_load_rows(source))
+        if INDEX_READ_ONLY:
+            # воркер в версию шарда не пишет (её читают и другие процессы) — индекс в памяти
+            return BM25Index([d.page_content for d in docs], [d.metadata for d in docs])
+        with shard_lock(source):
+            if not (current / BM25_NAME).exists():
+                _save_lexical(docs, current)
+    return BM25Index.load(current)
+
+
+def build_shard(source: str) -> VectorStore:
+    """
+    1. Строит шард источника с нуля в новом каталоге версии.
+    2. Атомарно переключает на него CURRENT.
+    3. Возвращает готовое хранилище, читающее новую версию.
+    Пока идёт сборка, читатели продолжают работать со старой версией.
+    """
+    with shard_lock(source):
+        version = _new_version(source)
+        vs = _build_index(source, version)
+        _flip(source, version)
+
+    from .embeddings import get_embeddings
+    print(f"✅  Шард «{source}» пересобран, кэш эмбеддингов: {get_embeddings().stats()}")
+    return vs
+
+
+def _sync(source: str, vs: VectorStore, dir_: Path) -> Tuple[int, int]:
+    """
+    Инкрементально приводит коллекцию шарда к текущему содержимому site_data:
+    эмбеддит только новые чанки и удаляет векторы исчезнувших строк.
+    Возвращает (добавлено, удалено).
+    """
+    rows = _load_rows(source)
+    docs = _load_docs(rows)
+    wanted = {_doc_id(d): d for d in docs}
+    existing = set(vs.get(include=[])["ids"])
+
+    stale = [id_ for id_ in existing if id_ not in wanted]
+    fresh = [id_ for id_ in wanted if id_ not in existing]
+
+    if stale:
+        vs.delete(ids=stale)
+    if fresh:
+        _write_docs(vs, [wanted[id_] for id_ in fresh])
+    _flush(vs)
+    _save_lexical(docs, dir_)
+    _write_manifest(dir_, _manifest(source, rows))
+
+    print(f"🔁  Шард «{source}» синхронизирован: +{len(fresh)} / -{len(stale)} чанков")
+    return len(fresh), len(stale)
+
+
+def update_shard(source: str) -> Optional[VectorStore]:
+    """
+    Обновляет шард источника после изменения его данных.
+    Если шард уже есть — копирует актуальную версию, синхронизирует копию
+    инкрементально и переключает на неё CURRENT; иначе строит с нуля.
+    Если данных источника больше нет — удаляет шард и возвращает None.
+    """
+    with shard_lock(source):
+        if not _load_rows(source):
+            drop_shard(source)
+            return None
+        current = current_version(source)
+        if current is None:
+            return build_shard(source)
+        manifest = _read_manifest(current)
+        if manifest and (manifest.get("embedding_model") != EMBEDDING_MODEL_NAME
+                         or manifest.get("backend", "chroma") != VECTOR_BACKEND):
+            # векторы другой модели или другой формат хранения — только полная пересборка
+            return build_shard(source)
+
+        version = _new_version(source)
+        shutil.copytree(current, version)
+        vs = _open(source, version)
+        _sync(source, vs, version)
+        _flip(source, version)
+        return vs
+
+
+def open_shard(source: str) -> Optional[VectorStore]:
+    """
+    Тёплый старт: если манифест шарда совпадает с текущим содержимым
+    site_data, просто открывает сохранённую коллекцию.
+    Иначе приводит шард в порядок через update_shard().
+    """
+    with shard_lock(source):
+        current = current_version(source)
+        if current is not None and _read_manifest(current) == _manifest(source, _load_rows(source)):
+            return _open(source, current)
+        return update_shard(source)
 
 
-def create_fresh_vectorstore() -> Chroma:
+def open_current(source: str) -> Optional[VectorStore]:
     """
-    1. Создаёт индекс в уникальном временном каталоге.
-    2. Удаляет старый BASE_DIR (если был) и «переименовывает» новый.
-    3. Возвращает готовый объект Chroma, уже читающий из BASE_DIR.
+    Только чтение: открывает текущую версию шарда как есть, без сверки
+    с БД и пересборки (для процессов‑воркеров). None — версии ещё нет.
     """
-    tmp_dir = Path(tempfile.mkdtemp(prefix="vs_tmp_"))
-    vs_tmp = _build_index(tmp_dir)      # строим «песочницу»
+    current = current_version(source)
+    return _open(source, current) if current is not None else None
 
-    # ——> атомарная подмена каталога
-    if BASE_DIR.exists():
-        shutil.rmtree(BASE_DIR)
-    tmp_dir.rename(BASE_DIR)
 
-    # подключаемся к «новому официальному» каталогу
-    print("✅  Индекс пересобран")
-    embeddings = OpenAIEmbeddings(openai_api_key=OPENAI_API_KEY)
-    return Chroma(
-        collection_name="rag_collection",
-        persist_directory=str(BASE_DIR),
-        embedding_function=embeddings,
-    )
\ No newline at end of file
+def drop_shard(source: str) -> None:
+    """Удаляет шард; версии, которые ещё читают, удалятся после закрытия."""
+    target = shard_dir(source)
+    if not target.exists():
+        return
+    with shard_lock(source):
+        (target / CURRENT_NAME).unlink(missing_ok=True)
+        for path in target.iterdir():
+            if path.is_dir():
+                _retire(path)
+            else:
+                path.unlink(missing_ok=True)
+        with contextlib.suppress(OSError):
+            target.rmdir()
+    print(f"🗑  Шард «{source}» удалён")
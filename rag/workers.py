@@ -0,0 +1,263 @@
+# rag/workers.py
+"""
+Пул процессов для ответов (WORKER_PROCESSES > 0).
+
+Процесс бота остаётся фронтендом: Telegram, БД, сборка индекса.
+Вопросы (пользователь, источник, вопрос) уходят по multiprocessing.Pipe
+в один из N воркеров — по user_id % N, так что история диалога
+пользователя всегда живёт в одном процессе (HISTORY_PATH у каждого свой).
+Воркер — отдельный интерпретатор со своим event‑loop: токенизация,
+векторная математика и разбор JSON идут на его ядре, а запросы к LLM
+внутри воркера по‑прежнему параллельны (ANSWER_CONCURRENCY на воркер).
+
+Индекс воркеры открывают только на чтение (INDEX_READ_ONLY=1): текущую
+версию шарда как есть. С VECTOR_BACKEND=numpy матрицы — memmap, и их
+страницы общие для всех процессов. После пересборки шарда основной
+процесс рассылает воркерам "refresh", и они переоткрывают шард.
+"""
+from __future__ import annotations
+
+import asyncio
+import contextlib
+import itertools
+import logging
+import multiprocessing
+import os
+import signal
+import threading
+from typing import AsyncIterator, Dict, List, Optional
+
+from .config import WORKER_PROCESSES, HISTORY_PATH
+
+
+def _worker_env(index: int) -> Dict[str, str]:
+    """Переменные окружения воркера поверх родительских."""
+    env = {"WORKER_PROCESSES": "0", "INDEX_READ_ONLY": "1", "METRICS_ENABLED": "0"}
+    if HISTORY_PATH:
+        env["HISTORY_PATH"] = f"{HISTORY_PATH}.{index}"
+    return env
+
+
+class _Worker:
+    """Процесс‑воркер и его конец канала на стороне фронтенда."""
+
+    def __init__(self, index: int):
+        self.index = index
+        self.process: Optional[multiprocessing.Process] = None
+        self.conn = None
+        self.send_lock = threading.Lock()
+        self.jobs: Dict[int, asyncio.Queue] = {}
+        self.ready: Optional[asyncio.Event] = None
+
+    def send(self, message) -> None:
+        with self.send_lock:
+            self.conn.send(message)
+
+
+class WorkerPool:
+    def __init__(self, processes: int = WORKER_PROCESSES):
+        self._workers = [_Worker(i) for i in range(processes)]
+        self._ids = itertools.count(1)
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._closing = False
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self._workers)
+
+    # ────────────────────────────────────────────────
+    #   Жизненный цикл
+    # ────────────────────────────────────────────────
+    async def start(self) -> None:
+        """
+        Запускает воркеры (spawn: без унаследованных потоков и event‑loop)
+        и ждёт, пока каждый импортирует RAG и откроет шарды.
+        """
+        self._loop = asyncio.get_running_loop()
+        for worker in self._workers:
+            self._spawn(worker)
+        await asyncio.gather(*(worker.ready.wait() for worker in self._workers))
+        logging.info(f"⚙️  Воркеров для ответов: {len(self._workers)}")
+
+    def _spawn(self, worker: _Worker) -> None:
+        ctx = multiprocessing.get_context("spawn")
+        parent, child = ctx.Pipe()
+        # rag.config читается при импорте, поэтому настройки воркера передаём
+        # окружением: дочерний процесс наследует его в момент start()
+        env = _worker_env(worker.index)
+        saved = {key: os.environ.get(key) for key in env}
+        os.environ.update(env)
+        try:
+            process = ctx.Process(target=_worker_main, args=(child,),
+                                  name=f"rag-worker-{worker.index}", daemon=True)
+            process.start()
+        finally:
+            for key, value in saved.items():
+                if value is None:
+                    os.environ.pop(key, None)
+                else:
+                    os.environ[key] = value
+        child.close()
+        worker.process, worker.conn = process, parent
+        worker.ready = asyncio.Event()
+        threading.Thread(target=self._read, args=(worker, parent), daemon=True,
+                         name=f"rag-worker-{worker.index}-reader").start()
+
+    async def close(self) -> None:
+        """Просит воркеров доделать начатое, сохранить историю и выйти."""
+        self._closing = True
+        for worker in self._workers:
+            try:
+                worker.send(None)
+            except OSError:
+                pass
+        for worker in self._workers:
+            if worker.process is not None:
+                await asyncio.to_thread(worker.process.join, 30)
+
+    # ────────────────────────────────────────────────
+    #   Ответы (те же сигнатуры, что у rag.pipeline)
+    # ────────────────────────────────────────────────
+    async def aget_answer(self, user_id: int, question: str, source: str) -> str:
+        async with contextlib.aclosing(self._submit("answer", user_id, question, source)) as events:
+            async for event in events:
+                return event["answer"]
+        raise RuntimeError("Воркер не вернул ответ")
+
+    async def astream_answer(self, user_id: int, question: str, source: str) -> AsyncIterator[dict]:
+        async with contextlib.aclosing(self._submit("stream", user_id, question, source)) as events:
+            async for event in events:
+                yield event
+
+    async def _submit(self, kind: str, user_id: int, question: str, source: str) -> AsyncIterator[dict]:
+        worker = self._workers[user_id % len(self._workers)]
+        job_id = next(self._ids)
+        queue: asyncio.Queue = asyncio.Queue()
+        worker.jobs[job_id] = queue
+        try:
+            worker.send((kind, job_id, user_id, question, source))
+            while True:
+                event, final = await queue.get()
+                if "error" in event:
+                    raise RuntimeError(f"Воркер {worker.index}: {event['error']}")
+                yield event
+                if final:
+                    return
+        finally:
+            worker.jobs.pop(job_id, None)
+
+    def refresh(self, source: str) -> None:
+        """Рассылает воркерам: шард source пересобран, переоткройте его."""
+        for worker in self._workers:
+            try:
+                worker.send(("refresh", source))
+            except OSError:
+                pass              # воркер перезапускается и откроет свежую версию сам
+
+    def stats(self) -> Dict[str, List[int]]:
+        return {"in_flight": [len(w.jobs) for w in self._workers]}
+
+    # ────────────────────────────────────────────────
+    #   Поток‑читатель канала (по одному на воркер)
+    # ────────────────────────────────────────────────
+    def _read(self, worker: _Worker, conn) -> None:
+        while True:
+            try:
+                job_id, event, final = conn.recv()
+            except (EOFError, OSError):
+                break
+            self._loop.call_soon_threadsafe(self._deliver, worker, job_id, event, final)
+        self._loop.call_soon_threadsafe(self._lost, worker, conn)
+
+    @staticmethod
+    def _deliver(worker: _Worker, job_id: int, event: dict, final: bool) -> None:
+        if job_id == _READY:
+            worker.ready.set()
+            return
+        queue = worker.jobs.get(job_id)
+        if queue is not None:            # иначе ответ уже никто не ждёт
+            queue.put_nowait((event, final))
+
+    def _lost(self, worker: _Worker, conn) -> None:
+        if conn is not worker.conn or self._closing:
+            return
+        logging.error(f"❌  Воркер {worker.index} завершился "
+                      f"(код {worker.process.exitcode}), перезапускаем")
+        for queue in worker.jobs.values():
+            queue.put_nowait(({"error": "процесс воркера завершился"}, True))
+        worker.jobs.clear()
+        self._spawn(worker)
+
+
+# ────────────────────────────────────────────────
+#   Процесс‑воркер
+# ────────────────────────────────────────────────
+_READY = 0      # job_id служебного сообщения «воркер готов»
+
+def _worker_main(conn) -> None:
+    # Ctrl+C получает вся группа процессов; останавливает воркер фронтенд
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    asyncio.run(_serve(conn))
+
+
+async def _serve(conn) -> None:
+    from .history import history_store
+    from .pipeline import aget_answer, astream_answer, get_rag_chain, reopen_shard, warm_up
+    from .vectorestore import list_sources
+
+    loop = asyncio.get_running_loop()
+    send_lock = threading.Lock()
+    stopped = asyncio.Event()
+    jobs = set()
+
+    def send(message) -> None:
+        with send_lock:
+            conn.send(message)
+
+    async def run(kind: str, job_id: int, user_id: int, question: str, source: str) -> None:
+        try:
+            if kind == "answer":
+                send((job_id, {"answer": await aget_answer(user_id, question, source)}, True))
+            else:
+                async for event in astream_answer(user_id, question, source):
+                    send((job_id, event, "token" not in event))
+        except Exception as exc:
+            logging.exception(f"Ошибка ответа для {source!r}: {question!r}")
+            send((job_id, {"error": f"{type(exc).__name__}: {exc}"}, True))
+
+    def dispatch(message) -> None:
+        if message is None:
+            stopped.set()
+        elif message[0] == "refresh":
+            reopen_shard(message[1])
+        else:
+            task = loop.create_task(run(*message))
+            jobs.add(task)
+            task.add_done_callback(jobs.discard)
+
+    def read() -> None:
+        while True:
+            try:
+                message = conn.recv()
+            except (EOFError, OSError):
+                message = None          # фронтенд пропал — выходим
+            loop.call_soon_threadsafe(dispatch, message)
+            if message is None:
+                return
+
+    threading.Thread(target=read, daemon=True, name="rag-worker-reader").start()
+    def prepare() -> None:
+        warm_up()
+        # и цепочки: первый вопрос не ждёт импорта langchain и сборки LLM
+        for source in list_sources():
+            get_rag_chain(source)
+
+    await asyncio.to_thread(prepare)
+    send((_READY, {}, True))
+    await stopped.wait()
+    if jobs:
+        await asyncio.gather(*jobs, return_exceptions=True)
+    history_store.save()
+
+
+worker_pool = WorkerPool()
@@ -0,0 +1,29 @@
+# tests/conftest.py
+"""
+Общие фикстуры тестов: корень репозитория в sys.path и офлайн‑токенизатор
+(tiktoken без сети не скачает свои таблицы, а токены нужны истории и контексту).
+
+    python -m pytest -q
+"""
+import sys
+from pathlib import Path
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+
+
+class WordEncoding:
+    """Токен = слово."""
+
+    def encode(self, text: str):
+        return text.split()
+
+    def decode(self, tokens) -> str:
+        return " ".join(tokens)
+
+
+@pytest.fixture(autouse=True)
+def offline_tokens(monkeypatch):
+    import rag.tokens
+    monkeypatch.setattr(rag.tokens, "_encoding", lambda model=None: WordEncoding())
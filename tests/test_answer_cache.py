@@ -0,0 +1,171 @@
+# tests/test_answer_cache.py
+import asyncio
+
+import pytest
+
+from rag.answer_cache import AnswerCache
+
+
+def _cache(**kwargs) -> AnswerCache:
+    params = {"max_entries": 100, "ttl": 60, "threshold": 0}
+    params.update(kwargs)
+    return AnswerCache(**params)
+
+
+# ────────────────────────────────────────────────
+#   Ключ и инвалидация
+# ────────────────────────────────────────────────
+def test_exact_hit_after_normalization():
+    cache = _cache()
+    cache.store("s", "Как отменить подписку?", "ответ")
+    assert cache.lookup("s", "как  отменить подписку") == "ответ"
+    assert cache.lookup("s", "Как отменить подписку!!") == "ответ"
+    assert cache.lookup("s", "как продлить подписку") is None
+    assert cache.stats()["hits"] == 2
+
+
+def test_sources_are_separate():
+    cache = _cache()
+    cache.store("a", "тариф", "ответ a")
+    assert cache.lookup("b", "тариф") is None
+    assert cache.lookup("a", "тариф") == "ответ a"
+
+
+def test_invalidate_drops_only_its_source():
+    cache = _cache()
+    cache.store("a", "q1", "1")
+    cache.store("a", "q2", "2")
+    cache.store("b", "q1", "3")
+    cache.invalidate("a")
+    assert cache.lookup("a", "q1") is None
+    assert cache.lookup("a", "q2") is None
+    assert cache.lookup("b", "q1") == "3"
+    assert cache.stats()["size"] == 1
+
+
+def test_ttl_expiry(monkeypatch):
+    import rag.answer_cache as module
+
+    now = [1000.0]
+    monkeypatch.setattr(module.time, "time", lambda: now[0])
+    cache = _cache(ttl=10)
+    cache.store("s", "q", "a")
+    now[0] += 9
+    assert cache.lookup("s", "q") == "a"
+    now[0] += 2
+    assert cache.lookup("s", "q") is None
+
+
+def test_lru_eviction():
+    cache = _cache(max_entries=2)
+    cache.store("s", "q1", "1")
+    cache.store("s", "q2", "2")
+    assert cache.lookup("s", "q1") == "1"       # q1 свежее q2
+    cache.store("s", "q3", "3")
+    assert cache.lookup("s", "q2") is None
+    assert cache.lookup("s", "q1") == "1"
+    assert cache.lookup("s", "q3") == "3"
+
+
+def test_semantic_hit_respects_threshold():
+    vectors = {"тариф x": [1.0, 0.0], "про тариф x": [0.99, 0.14], "тариф y": [0.0, 1.0]}
+    cache = _cache(threshold=0.95, embed=lambda text: vectors[text])
+    cache.store("s", "тариф X", "про X")
+    assert cache.lookup("s", "про тариф X") == "про X"
+    assert cache.lookup("s", "тариф Y") is None
+
+
+def test_semantic_lookup_disabled_without_threshold():
+    calls = []
+    cache = _cache(threshold=0, embed=lambda text: calls.append(text) or [1.0])
+    cache.store("s", "q", "a")
+    assert cache.lookup("s", "другой вопрос") is None
+    assert calls == []
+
+
+# ────────────────────────────────────────────────
+#   Ключ в пайплайне — самостоятельный вопрос после condense
+# ────────────────────────────────────────────────
+@pytest.fixture
+def pipeline(monkeypatch):
+    """rag.pipeline с цепочкой на фальшивых LLM и чистыми кэшем/историей."""
+    from langchain.chains import ConversationalRetrievalChain
+    from langchain_core.documents import Document
+    from langchain_core.language_models.fake_chat_models import FakeListChatModel
+    from langchain_core.retrievers import BaseRetriever
+
+    from rag import pipeline as P
+    from rag.history import HistoryStore
+    from rag.singleflight import SingleFlight
+
+    class Retriever(BaseRetriever):
+        def _get_relevant_documents(self, query, *, run_manager):
+            return [Document(page_content="тарифы", metadata={"title": "t"})]
+
+    class Condense(FakeListChatModel):
+        """Переписывает уточнение по последнему упомянутому в истории тарифу."""
+
+        def _call(self, messages, stop=None, run_manager=None, **kwargs):
+            history = messages[-1].content.split("Follow Up")[0]
+            tariff = "Y" if history.rfind("тариф Y") > history.rfind("тариф X") else "X"
+            return f"сколько стоит тариф {tariff}"
+
+    calls = []
+
+    class Answer(FakeListChatModel):
+        def _call(self, messages, stop=None, run_manager=None, **kwargs):
+            question = messages[-1].content.split("Question:")[-1].strip().splitlines()[0]
+            calls.append(question)
+            return f"ответ: {question}"
+
+        async def _acall(self, *args, **kwargs):
+            await asyncio.sleep(0.01)
+            return self._call(*args, **kwargs)
+
+    chain = ConversationalRetrievalChain.from_llm(
+        llm=Answer(responses=["-"], tags=[P.ANSWER_TAG]),
+        condense_question_llm=Condense(responses=["-"]),
+        retriever=Retriever(),
+        return_source_documents=True,
+        output_key="answer",
+    )
+    monkeypatch.setattr(P, "answer_cache", _cache())
+    monkeypatch.setattr(P, "history_store", HistoryStore(100, 1000, 3600))
+    monkeypatch.setattr(P, "inflight", SingleFlight())
+    monkeypatch.setattr(P, "_chains", {"s": chain})
+    monkeypatch.setattr(P, "_shards", {})
+    monkeypatch.setattr(P, "get_rag_chain", lambda source: chain)
+    monkeypatch.setattr(P, "answer_calls", calls, raising=False)
+    return P
+
+
+def test_follow_ups_are_cached_per_condensed_question(pipeline):
+    P = pipeline
+    P.get_answer(1, "тариф X", "s")
+    P.get_answer(2, "тариф Y", "s")
+    assert P.get_answer(1, "а сколько он стоит?", "s") == "ответ: сколько стоит тариф X"
+    # тот же текст у другого пользователя — другой самостоятельный вопрос
+    assert P.get_answer(2, "а сколько он стоит?", "s") == "ответ: сколько стоит тариф Y"
+    assert len(P.answer_calls) == 4
+
+
+def test_returning_user_hits_cache(pipeline):
+    P = pipeline
+    P.get_answer(1, "тариф X", "s")
+    P.get_answer(1, "сколько он стоит?", "s")
+    calls = len(P.answer_calls)
+    # у пользователя 3 уже есть история, но вопрос сводится к закэшированному
+    P.get_answer(3, "тариф X", "s")
+    assert P.get_answer(3, "а он почём?", "s") == "ответ: сколько стоит тариф X"
+    assert len(P.answer_calls) == calls
+    # в историю пишется исходная формулировка
+    assert P.history_store.get(3, "s")[-1][0] == "а он почём?"
+
+
+def test_refresh_invalidates_cached_answers(pipeline, monkeypatch):
+    P = pipeline
+    monkeypatch.setattr(P, "update_shard", lambda source: object())
+    P.get_answer(1, "тариф X", "s")
+    assert P.answer_cache.lookup("s", "тариф X") is not None
+    P.refresh_chain("s")
+    assert P.answer_cache.lookup("s", "тариф X") is None
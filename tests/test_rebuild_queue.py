@@ -0,0 +1,115 @@
+# tests/test_rebuild_queue.py
+import asyncio
+import threading
+
+from rag import rebuild
+from rag.rebuild import RebuildQueue
+
+
+def _fake_refresh(monkeypatch, fail=()):
+    built = []
+    lock = threading.Lock()
+
+    def refresh_chain(source):
+        with lock:
+            built.append(source)
+        if source in fail:
+            raise RuntimeError("нет данных")
+
+    monkeypatch.setattr(rebuild, "refresh_chain", refresh_chain)
+    return built
+
+
+async def _drain(queue: RebuildQueue, timeout: float = 2.0) -> None:
+    """Ждём, пока воркер разберёт все заявки."""
+    async def idle():
+        while queue._pending or queue.current or queue._wakeup.is_set():
+            await asyncio.sleep(0.01)
+    await asyncio.wait_for(idle(), timeout)
+
+
+def test_burst_is_merged_into_one_build_per_source(monkeypatch):
+    built = _fake_refresh(monkeypatch)
+
+    async def main():
+        queue = RebuildQueue(debounce=0.05)
+        accepted = [queue.request("a"), queue.request("b"), queue.request("a"), queue.request("a")]
+        await _drain(queue)
+        queue._task.cancel()
+        return queue, accepted
+
+    queue, accepted = asyncio.run(main())
+    assert accepted == [True, True, False, False]
+    assert sorted(built) == ["a", "b"]
+    assert queue.builds == 2
+    assert queue.last_error is None
+    assert queue.status()["pending"] == []
+
+
+def test_request_during_build_triggers_one_more_build(monkeypatch):
+    built = _fake_refresh(monkeypatch)
+
+    async def main():
+        queue = RebuildQueue(debounce=0.02)
+        queue.request("a")
+        await asyncio.sleep(0.03)          # первая сборка уже забрала пачку
+        queue.request("a")
+        queue.request("a")
+        await asyncio.sleep(0.01)
+        await _drain(queue)
+        queue._task.cancel()
+
+    asyncio.run(main())
+    assert built == ["a", "a"]
+
+
+def test_every_merged_requester_is_notified(monkeypatch):
+    _fake_refresh(monkeypatch)
+    messages = {1: [], 2: []}
+
+    def notifier(chat):
+        async def notify(text):
+            messages[chat].append(text)
+        return notify
+
+    async def main():
+        queue = RebuildQueue(debounce=0.02)
+        queue.request("a", notifier(1))
+        queue.request("a", notifier(2))
+        await _drain(queue)
+        queue._task.cancel()
+
+    asyncio.run(main())
+    for texts in messages.values():
+        assert len(texts) == 2
+        assert texts[0].startswith("🔄") and "«a»" in texts[0]
+        assert texts[1].startswith("✅")
+
+
+def test_failure_is_reported_and_does_not_stop_worker(monkeypatch):
+    built = _fake_refresh(monkeypatch, fail={"bad"})
+    messages = []
+
+    async def notify(text):
+        messages.append(text)
+
+    async def broken_notify(text):
+        raise ConnectionError("чат недоступен")
+
+    async def main():
+        queue = RebuildQueue(debounce=0.02)
+        queue.request("bad", notify)
+        queue.request("bad", broken_notify)
+        await _drain(queue)
+        failed = queue.status()
+        queue.request("good")
+        await _drain(queue)
+        queue._task.cancel()
+        return failed, queue
+
+    failed, queue = asyncio.run(main())
+    assert failed["last_error"] == "bad: нет данных"
+    assert failed["builds"] == 0
+    assert messages[-1].startswith("❌")
+    assert built == ["bad", "good"]
+    assert queue.builds == 1 and queue.last_error is None
@@ -0,0 +1,146 @@
+# tests/test_shard_sync.py
+import gc
+import hashlib
+import sqlite3
+
+import pytest
+from langchain_core.embeddings import Embeddings
+
+from rag import embeddings as E
+from rag import vectorestore as V
+from rag.embeddings import CachedEmbeddings
+
+
+class CountingEmbeddings(Embeddings):
+    """Детерминированные векторы из хэша текста; считает, что ушло «в API»."""
+
+    def __init__(self):
+        self.texts = []
+
+    def _vector(self, text):
+        digest = hashlib.sha256(text.encode("utf-8")).digest()
+        return [b / 255 for b in digest[:8]]
+
+    def embed_documents(self, texts):
+        self.texts.extend(texts)
+        return [self._vector(t) for t in texts]
+
+    def embed_query(self, text):
+        return self._vector(text)
+
+
+@pytest.fixture(params=["numpy", "chroma"])
+def shard_env(request, tmp_path, monkeypatch):
+    if request.param == "chroma":
+        pytest.importorskip("langchain_chroma")
+    db = tmp_path / "data.db"
+    conn = sqlite3.connect(db)
+    conn.execute("CREATE TABLE site_data (id INTEGER PRIMARY KEY, source TEXT, title TEXT, content TEXT)")
+    conn.commit()
+    conn.close()
+
+    inner = CountingEmbeddings()
+    monkeypatch.setattr(V, "DB_PATH", db)
+    monkeypatch.setattr(V, "BASE_DIR", tmp_path / "vectorstore")
+    monkeypatch.setattr(V, "VECTOR_BACKEND", request.param)
+    monkeypatch.setattr(V, "QUANTIZATION", "none")
+    monkeypatch.setattr(V, "INDEX_READ_ONLY", False)
+    monkeypatch.setattr(E, "_embeddings", CachedEmbeddings(inner, "test", tmp_path / "emb.db", 1000))
+
+    written = []
+    write_docs = V._write_docs
+
+    def spy(vs, docs):
+        written.append(len(docs))
+        write_docs(vs, docs)
+
+    monkeypatch.setattr(V, "_write_docs", spy)
+    yield db, inner, written
+    gc.collect()
+
+
+def _execute(db, sql, *params):
+    conn = sqlite3.connect(db)
+    conn.execute(sql, params)
+    conn.commit()
+    conn.close()
+
+
+def _ids(vs):
+    return sorted(vs.get(include=[])["ids"])
+
+
+def test_update_embeds_only_new_rows(shard_env):
+    db, inner, written = shard_env
+    _execute(db, "INSERT INTO site_data VALUES (1, 's', 't1', 'Тариф X стоит 100 рублей.')")
+    _execute(db, "INSERT INTO site_data VALUES (2, 's', 't2', 'Оплата картой или по счёту.')")
+
+    vs = V.build_shard("s")
+    assert written == [2]
+    assert len(_ids(vs)) == 2
+
+    _execute(db, "INSERT INTO site_data VALUES (3, 's', 't3', 'Поддержка работает круглосуточно.')")
+    vs = V.update_shard("s")
+    assert written == [2, 1]
+    assert [i.split(":")[0] for i in _ids(vs)] == ["1", "2", "3"]
+    assert len(inner.texts) == 3
+    assert V.load_lexical("s") is not None
+    assert V._read_manifest(V.current_version("s")) == V._manifest("s", V._load_rows("s"))
+
+
+def test_changed_and_deleted_rows_are_synced(shard_env):
+    db, inner, written = shard_env
+    _execute(db, "INSERT INTO site_data VALUES (1, 's', 't1', 'Старый текст.')")
+    _execute(db, "INSERT INTO site_data VALUES (2, 's', 't2', 'Без изменений.')")
+    V.build_shard("s")
+
+    _execute(db, "UPDATE site_data SET content = 'Новый текст.' WHERE id = 1")
+    _execute(db, "DELETE FROM site_data WHERE id = 2")
+    vs = V.update_shard("s")
+
+    digest = hashlib.sha1("Новый текст.".encode("utf-8")).hexdigest()
+    assert _ids(vs) == [f"1:0:{digest}"]
+    assert written == [2, 1]
+
+
+def test_unchanged_data_reopens_without_embedding(shard_env):
+    db, inner, written = shard_env
+    _execute(db, "INSERT INTO site_data VALUES (1, 's', 't1', 'Текст.')")
+    V.build_shard("s")
+    version = V.current_version("s")
+
+    vs = V.open_shard("s")
+    assert V.current_version("s") == version
+    assert written == [1]
+    assert len(_ids(vs)) == 1
+
+
+def test_source_without_rows_is_dropped(shard_env):
+    db, inner, written = shard_env
+    _execute(db, "INSERT INTO site_data VALUES (1, 's', 't1', 'Текст.')")
+    _execute(db, "INSERT INTO site_data VALUES (2, 'other', 't', 'Другой сервис.')")
+    V.build_shard("s")
+    V.build_shard("other")
+
+    _execute(db, "DELETE FROM site_data WHERE source = 's'")
+    assert V.update_shard("s") is None
+    assert V.current_version("s") is None
+    assert V.current_version("other") is not None
+
+
+def test_retired_version_is_removed_once_unused(shard_env):
+    db, inner, written = shard_env
+    _execute(db, "INSERT INTO site_data VALUES (1, 's', 't1', 'Текст.')")
+    reader = V.build_shard("s")              # старую версию ещё читают
+    first = V.current_version("s")
+
+    for row_id in range(2, 2 + V.KEEP_VERSIONS):
+        _execute(db, "INSERT INTO site_data VALUES (?, 's', 't', ?)", row_id, f"Текст {row_id}.")
+        vs = V.update_shard("s")
+        gc.collect()
+    assert first.exists()                    # вышла за KEEP_VERSIONS, но открыта
+
+    del reader
+    gc.collect()
+    assert not first.exists()
+    assert len(_ids(vs)) == 1 + V.KEEP_VERSIONS
@@ -0,0 +1,155 @@
+# tests/test_singleflight.py
+import asyncio
+
+import pytest
+
+from rag.singleflight import SingleFlight, flight_key
+
+
+def test_flight_key_normalizes_question():
+    assert flight_key("s", "Как оплатить?") == flight_key("s", "как  оплатить")
+    assert flight_key("a", "q") != flight_key("b", "q")
+
+
+def test_concurrent_calls_share_one_computation():
+    flight = SingleFlight()
+    runs = []
+
+    async def compute():
+        runs.append(1)
+        await asyncio.sleep(0.01)
+        return "ответ"
+
+    async def main():
+        return await asyncio.gather(*(flight.call("k", compute) for _ in range(5)))
+
+    results = asyncio.run(main())
+    assert [r for r, _ in results] == ["ответ"] * 5
+    assert sorted(shared for _, shared in results) == [False] + [True] * 4
+    assert len(runs) == 1
+    assert flight.stats() == {"leaders": 1, "collapsed": 4, "collapse_rate": 0.8, "in_flight": 0}
+
+
+def test_sequential_calls_are_not_shared():
+    flight = SingleFlight()
+
+    async def compute():
+        return 1
+
+    async def main():
+        await flight.call("k", compute)
+        return await flight.call("k", compute)
+
+    assert asyncio.run(main()) == (1, False)
+    assert flight.stats()["leaders"] == 2
+
+
+def test_error_reaches_every_waiter():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("LLM недоступна")
+
+    async def main():
+        return await asyncio.gather(*(flight.call("k", compute) for _ in range(3)),
+                                    return_exceptions=True)
+
+    results = asyncio.run(main())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_cancelled_leader_does_not_cancel_joiners():
+    flight = SingleFlight()
+
+    async def compute():
+        await asyncio.sleep(0.05)
+        return "ответ"
+
+    async def main():
+        leader = asyncio.create_task(flight.call("k", compute))
+        await asyncio.sleep(0)
+        joiner = asyncio.create_task(flight.call("k", compute))
+        await asyncio.sleep(0)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return await joiner
+
+    assert asyncio.run(main()) == ("ответ", True)
+
+
+def test_stream_replays_events_to_late_subscriber():
+    flight = SingleFlight()
+
+    async def produce():
+        for token in ("а", "б", "в"):
+            yield {"token": token}
+            await asyncio.sleep(0.01)
+        yield {"answer": "абв"}
+
+    async def consume(stream):
+        return [event async for event in stream]
+
+    async def main():
+        first, shared_first = flight.stream("k", produce)
+        first_task = asyncio.create_task(consume(first))
+        await asyncio.sleep(0.015)                  # часть токенов уже отдана
+        second, shared_second = flight.stream("k", produce)
+        return await first_task, await consume(second), shared_first, shared_second
+
+    first, second, shared_first, shared_second = asyncio.run(main())
+    assert first == second == [{"token": "а"}, {"token": "б"}, {"token": "в"}, {"answer": "абв"}]
+    assert (shared_first, shared_second) == (False, True)
+    assert flight.stats()["in_flight"] == 0
+
+
+def test_stream_error_is_raised_to_subscribers():
+    flight = SingleFlight()
+
+    async def produce():
+        yield {"token": "а"}
+        raise RuntimeError("обрыв")
+
+    async def main():
+        stream, _ = flight.stream("k", produce)
+        return [event async for event in stream]
+
+    with pytest.raises(RuntimeError, match="обрыв"):
+        asyncio.run(main())
+
+
+def test_pipeline_coalesces_users_with_history(monkeypatch):
+    """Пять пользователей с историей и одним и тем же уточнением — один ответ LLM."""
+    from rag import pipeline as P
+    from rag.answer_cache import AnswerCache
+    from rag.history import HistoryStore
+
+    calls = []
+
+    async def standalone(user_id, question, source):
+        return "сколько стоит тариф X"
+
+    async def answer(user_id, question, standalone_question, source):
+        calls.append(standalone_question)
+        await asyncio.sleep(0.02)
+        P._remember(user_id, source, question, standalone_question,
+                    {"answer": "100 ₽", "source_documents": [object()]})
+        return "100 ₽"
+
+    history = HistoryStore(100, 1000, 3600)
+    for user_id in range(5):
+        history.append(user_id, "s", "тариф X", "…")
+    monkeypatch.setattr(P, "history_store", history)
+    monkeypatch.setattr(P, "answer_cache", AnswerCache(100, 60, 0))
+    monkeypatch.setattr(P, "inflight", SingleFlight())
+    monkeypatch.setattr(P, "_astandalone", standalone)
+    monkeypatch.setattr(P, "_aget_answer", answer)
+
+    async def main():
+        return await asyncio.gather(*(P.aget_answer(u, "а он сколько стоит?", "s") for u in range(5)))
+
+    assert asyncio.run(main()) == ["100 ₽"] * 5
+    assert calls == ["сколько стоит тариф X"]
+    assert all(history.get(u, "s")[-1] == ("а он сколько стоит?", "100 ₽") for u in range(5))
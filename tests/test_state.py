@@ -0,0 +1,118 @@
+# tests/test_state.py
+import asyncio
+
+import pytest
+
+from bot import state as state_mod
+
+LIMIT = 3
+
+
+def _make(backend, tmp_path):
+    if backend == "memory":
+        return state_mod.MemoryState()
+    if backend == "sqlite":
+        return state_mod.SQLiteState(str(tmp_path / "state.db"), flush_interval=0.05)
+    fakeredis = pytest.importorskip("fakeredis")
+    return state_mod.RedisState(client=fakeredis.FakeAsyncRedis(decode_responses=True))
+
+
+def _run(backend, tmp_path, scenario):
+    async def main():
+        st = _make(backend, tmp_path)
+        await st.open()
+        try:
+            return await scenario(st)
+        finally:
+            await st.close()
+    return asyncio.run(main())
+
+
+@pytest.fixture(params=["memory", "sqlite", "redis"])
+def backend(request):
+    return request.param
+
+
+def test_concurrent_questions_respect_quota(backend, tmp_path):
+    async def scenario(st):
+        return await asyncio.gather(*(st.take_quota(1, LIMIT) for _ in range(10)))
+
+    taken = _run(backend, tmp_path, scenario)
+    assert sorted(n for n in taken if n is not None) == [1, 2, 3]
+    assert taken.count(None) == 7
+
+
+def test_rejection_does_not_advance_counter(backend, tmp_path):
+    async def scenario(st):
+        for _ in range(LIMIT + 5):
+            await st.take_quota(1, LIMIT)
+        return await st.take_quota(1, LIMIT + 1), await st.take_quota(2, LIMIT)
+
+    assert _run(backend, tmp_path, scenario) == (LIMIT + 1, 1)
+
+
+def test_quota_resets_next_day(backend, tmp_path, monkeypatch):
+    async def scenario(st):
+        for _ in range(LIMIT):
+            await st.take_quota(1, LIMIT)
+        exhausted = await st.take_quota(1, LIMIT)
+        monkeypatch.setattr(state_mod, "_today", lambda: 20_000)
+        return exhausted, await st.take_quota(1, LIMIT)
+
+    assert _run(backend, tmp_path, scenario) == (None, 1)
+
+
+def test_source_and_support_flags(backend, tmp_path):
+    async def scenario(st):
+        await st.set_source(1, "сервис")
+        await st.support_enter(1)
+        entered = await st.support_active(1), await st.support_active(2)
+        await st.support_leave(1)
+        return (await st.get_source(1), await st.get_source(2),
+                entered, await st.support_active(1))
+
+    assert _run(backend, tmp_path, scenario) == ("сервис", None, (True, False), False)
+
+
+def test_memory_state_is_bounded():
+    async def scenario():
+        st = state_mod.MemoryState(max_users=2)
+        for user_id in (1, 2, 3):
+            await st.set_source(user_id, "s")
+        return await st.get_source(1), await st.get_source(3)
+
+    assert asyncio.run(scenario()) == (None, "s")
+
+
+def test_sqlite_state_survives_restart_and_eviction(tmp_path):
+    path = str(tmp_path / "state.db")
+
+    async def scenario():
+        st = state_mod.SQLiteState(path, max_users=1, flush_interval=60)
+        await st.open()
+        await st.set_source(1, "a")
+        await st.take_quota(1, LIMIT)
+        await st.set_source(2, "b")          # вытесняет пользователя 1 до записи
+        evicted = await st.get_source(1)
+        await st.close()                     # close() дописывает остаток
+
+        st = state_mod.SQLiteState(path, max_users=1, flush_interval=60)
+        await st.open()
+        try:
+            return evicted, await st.get_source(1), await st.get_source(2), await st.take_quota(1, LIMIT)
+        finally:
+            await st.close()
+
+    assert asyncio.run(scenario()) == ("a", "a", "b", 2)
+
+
+def test_redis_quota_key_expires(tmp_path):
+    fakeredis = pytest.importorskip("fakeredis")
+    client = fakeredis.FakeAsyncRedis(decode_responses=True)
+
+    async def scenario():
+        st = state_mod.RedisState(client=client)
+        await st.take_quota(1, LIMIT)
+        return await client.ttl(f"quota:1:{state_mod._today()}")
+
+    assert 0 < asyncio.run(scenario()) <= 2 * 24 * 60 * 60